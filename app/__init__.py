@@ -0,0 +1,5 @@
+from dotenv import load_dotenv
+
+# Settings are read from the environment when each module is imported, so a .env file is
+# loaded once, before any of them
+load_dotenv()
@@ -1,54 +1,397 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy import text
+import asyncio
+import itertools
+import logging
 import os
-from dotenv import load_dotenv
+import time
+from functools import cached_property
+from typing import List, Optional
+from fastapi import Request
+from prometheus_client import Gauge, Histogram
 
-# Load environment variables from .env file
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # Database URL from environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Comma-separated read replica URLs; read-only routes use them when set
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# "round_robin" or "least_connections"
+DB_REPLICA_SELECTION = os.getenv("DB_REPLICA_SELECTION", "round_robin")
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+DB_REPLICA_CHECK_TIMEOUT = float(os.getenv("DB_REPLICA_CHECK_TIMEOUT", "2"))
+# A replica further behind the primary than this is treated as unhealthy; 0 disables the check
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "10"))
 
-# Create an asynchronous engine for database operations
-# The engine is the source of database connectivity and behavior.
-# echo=True will log all SQL statements.
-engine = create_async_engine(DATABASE_URL, echo=True, pool_pre_ping=True)
+# Engine profiles. DB_PROFILE picks one and any DB_* variable below overrides a single setting.
+# "dev" logs every SQL statement; "prod" is quiet and sized for real traffic. pool_prewarm
+# connections per engine are opened at startup, before the worker reports ready.
+ENGINE_PROFILES = {
+    "dev": {
+        "echo": True,
+        "pool_size": 5,
+        "max_overflow": 5,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "statement_cache_size": 100,
+        "pool_prewarm": 1,
+    },
+    "prod": {
+        "echo": False,
+        "pool_size": 20,
+        "max_overflow": 10,
+        "pool_timeout": 10,
+        "pool_recycle": 1800,
+        "statement_cache_size": 500,
+        "pool_prewarm": 10,
+    },
+}
 
-# Create a configured "Session" class.
-# This is the factory for creating new Session objects.
+DB_PROFILE = os.getenv("DB_PROFILE", "dev")
+
+
+def _engine_settings(profile: str) -> dict:
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE: {profile}")
+    settings = dict(ENGINE_PROFILES[profile])
+    if os.getenv("DB_ECHO") is not None:
+        settings["echo"] = os.getenv("DB_ECHO").lower() == "true"
+    for key, env in (("pool_size", "DB_POOL_SIZE"), ("max_overflow", "DB_MAX_OVERFLOW"),
+                     ("pool_timeout", "DB_POOL_TIMEOUT"), ("pool_recycle", "DB_POOL_RECYCLE"),
+                     ("statement_cache_size", "DB_STATEMENT_CACHE_SIZE"), ("pool_prewarm", "DB_POOL_PREWARM")):
+        if os.getenv(env) is not None:
+            settings[key] = int(os.getenv(env))
+    return settings
+
+
+ENGINE_SETTINGS = _engine_settings(DB_PROFILE)
+DB_POOL_PREWARM_TIMEOUT = float(os.getenv("DB_POOL_PREWARM_TIMEOUT", "10"))
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out of the pool")
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections open beyond pool_size")
+DB_POOL_SIZE = Gauge("db_pool_size", "Configured pool size")
+DB_REPLICA_HEALTHY = Gauge("db_replica_healthy", "Whether a read replica is taking reads", ["replica"])
+DB_REPLICA_LAG = Gauge("db_replica_lag_seconds", "Replication lag seen by the last health check", ["replica"])
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waited for a connection.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+def create_engine_from_settings(url: str, settings: dict):
+    """
+    Creates an async engine for the given URL using a profile's settings.
+    """
+    return create_async_engine(
+        url,
+        echo=settings["echo"],
+        pool_pre_ping=True,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings["pool_size"],
+        max_overflow=settings["max_overflow"],
+        pool_timeout=settings["pool_timeout"],
+        pool_recycle=settings["pool_recycle"],
+        # asyncpg prepared statement cache, per connection
+        connect_args={"prepared_statement_cache_size": settings["statement_cache_size"]},
+    )
+
+
+_engine = None
+
+
+def get_engine():
+    """
+    Returns the primary's engine, creating it on first use. Creating it loads the asyncpg
+    dialect but opens no connection; `engine` at module level resolves to the same object.
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_engine_from_settings(DATABASE_URL, ENGINE_SETTINGS)
+    return _engine
+
+
+def __getattr__(name):
+    # `from app.db.database import engine` keeps working without creating it at import time
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+async def dispose_engine():
+    """
+    Closes every pooled connection of the primary's engine, if it was ever created.
+    """
+    if _engine is not None:
+        await _engine.dispose()
+
+
+async def warm_pool(engine, connections: int, timeout: float = DB_POOL_PREWARM_TIMEOUT) -> int:
+    """
+    Opens up to `connections` connections at once and returns them to the pool, so the first
+    requests do not pay for the TCP, TLS and authentication round trips. Capped at the
+    pool size, since overflow connections are closed on return. Returns how many opened;
+    failures are logged, not raised, so a worker can start while the database is down.
+    """
+    connections = min(connections, engine.pool.size())
+    if connections <= 0:
+        return 0
+    tasks = [asyncio.ensure_future(engine.connect().start()) for _ in range(connections)]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    opened = 0
+    for task in done:
+        if task.exception() is not None:
+            logger.warning("Could not open a pool connection at startup: %r", task.exception())
+            continue
+        await task.result().close()
+        opened += 1
+    if pending:
+        logger.warning("Pool warm-up timed out after %.1fs with %d of %d connections open",
+                       timeout, opened, connections)
+    return opened
+
+
+DB_POOL_SIZE.set(ENGINE_SETTINGS["pool_size"])
+DB_POOL_CHECKED_OUT.set_function(lambda: _engine.pool.checkedout() if _engine is not None else 0)
+DB_POOL_OVERFLOW.set_function(lambda: max(_engine.pool.overflow(), 0) if _engine is not None else 0)
+
+# A base class for declarative class definitions.
+Base = declarative_base()
+
+# Replication lag in seconds; 0 on a primary, or on a replica that has replayed all it received
+REPLICA_LAG = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    """
+    A read replica with its own engine and pool.
+    """
+
+    def __init__(self, url: str, settings: dict):
+        parsed = make_url(url)
+        self.name = f"{parsed.host}:{parsed.port or 5432}/{parsed.database}"
+        self.url = url
+        self.settings = settings
+        self.healthy = True
+        self.lag = 0.0
+        DB_REPLICA_HEALTHY.labels(replica=self.name).set(1)
+
+    @cached_property
+    def engine(self):
+        # Created on first use, like the primary's
+        return create_engine_from_settings(self.url, self.settings)
+
+    async def dispose(self):
+        if "engine" in self.__dict__:
+            await self.engine.dispose()
+
+
+class ReplicaRouter:
+    """
+    Picks the replica for each read session, round-robin or by fewest checked-out
+    connections, among the replicas that passed their last health check. A background
+    task re-checks every replica every DB_REPLICA_CHECK_INTERVAL seconds; a replica that
+    fails a check, lags by more than DB_REPLICA_MAX_LAG_SECONDS or drops a connection
+    mid-request gets no reads until it passes a check again. With no healthy replica,
+    reads go to the primary.
+    """
+
+    def __init__(self, replicas: List[Replica], selection: str = DB_REPLICA_SELECTION,
+                 check_interval: float = DB_REPLICA_CHECK_INTERVAL, max_lag: float = DB_REPLICA_MAX_LAG_SECONDS):
+        if selection not in ("round_robin", "least_connections"):
+            raise ValueError(f"Unknown DB_REPLICA_SELECTION: {selection}")
+        self.replicas = replicas
+        self.selection = selection
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._turn = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    def choose(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if self.selection == "least_connections":
+            return min(healthy, key=lambda replica: replica.engine.pool.checkedout())
+        return healthy[next(self._turn) % len(healthy)]
+
+    def mark_down(self, replica: Replica, reason: str):
+        if replica.healthy:
+            logger.warning("Read replica %s taken out of rotation: %s", replica.name, reason)
+        replica.healthy = False
+        DB_REPLICA_HEALTHY.labels(replica=replica.name).set(0)
+
+    async def check(self, replica: Replica):
+        try:
+            async with replica.engine.connect() as connection:
+                lag = float(await asyncio.wait_for(connection.scalar(REPLICA_LAG), timeout=DB_REPLICA_CHECK_TIMEOUT))
+        except Exception as e:
+            self.mark_down(replica, repr(e))
+            return
+        replica.lag = lag
+        DB_REPLICA_LAG.labels(replica=replica.name).set(lag)
+        if self.max_lag and lag > self.max_lag:
+            self.mark_down(replica, f"{lag:.1f}s behind the primary")
+        elif not replica.healthy:
+            logger.info("Read replica %s back in rotation", replica.name)
+            replica.healthy = True
+            DB_REPLICA_HEALTHY.labels(replica=replica.name).set(1)
+
+    def start(self):
+        if self.replicas and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+            await asyncio.sleep(self.check_interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for replica in self.replicas:
+            await replica.dispose()
+
+
+replica_router = ReplicaRouter([Replica(url, ENGINE_SETTINGS) for url in DATABASE_REPLICA_URLS])
+
+
+class RequestRoute:
+    """
+    Where one request's read sessions run: its replica, or the primary once the request
+    has also asked for a write session.
+    """
+
+    __slots__ = ("replica", "primary")
+
+    def __init__(self, replica: Optional[Replica]):
+        self.replica = replica
+        self.primary = False
+
+
+class RoutingSession(Session):
+    """
+    Session that sends every statement to its request's replica, or to the primary when
+    the request has no replica or also writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        route = self.info.get("route")
+        if route is not None and route.replica is not None and not route.primary:
+            return route.replica.engine.sync_engine
+        return get_engine().sync_engine
+
+
+# Session factories. Sessions resolve their engine per statement through
+# RoutingSession.get_bind, so neither factory needs the engine to exist yet; sessions from
+# SessionLocal carry no route and always use the primary.
 SessionLocal = async_sessionmaker(
+    sync_session_class=RoutingSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+ReadSessionLocal = async_sessionmaker(
+    sync_session_class=RoutingSession,
     autocommit=False,
     autoflush=False,
-    bind=engine,
     expire_on_commit=False,
 )
 
-# A base class for declarative class definitions.
-Base = declarative_base()
 
-# Dependency to get a database session.
-# This will create a new session for each request and close it when the request is finished.
-# This is the recommended way to handle sessions in FastAPI.
-async def get_db():
+def _request_route(request: Request) -> RequestRoute:
+    route = getattr(request.state, "db_route", None)
+    if route is None:
+        route = request.state.db_route = RequestRoute(replica_router.choose())
+    return route
+
+
+def route_to_primary(session) -> bool:
     """
-    Dependency that provides a database session to the route.
-    Ensures that the session is always closed after the request is finished.
+    Sends a read session's further statements to the primary, e.g. to re-check a row
+    that a lagging replica may not have yet. Returns False if they already went there.
     """
+    route = session.info.get("route")
+    if route is None or route.replica is None or route.primary:
+        return False
+    route.primary = True
+    return True
+
+
+# Dependencies to get a database session.
+# Each creates a new session for the request and closes it when the request is finished.
+async def get_write_db(request: Request):
+    """
+    Dependency that provides a session on the primary. Any read session of the same
+    request is routed to the primary as well, so its reads see this session's writes.
+    """
+    _request_route(request).primary = True
     async with SessionLocal() as session:
         try:
             yield session
         finally:
             await session.close()
 
-async def check_db_connection():
+# Routes that have not been sorted into readers and writers keep using the primary
+get_db = get_write_db
+
+async def get_read_db(request: Request):
+    """
+    Dependency that provides a session for read-only routes, on a healthy replica when
+    replicas are configured. Replicas lag the primary, so a read may not yet see a write
+    committed by an earlier request (by at most DB_REPLICA_MAX_LAG_SECONDS).
+    """
+    route = _request_route(request)
+    async with ReadSessionLocal(info={"route": route}) as session:
+        try:
+            yield session
+        except (OSError, asyncio.TimeoutError, DBAPIError) as e:
+            # The request still fails, but later ones are sent elsewhere until the replica recovers
+            lost = not isinstance(e, DBAPIError) or e.connection_invalidated
+            if lost and route.replica is not None and not route.primary:
+                replica_router.mark_down(route.replica, repr(e))
+            raise
+        finally:
+            await session.close()
+
+async def check_db_connection(timeout: float = 2.0):
     """
     Checks if a connection to the database can be established.
     Returns True if the connection is successful, False otherwise.
     """
-    try:
-        async with engine.connect() as connection:
+    async def ping():
+        async with get_engine().connect() as connection:
             await connection.execute(text("SELECT 1"))
+
+    try:
+        await asyncio.wait_for(ping(), timeout=timeout)
         return True
     except Exception:
         return False
@@ -57,4 +400,14 @@ def get_pool_status():
     """
     Returns the status of the connection pool.
     """
-    return engine.pool.status()
\ No newline at end of file
+    return get_engine().pool.status()
+
+def get_replica_status():
+    """
+    Returns the health, lag and pool status of each read replica.
+    """
+    return [
+        {"replica": replica.name, "healthy": replica.healthy, "lag_seconds": replica.lag,
+         "pool": replica.engine.pool.status()}
+        for replica in replica_router.replicas
+    ]
@@ -1,8 +1,9 @@
 import uuid
 from datetime import datetime, timezone
-from sqlalchemy import Column, UUID, VARCHAR, TIMESTAMP, TEXT, BOOLEAN, ForeignKey
+from sqlalchemy import Column, UUID, VARCHAR, TIMESTAMP, TEXT, BOOLEAN, BIGINT, INTEGER, SMALLINT, CHAR, DATE, LargeBinary, ForeignKey, Index, CheckConstraint, UniqueConstraint, Computed, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
@@ -70,6 +71,16 @@ class User(Base):
         comment="Last profile update time"
     )
 
+    tokens_not_before = Column(
+        TIMESTAMP(timezone=True),
+        nullable=True,
+        comment="Access tokens issued before this are rejected (password change, sign out everywhere)"
+    )
+
+    __table_args__ = (
+        Index('ix_users_tokens_not_before', 'tokens_not_before', postgresql_where=text('tokens_not_before IS NOT NULL')),
+    )
+
     def __repr__(self):
         return f"<User(username={self.username}, email={self.email})>"
         
@@ -82,7 +93,7 @@ class RefreshToken(Base):
     __tablename__ = 'refresh_tokens'
     token_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False, comment="Unique token identifier")
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), nullable=False, comment="Owner user ID")
-    token = Column(TEXT, nullable=False, comment="Refresh token string")
+    token_hash = Column(LargeBinary(32), nullable=False, comment="SHA-256 digest of the refresh token")
     expires_at = Column(TIMESTAMP(timezone=True), nullable=False, comment="Token expiry timestamp")
     revoked = Column(BOOLEAN, nullable=False, default=False, comment="Revocation status")
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="Creation time")
@@ -90,6 +101,24 @@ class RefreshToken(Base):
 
     user = relationship("User", backref="refresh_tokens")
 
+    __table_args__ = (
+        Index('ux_refresh_tokens_token_hash', 'token_hash', unique=True),
+        Index('ix_refresh_tokens_revoked_updated_at', 'updated_at', postgresql_where=text('revoked = true')),
+        Index('ix_refresh_tokens_user_active', 'user_id', 'expires_at', postgresql_where=text('revoked = false')),
+        Index('ix_refresh_tokens_expires_at', 'expires_at'),
+    )
+
+class RevokedAccessToken(Base):
+    __tablename__ = 'revoked_access_tokens'
+    token_hash = Column(LargeBinary(32), primary_key=True, nullable=False, comment="SHA-256 digest of the access token")
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, comment="When the token expires; the row can go after this")
+    revoked_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="Revocation time")
+
+    __table_args__ = (
+        Index('ix_revoked_access_tokens_revoked_at', 'revoked_at'),
+        Index('ix_revoked_access_tokens_expires_at', 'expires_at'),
+    )
+
 class FCMToken(Base):
     __tablename__ = 'fcm_tokens'
     fcm_token_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False, comment="Unique token identifier")
@@ -101,6 +130,11 @@ class FCMToken(Base):
 
     user = relationship("User", backref="fcm_tokens")
 
+    __table_args__ = (
+        Index('ix_fcm_tokens_user_id', 'user_id'),
+        Index('ix_fcm_tokens_token', 'token', postgresql_using='hash'),
+    )
+
 class BankAccount(Base):
     __tablename__ = 'bank_accounts'
     account_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False, comment="Unique bank account ID")
@@ -108,11 +142,18 @@ class BankAccount(Base):
     bank_name = Column(VARCHAR(100), nullable=False, comment="Bank name (e.g., SBI)")
     account_mask = Column(VARCHAR(20), nullable=False, comment="Masked account number (e.g., XXXX1234)")
     last_sync = Column(TIMESTAMP(timezone=True), nullable=True, comment="Last synchronization time date")
+    next_sync_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="When the account is next due for an Account Aggregator sync")
+    sync_failures = Column(INTEGER, nullable=False, default=0, server_default="0", comment="Consecutive failed syncs, for backoff")
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="Linked Creation time")
     updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now(), comment="Last update time")
 
     user = relationship("User", backref="bank_accounts")
 
+    __table_args__ = (
+        # Due accounts: next_sync_at <= now() ORDER BY next_sync_at
+        Index('ix_bank_accounts_next_sync_at', 'next_sync_at'),
+    )
+
 class OTPVerification(Base):
     __tablename__ = 'otp_verifications'
     otp_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False, comment="Unique OTP ID")
@@ -120,6 +161,178 @@ class OTPVerification(Base):
     otp_code = Column(VARCHAR(6), nullable=False, comment="One-time password code")
     expires_at = Column(TIMESTAMP(timezone=True), nullable=False, comment="OTP expiry timestamp")
     verified = Column(BOOLEAN, nullable=False, default=False, comment="Verification status")
+    attempts = Column(SMALLINT, nullable=False, default=0, server_default="0", comment="Wrong codes tried against this OTP")
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="Creation time")
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now(), comment="Last update time")
+    user = relationship("User", backref="otp_verifications")
+
+    __table_args__ = (
+        Index('ix_otp_verifications_user_pending', 'user_id', 'otp_code', 'expires_at', postgresql_where=text('verified = false')),
+        Index('ix_otp_verifications_expires_at', 'expires_at'),
+    )
+
+# 'simple' configuration: merchant and place names are not stemmed or stop-worded
+SEARCH_VECTOR_SQL = (
+    "to_tsvector('simple', coalesce(merchant, '') || ' ' || coalesce(upi_app, '') || ' ' || "
+    "coalesce(location, '') || ' ' || coalesce(description, ''))"
+)
+
+class Transaction(Base):
+    """
+    Ledger entry. The table is range-partitioned by month on occurred_at, so the primary key
+    has to include it. Amounts are integer minor units (paise for INR) to avoid float rounding.
+    """
+    __tablename__ = 'transactions'
+    transaction_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False, comment="Unique transaction ID")
+    occurred_at = Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False, comment="When the transaction happened (partition key)")
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), nullable=False, comment="Owner user ID")
+    account_id = Column(UUID(as_uuid=True), ForeignKey('bank_accounts.account_id'), nullable=True, comment="Bank account, if linked")
+    amount_minor = Column(BIGINT, nullable=False, comment="Amount in minor currency units (e.g. paise)")
+    currency = Column(CHAR(3), nullable=False, default="INR", server_default="INR", comment="ISO 4217 currency code")
+    direction = Column(VARCHAR(6), nullable=False, comment="debit or credit")
+    category = Column(VARCHAR(50), nullable=True, comment="Spending category")
+    merchant = Column(VARCHAR(150), nullable=True, comment="Merchant name")
+    upi_app = Column(VARCHAR(50), nullable=True, comment="UPI app used (e.g., GPay)")
+    location = Column(VARCHAR(150), nullable=True, comment="Where the transaction happened")
+    description = Column(TEXT, nullable=True, comment="Free-form note or bank narration")
+    fingerprint = Column(LargeBinary(16), nullable=True, comment="Digest of the source row, used to skip duplicates on re-import")
+    # Maintained by Postgres; deferred so listing transactions never loads it
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True), comment="Words of merchant, UPI app, location and description, for full-text search"))
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="Creation time")
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now(), comment="Last update time")
+
+    user = relationship("User", backref="transactions")
+    account = relationship("BankAccount", backref="transactions")
+
+    __table_args__ = (
+        CheckConstraint('amount_minor >= 0', name='ck_transactions_amount_non_negative'),
+        CheckConstraint("direction IN ('debit', 'credit')", name='ck_transactions_direction'),
+        # Keyset pagination: user_id = ? AND (occurred_at, transaction_id) < (?, ?) ORDER BY both DESC
+        Index('ix_transactions_user_occurred', 'user_id', text('occurred_at DESC'), text('transaction_id DESC')),
+        Index('ix_transactions_account_occurred', 'account_id', 'occurred_at'),
+        Index('ux_transactions_account_fingerprint', 'account_id', 'occurred_at', 'fingerprint', unique=True, postgresql_where=text('fingerprint IS NOT NULL')),
+        # Search: user_id = ? AND merchant/location ILIKE '%...%' (pg_trgm, with btree_gin for user_id)
+        Index('ix_transactions_user_merchant_trgm', 'user_id', 'merchant', postgresql_using='gin', postgresql_ops={'merchant': 'gin_trgm_ops'}),
+        Index('ix_transactions_user_location_trgm', 'user_id', 'location', postgresql_using='gin', postgresql_ops={'location': 'gin_trgm_ops'}),
+        Index('ix_transactions_user_search_vector', 'user_id', 'search_vector', postgresql_using='gin'),
+        {'postgresql_partition_by': 'RANGE (occurred_at)'},
+    )
+
+class Budget(Base):
+    __tablename__ = 'budgets'
+    budget_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False, comment="Unique budget ID")
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), nullable=False, comment="Owner user ID")
+    category = Column(VARCHAR(50), nullable=False, comment="Spending category the budget applies to")
+    amount_minor = Column(BIGINT, nullable=False, comment="Monthly limit in minor currency units")
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="Creation time")
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now(), comment="Last update time")
+
+    user = relationship("User", backref="budgets")
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'category', name='uq_budgets_user_category'),
+        CheckConstraint('amount_minor >= 0', name='ck_budgets_amount_non_negative'),
+    )
+
+class CategoryMonthlyRollup(Base):
+    """
+    Per user, month and category totals, kept in step with transactions in the same
+    database transaction so budget reads never have to SUM over the ledger.
+    """
+    __tablename__ = 'category_monthly_rollups'
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), primary_key=True, nullable=False, comment="Owner user ID")
+    month = Column(DATE, primary_key=True, nullable=False, comment="First day of the month")
+    category = Column(VARCHAR(50), primary_key=True, nullable=False, comment="Spending category ('' when uncategorized)")
+    debit_minor = Column(BIGINT, nullable=False, default=0, server_default="0", comment="Money out in minor currency units")
+    credit_minor = Column(BIGINT, nullable=False, default=0, server_default="0", comment="Money in in minor currency units")
+    txn_count = Column(INTEGER, nullable=False, default=0, server_default="0", comment="Number of transactions")
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now(), comment="Last update time")
+
+class Allocation(Base):
+    """
+    A user's Fixed, Spend and Save funds for one month: the rule each fund is filled by (a
+    share of income or a fixed amount), what the month-rollover job put in and the balance
+    that leaves. Rules carry over from the previous month's rows.
+    """
+    __tablename__ = 'allocations'
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), primary_key=True, nullable=False, comment="Owner user ID")
+    month = Column(DATE, primary_key=True, nullable=False, comment="First day of the month")
+    name = Column(VARCHAR(10), primary_key=True, nullable=False, comment="Fund: fixed, spend or save")
+    target_pct = Column(SMALLINT, nullable=True, comment="Share of the previous month's income, in percent")
+    target_amount_minor = Column(BIGINT, nullable=True, comment="Fixed monthly amount, used instead of target_pct when set")
+    funded_minor = Column(BIGINT, nullable=False, default=0, server_default="0", comment="Money put into the fund for the month")
+    balance_minor = Column(BIGINT, nullable=False, default=0, server_default="0", comment="Fund balance for the month after funding")
+    last_funded = Column(TIMESTAMP(timezone=True), nullable=True, comment="When the fund was last funded")
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="Creation time")
     updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now(), comment="Last update time")
-    user = relationship("User", backref="otp_verifications")
\ No newline at end of file
+
+    __table_args__ = (
+        CheckConstraint("name IN ('fixed', 'spend', 'save')", name='ck_allocations_name'),
+        CheckConstraint('target_pct BETWEEN 0 AND 100', name='ck_allocations_target_pct'),
+    )
+
+class JobCheckpoint(Base):
+    """
+    Progress of a resumable batch job, written in the same transaction as each chunk's
+    results so a restarted run continues after the last committed chunk.
+    """
+    __tablename__ = 'job_checkpoints'
+    job = Column(VARCHAR(100), primary_key=True, nullable=False, comment="Job and run name, e.g. allocation_rollover:2026-11")
+    last_key = Column(TEXT, nullable=True, comment="Last key processed, in the job's own ordering")
+    processed = Column(BIGINT, nullable=False, default=0, server_default="0", comment="Items processed so far")
+    started_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="When the run first started")
+    completed_at = Column(TIMESTAMP(timezone=True), nullable=True, comment="When the run finished")
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now(), comment="Last update time")
+
+class TransactionExport(Base):
+    """
+    An export too large to stream in a request, written to a file by the export worker.
+    Workers claim pending jobs (and running ones whose lease ran out) with SKIP LOCKED.
+    The row and its file are deleted once expires_at passes.
+    """
+    __tablename__ = 'transaction_exports'
+    export_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False, comment="Unique export ID")
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), nullable=False, comment="Owner user ID")
+    format = Column(VARCHAR(5), nullable=False, comment="csv, jsonl or xlsx")
+    since = Column(TIMESTAMP(timezone=True), nullable=True, comment="Earliest occurred_at exported, if limited")
+    until = Column(TIMESTAMP(timezone=True), nullable=True, comment="Exported transactions occurred before this, if limited")
+    status = Column(VARCHAR(10), nullable=False, default="pending", server_default="pending", comment="pending, running, done or failed")
+    attempts = Column(SMALLINT, nullable=False, default=0, server_default="0", comment="Times a worker has claimed the job")
+    lease_until = Column(TIMESTAMP(timezone=True), nullable=True, comment="A running job may be claimed again after this")
+    rows = Column(BIGINT, nullable=True, comment="Transactions written")
+    size_bytes = Column(BIGINT, nullable=True, comment="Size of the written file")
+    error = Column(TEXT, nullable=True, comment="Why the export failed")
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), comment="Creation time")
+    completed_at = Column(TIMESTAMP(timezone=True), nullable=True, comment="When the job finished or failed")
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=True, comment="When the file and this row are deleted")
+
+    __table_args__ = (
+        CheckConstraint("format IN ('csv', 'jsonl', 'xlsx')", name='ck_transaction_exports_format'),
+        CheckConstraint("status IN ('pending', 'running', 'done', 'failed')", name='ck_transaction_exports_status'),
+        Index('ix_transaction_exports_user_created', 'user_id', 'created_at'),
+        # Claiming: only unfinished jobs, oldest first
+        Index('ix_transaction_exports_unfinished', 'created_at', postgresql_where=text("status IN ('pending', 'running')")),
+        Index('ix_transaction_exports_expires', 'expires_at'),
+    )
+
+class AuditLog(Base):
+    """
+    Security and activity trail. Range-partitioned by month on occurred_at so old months are
+    dropped as whole partitions instead of deleted row by row. No foreign key to users: the
+    trail has to outlive the accounts it describes.
+    """
+    __tablename__ = 'audit_logs'
+    audit_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False, comment="Unique audit event ID")
+    occurred_at = Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False, comment="When the event happened (partition key)")
+    user_id = Column(UUID(as_uuid=True), nullable=True, comment="User the event concerns, if known")
+    action = Column(VARCHAR(50), nullable=False, comment="What happened (e.g. login, otp_verify)")
+    outcome = Column(VARCHAR(20), nullable=False, comment="success or failure")
+    ip_address = Column(VARCHAR(45), nullable=True, comment="Client IP address")
+    user_agent = Column(VARCHAR(255), nullable=True, comment="Client user agent")
+    details = Column(JSONB, nullable=True, comment="Event-specific context")
+
+    __table_args__ = (
+        Index('ix_audit_logs_user_occurred', 'user_id', text('occurred_at DESC')),
+        Index('ix_audit_logs_action_occurred', 'action', 'occurred_at'),
+        {'postgresql_partition_by': 'RANGE (occurred_at)'},
+    )
@@ -0,0 +1,113 @@
+import logging
+from datetime import date, datetime, timezone
+from typing import List
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    """
+    Returns the first day of the month `offset` months away from `day`.
+    """
+    index = day.year * 12 + (day.month - 1) + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def monthly_partition_ddl(table: str, start: date) -> str:
+    end = month_start(start, 1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {table}_{start:%Y_%m} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    )
+
+
+async def create_monthly_partition(conn, table: str, start: date) -> bool:
+    """
+    Creates the partition of `table` for the month starting on `start`, unless it exists.
+    Postgres refuses to create it while the default partition holds rows in its range, so
+    those rows are moved in: the default is detached, the partition created, the rows
+    moved across and the default attached again, all in the caller's transaction.
+    Returns whether the partition was created.
+    """
+    name = f"{table}_{start:%Y_%m}"
+    if await conn.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}):
+        return False
+    default = f"{table}_default"
+    bounds = {"start": start, "end": month_start(start, 1)}
+    in_range = "occurred_at >= :start AND occurred_at < :end"
+    stray = await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})"), bounds)
+    if not stray:
+        await conn.execute(text(monthly_partition_ddl(table, start)))
+        return True
+    # Generated columns are recomputed on insert and cannot be copied
+    columns = ", ".join(f'"{column}"' for column in (await conn.execute(
+        text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table AND is_generated = 'NEVER' "
+            "ORDER BY ordinal_position"
+        ),
+        {"table": table},
+    )).scalars())
+    await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    await conn.execute(text(monthly_partition_ddl(table, start)))
+    moved = await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING {columns}) "
+        f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved"
+    ), bounds)
+    await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    logger.info("Moved %d rows from %s into the new partition %s", moved.rowcount, default, name)
+    return True
+
+
+async def ensure_monthly_partitions(engine, table: str, months_ahead: int = 3) -> List[str]:
+    """
+    Creates the partitions for the current month and the next `months_ahead` months if they
+    are missing, so new rows never fall into the default partition. Each month runs in its
+    own transaction; a month that fails is logged and skipped until the next run.
+    Returns the names of the partitions created.
+    """
+    current = month_start(datetime.now(timezone.utc).date())
+    created = []
+    for i in range(months_ahead + 1):
+        start = month_start(current, i)
+        try:
+            async with engine.begin() as conn:
+                if await create_monthly_partition(conn, table, start):
+                    created.append(f"{table}_{start:%Y_%m}")
+        except Exception:
+            logger.exception("Could not create the %s partition for %s", table, f"{start:%Y-%m}")
+    return created
+
+
+async def drop_monthly_partitions_before(engine, table: str, cutoff: date) -> List[str]:
+    """
+    Drops the monthly partitions of `table` that end on or before `cutoff`, each in its own
+    transaction. The default partition is never touched. Returns the names of the dropped
+    partitions.
+    """
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST(:table AS regclass)"
+            ),
+            {"table": table},
+        )
+        names = result.scalars().all()
+    dropped = []
+    for name in names:
+        try:
+            start = datetime.strptime(name[len(table) + 1:], "%Y_%m").date()
+        except ValueError:
+            continue
+        if month_start(start, 1) <= cutoff:
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+            except Exception:
+                logger.exception("Could not drop the expired partition %s", name)
+                continue
+            dropped.append(name)
+    return dropped
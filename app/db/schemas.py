@@ -1,6 +1,7 @@
 import uuid
-from pydantic import BaseModel, EmailStr, constr
-from datetime import datetime
+from pydantic import BaseModel, EmailStr, conint, conlist, constr
+from datetime import date, datetime
+from typing import List, Literal, Optional
 
 class UserCreate(BaseModel):
     name: str
@@ -8,10 +9,28 @@ class UserCreate(BaseModel):
     phone: constr(min_length=10, max_length=20)
     password: str
 
+class UserBatchCreate(BaseModel):
+    users: conlist(UserCreate, min_length=1, max_length=1000)
+
+class UserBatchRow(BaseModel):
+    index: int
+    email: str
+    status: Literal["created", "conflict"]
+    user_id: Optional[uuid.UUID] = None
+    detail: Optional[str] = None
+
+class UserBatchResult(BaseModel):
+    created: int
+    conflicts: int
+    results: List[UserBatchRow]
+
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
 class UserOut(BaseModel):
     user_id: uuid.UUID
     name: str
@@ -21,4 +40,119 @@ class UserOut(BaseModel):
     updated_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class TransactionCreate(BaseModel):
+    account_id: Optional[uuid.UUID] = None
+    amount_minor: conint(ge=0)
+    currency: constr(min_length=3, max_length=3) = "INR"
+    direction: Literal["debit", "credit"]
+    occurred_at: datetime
+    category: Optional[constr(max_length=50)] = None
+    merchant: Optional[constr(max_length=150)] = None
+    upi_app: Optional[constr(max_length=50)] = None
+    location: Optional[constr(max_length=150)] = None
+    description: Optional[str] = None
+
+class TransactionUpdate(BaseModel):
+    amount_minor: Optional[conint(ge=0)] = None
+    direction: Optional[Literal["debit", "credit"]] = None
+    category: Optional[constr(max_length=50)] = None
+    merchant: Optional[constr(max_length=150)] = None
+    upi_app: Optional[constr(max_length=50)] = None
+    location: Optional[constr(max_length=150)] = None
+    description: Optional[str] = None
+
+class TransactionOut(BaseModel):
+    transaction_id: uuid.UUID
+    account_id: Optional[uuid.UUID] = None
+    amount_minor: int
+    currency: str
+    direction: str
+    occurred_at: datetime
+    category: Optional[str] = None
+    merchant: Optional[str] = None
+    upi_app: Optional[str] = None
+    location: Optional[str] = None
+    description: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class TransactionPage(BaseModel):
+    items: List[TransactionOut]
+    next_cursor: Optional[str] = None
+
+class MerchantSuggestion(BaseModel):
+    merchant: str
+    transactions: int
+
+class ExportJobOut(BaseModel):
+    export_id: uuid.UUID
+    format: str
+    status: str
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    rows: Optional[int] = None
+    size_bytes: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class BudgetSet(BaseModel):
+    amount_minor: conint(ge=0)
+
+class BudgetOut(BaseModel):
+    budget_id: uuid.UUID
+    category: str
+    amount_minor: int
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class BudgetStatusItem(BaseModel):
+    category: str
+    budget_minor: Optional[int] = None
+    spent_minor: int
+    received_minor: int
+    txn_count: int
+    remaining_minor: Optional[int] = None
+
+class BudgetStatus(BaseModel):
+    month: date
+    items: List[BudgetStatusItem]
+
+class MonthlySpend(BaseModel):
+    month: str
+    spent_minor: int
+    received_minor: int
+    spent_change_minor: Optional[int] = None
+    spent_change_pct: Optional[float] = None
+
+class DailySpend(BaseModel):
+    date: str
+    spent_minor: int
+    moving_average_7d: float
+    moving_average_30d: float
+
+class CategoryShare(BaseModel):
+    category: str
+    spent_minor: int
+    txn_count: int
+    share_pct: float
+
+class AnalyticsReport(BaseModel):
+    timezone: str
+    lookback_days: int
+    total_spent_minor: int
+    total_received_minor: int
+    monthly: List[MonthlySpend]
+    daily: List[DailySpend]
+    categories: List[CategoryShare]
+    heatmap: List[List[int]]
@@ -1,11 +1,101 @@
+import asyncio
+
 from fastapi import FastAPI
+from app.db.database import ENGINE_SETTINGS, dispose_engine, get_engine, replica_router, warm_pool
+from app.routes.account_routes import router as account_router
+from app.routes.analytics_routes import router as analytics_router
 from app.routes.auth_routes import router as auth_router
+from app.routes.budget_routes import router as budget_router
+from app.routes.health_routes import router as health_router
+from app.routes.transaction_routes import router as transaction_router
+from app.utils.account_sync import shutdown_account_sync, start_account_sync
+from app.utils.alerts import get_alert_engine, shutdown_alert_engine
+from app.utils.analytics import ANALYTICS_PREWARM, get_analytics_engine, shutdown_analytics_engine
+from app.utils.audit import get_audit_writer, shutdown_audit_writer
+from app.utils.auth import get_access_revocations, shutdown_access_revocations
+from app.utils.categorizer import load_categorizer, shutdown_categorization_batcher
+from app.utils.export import shutdown_export_worker, start_export_worker
+from app.utils.otp import get_otp_dispatcher, shutdown_otp_dispatcher
+from app.utils.otp_store import shutdown_otp_audit_writer
+from app.utils.refresh_tokens import get_revocation_filter, shutdown_revocation_filter
+from app.utils.push import shutdown_push_worker, start_push_worker
+from app.utils.rate_limit import shutdown_rate_limiter
+from app.utils.request_metrics import RequestMetricsMiddleware, instrument_engine
+from app.utils.resources import ResourceRegistry
+from app.utils.retention import RetentionJob, RETENTION_ENABLED
+from app.utils.security import shutdown_hashing_pool
+
+
+async def start_database():
+    """
+    Creates the engines and opens DB_POOL_PREWARM connections on each before the worker
+    takes traffic.
+    """
+    engines = [get_engine()] + [replica.engine for replica in replica_router.replicas]
+    for engine in engines:
+        instrument_engine(engine)
+    await asyncio.gather(*(warm_pool(engine, ENGINE_SETTINGS["pool_prewarm"]) for engine in engines))
+
+
+def start_audit_writer():
+    audit_writer = get_audit_writer()
+    if audit_writer:
+        # Also replays events spilled to disk by an earlier run
+        audit_writer.start()
+
 
-app = FastAPI()
+def start_analytics_pool():
+    if ANALYTICS_PREWARM:
+        get_analytics_engine().warm()
+
+
+def create_resources() -> ResourceRegistry:
+    """
+    Everything the worker owns, in start order; shutdown runs in reverse, so queues drain
+    while the engines they write through are still open.
+    """
+    resources = ResourceRegistry()
+    resources.register("database", start=start_database, stop=dispose_engine)
+    resources.register("read_replicas", start=replica_router.start, stop=replica_router.stop)
+    resources.register("rate_limiter", stop=shutdown_rate_limiter)
+    resources.register("analytics_pool", start=start_analytics_pool, stop=shutdown_analytics_engine)
+    resources.register("hashing_pool", stop=shutdown_hashing_pool)
+    # Loads the categorization model, if one has been trained, off the event loop
+    resources.register("categorization_batcher", start=load_categorizer, stop=shutdown_categorization_batcher)
+    resources.register("audit_writer", start=start_audit_writer, stop=shutdown_audit_writer)
+    resources.register("otp_audit_writer", stop=shutdown_otp_audit_writer)
+    # Sends any queued OTPs through the SMS provider, then closes it
+    resources.register("otp_dispatcher", start=lambda: get_otp_dispatcher().start(), stop=shutdown_otp_dispatcher)
+    resources.register("revocation_filter", start=lambda: get_revocation_filter().start(),
+                       stop=shutdown_revocation_filter)
+    resources.register("access_revocations", start=lambda: get_access_revocations().start(),
+                       stop=shutdown_access_revocations)
+    # get_alert_engine() restores the alert state snapshot, if one is configured; it is
+    # snapshotted again after the push worker has delivered the queued alerts
+    resources.register("alert_engine", start=get_alert_engine, stop=shutdown_alert_engine)
+    # Owns the FCM HTTP client
+    resources.register("push_worker", start=lambda: start_push_worker(get_alert_engine().queue),
+                       stop=shutdown_push_worker)
+    resources.register("account_sync", start=start_account_sync, stop=shutdown_account_sync)
+    # Interrupted exports are handed back to the queue on stop
+    resources.register("export_worker", start=start_export_worker, stop=shutdown_export_worker)
+    retention_job = RetentionJob()
+    if RETENTION_ENABLED:
+        resources.register("retention", start=retention_job.start, stop=retention_job.stop)
+    return resources
+
+
+app = FastAPI(lifespan=create_resources().lifespan)
+
+app.add_middleware(RequestMetricsMiddleware)
 
 app.include_router(auth_router)
+app.include_router(health_router)
+app.include_router(transaction_router)
+app.include_router(account_router)
+app.include_router(budget_router)
+app.include_router(analytics_router)
 
 @app.get("/")
 async def root():
     return {"message": "Expense Tracker API is running!"}
-
@@ -0,0 +1,54 @@
+import uuid
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.db.database import get_write_db
+from app.db.models import BankAccount
+from app.utils.alerts import refresh_alert_spend
+from app.utils.analytics import invalidate_analytics
+from app.utils.auth import get_current_user, CurrentUser
+from app.utils.search import invalidate_merchant_index
+from app.utils.statement_import import import_statement, StatementFormatError
+
+router = APIRouter(
+    prefix="/accounts",
+    tags=["Bank Accounts"],
+)
+
+@router.post("/{account_id}/statements", status_code=status.HTTP_200_OK)
+async def upload_statement(
+    account_id: uuid.UUID,
+    file: UploadFile = File(...),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """
+    Imports a CSV or XLSX bank statement into the account. The file is streamed from its
+    spooled upload, so memory use does not grow with the file size.
+    """
+    account = await db.execute(
+        select(BankAccount.account_id).where(
+            BankAccount.account_id == account_id,
+            BankAccount.user_id == current_user.user_id,
+        )
+    )
+    if account.scalar_one_or_none() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Bank account not found"
+        )
+
+    try:
+        report = await import_statement(db, file.file, file.filename, current_user.user_id, account_id)
+    except StatementFormatError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if report["rows_inserted"]:
+        invalidate_analytics(current_user.user_id)
+        invalidate_merchant_index(current_user.user_id)
+        refresh_alert_spend(current_user.user_id)
+    return report
@@ -0,0 +1,69 @@
+from typing import List
+
+from fastapi import APIRouter, Depends, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import get_read_db
+from app.db.schemas import AnalyticsReport, CategoryShare, DailySpend, MonthlySpend
+from app.utils.analytics import get_analytics_engine
+from app.utils.auth import get_current_user, CurrentUser
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["Analytics"],
+)
+
+@router.get("", response_model=AnalyticsReport, status_code=status.HTTP_200_OK)
+async def analytics_report(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Full spending report over the lookback window. The other /analytics endpoints return
+    parts of the same memoized report.
+    """
+    return await get_analytics_engine().report(db, current_user.user_id)
+
+@router.get("/trends", response_model=List[MonthlySpend], status_code=status.HTTP_200_OK)
+async def spending_trends(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Monthly spending and income with month-over-month changes.
+    """
+    report = await get_analytics_engine().report(db, current_user.user_id)
+    return report["monthly"]
+
+@router.get("/moving-averages", response_model=List[DailySpend], status_code=status.HTTP_200_OK)
+async def moving_averages(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Daily spending with 7 and 30 day trailing averages.
+    """
+    report = await get_analytics_engine().report(db, current_user.user_id)
+    return report["daily"]
+
+@router.get("/categories", response_model=List[CategoryShare], status_code=status.HTTP_200_OK)
+async def category_share(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Share of spending per category, largest first.
+    """
+    report = await get_analytics_engine().report(db, current_user.user_id)
+    return report["categories"]
+
+@router.get("/heatmap", response_model=List[List[int]], status_code=status.HTTP_200_OK)
+async def spending_heatmap(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Spending by day of week (rows, Monday first) and hour of day (columns), in local time.
+    """
+    report = await get_analytics_engine().report(db, current_user.user_id)
+    return report["heatmap"]
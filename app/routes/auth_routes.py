@@ -1,14 +1,31 @@
+import hmac
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
-from app.db.database import get_db
+from app.db.database import get_read_db, get_write_db, route_to_primary
 from app.db.models import User, OTPVerification
-from app.db.schemas import UserCreate, UserOut, UserLogin
-from app.utils.security import get_password_hash, authenticate_user, create_access_token, create_refresh_token
-from app.utils.otp import send_otp
+from app.db.schemas import UserCreate, UserBatchCreate, UserBatchResult, UserOut, UserLogin, TokenRefresh
+from app.utils.security import hash_password, hash_passwords, authenticate_user, create_access_token, HashingPoolBusy
+from app.utils.refresh_tokens import (
+    issue_refresh_token, rotate_refresh_token, revoke_refresh_token, revoke_all_refresh_tokens, InvalidRefreshToken,
+)
+from app.utils.otp import generate_otp, send_otp, OTPQueueFull
+from app.utils.auth import (
+    bearer_scheme, get_current_user, invalidate_user, require_admin, revoke_access_token, revoke_user_tokens,
+    CurrentUser,
+)
+from app.utils.otp_store import (
+    get_otp_store, get_otp_audit_writer, OTPStoreFull, VERIFIED, INVALID, LOCKED, MISSING, OTP_MAX_ATTEMPTS,
+)
+from app.utils.audit import request_audit, RequestAudit, FAILURE
+from app.utils.rate_limit import enforce, limit_login, limit_otp_request, limit_otp_verify, OTP_REQUEST_PER_PHONE
+from app.utils.registration import create_user, create_users, RegistrationConflict, CREATED, EMAIL_TAKEN
 
 router = APIRouter(
     prefix="/auth",
@@ -18,116 +35,315 @@ router = APIRouter(
 @router.post("/register", response_model=UserOut, status_code=status.HTTP_201_CREATED)
 async def register_user(
     user: UserCreate,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_write_db),
+    audit: RequestAudit = Depends(request_audit)
 ):
-    # Check if user with email already exists
-    existing_user_email = await db.execute(select(User).where(User.email == user.email))
-    if existing_user_email.scalar_one_or_none():
+    try:
+        hashed_password = await hash_password(user.password)
+    except HashingPoolBusy:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
         )
 
-    # Check if user with phone already exists
-    existing_user_phone = await db.execute(select(User).where(User.phone == user.phone))
-    if existing_user_phone.scalar_one_or_none():
+    # The unique constraints on email and phone do the duplicate checks in the same round trip
+    try:
+        db_user = await create_user(db, user.name, user.email, user.phone, hashed_password)
+    except RegistrationConflict as e:
+        audit.record("register", FAILURE, reason="email_taken" if e.detail == EMAIL_TAKEN else "phone_taken")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Phone number already registered"
+            detail=e.detail
         )
-
-    hashed_password = get_password_hash(user.password)
-    db_user = User(
-        name=user.name,
-        email=user.email,
-        phone=user.phone,
-        password_hash=hashed_password
-    )
-
-    db.add(db_user)
-    await db.commit()
-    await db.refresh(db_user)
+    audit.record("register", user_id=db_user.user_id)
 
     return db_user
 
-@router.post("/login", status_code=status.HTTP_200_OK)
+@router.post("/register/batch", response_model=UserBatchResult, status_code=status.HTTP_200_OK,
+             dependencies=[Depends(require_admin)])
+async def register_users_batch(
+    batch: UserBatchCreate,
+    db: AsyncSession = Depends(get_write_db),
+    audit: RequestAudit = Depends(request_audit)
+):
+    """
+    Admin-only bulk onboarding of partner users. Every row gets its own result; rows whose
+    email or phone is taken are reported as conflicts and do not fail the batch.
+    """
+    try:
+        hashes = await hash_passwords([user.password for user in batch.users])
+    except HashingPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    results = await create_users(db, [
+        {"name": user.name, "email": user.email, "phone": user.phone, "password_hash": password_hash}
+        for user, password_hash in zip(batch.users, hashes)
+    ])
+    created = sum(1 for row in results if row["status"] == CREATED)
+    audit.record("register_batch", created=created, conflicts=len(results) - created)
+    return {"created": created, "conflicts": len(results) - created, "results": results}
+
+@router.post("/login", status_code=status.HTTP_200_OK, dependencies=[Depends(limit_login)])
 async def login_for_access_token(
     user_credentials: UserLogin,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_write_db),
+    audit: RequestAudit = Depends(request_audit)
 ):
-    user = await authenticate_user(db, user_credentials.email, user_credentials.password)
+    try:
+        user = await authenticate_user(db, user_credentials.email, user_credentials.password)
+    except HashingPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
     if not user:
+        audit.record("login", FAILURE, email=user_credentials.email)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token = create_access_token(data={"sub": user.email})
-    refresh_token = create_refresh_token(data={"sub": user.email})
+    refresh_token = await issue_refresh_token(db, user.user_id, user.email)
+    await db.commit()
+    audit.record("login", user_id=user.user_id)
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+@router.post("/refresh", status_code=status.HTTP_200_OK)
+async def refresh_access_token(
+    token: TokenRefresh,
+    db: AsyncSession = Depends(get_write_db)
+):
+    try:
+        access_token, refresh_token = await rotate_refresh_token(db, token.refresh_token)
+    except InvalidRefreshToken:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
-@router.post("/otp/request", status_code=status.HTTP_200_OK)
+@router.post("/logout", status_code=status.HTTP_200_OK)
+async def logout(
+    token: TokenRefresh,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """
+    Revokes the refresh token, and the access token sent as the bearer token, if any.
+    """
+    try:
+        await revoke_refresh_token(db, token.refresh_token)
+    except InvalidRefreshToken:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if credentials is not None:
+        await revoke_access_token(db, credentials.credentials)
+        await db.commit()
+    return {"message": "Logged out successfully"}
+
+@router.post("/logout/all", status_code=status.HTTP_200_OK)
+async def logout_everywhere(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_write_db),
+    audit: RequestAudit = Depends(request_audit)
+):
+    """
+    Signs the user out on every device: all refresh tokens and every access token issued so far.
+    """
+    await revoke_user_tokens(db, current_user.email)
+    await revoke_all_refresh_tokens(db, current_user.email)
+    audit.record("logout_all", user_id=current_user.user_id)
+    return {"message": "Logged out on all devices"}
+
+@router.get("/me", response_model=UserOut, status_code=status.HTTP_200_OK)
+async def read_current_user(current_user: CurrentUser = Depends(get_current_user)):
+    return current_user
+
+@router.post("/otp/request", status_code=status.HTTP_200_OK, dependencies=[Depends(limit_otp_request)])
 async def request_otp(
     user_email: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    audit: RequestAudit = Depends(request_audit)
 ):
     user = await db.execute(select(User).where(User.email == user_email))
     user = user.scalar_one_or_none()
+    if not user and route_to_primary(db):
+        # A user who has just registered may not have reached the replica yet
+        user = (await db.execute(select(User).where(User.email == user_email))).scalar_one_or_none()
     if not user:
+        audit.record("otp_request", FAILURE, email=user_email, reason="unknown_user")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
 
-    # In a real app, use a proper OTP service
-    otp_code = await send_otp(db, user.phone)
+    # Bounds the SMS sent to one number, however many emails or addresses ask for them
+    enforce((OTP_REQUEST_PER_PHONE, user.phone))
 
-    # Store OTP in database
-    otp_expires_at = datetime.now(timezone.utc) + timedelta(minutes=10) # OTP expires in 10 minutes
-    db_otp = OTPVerification(
-        user_id=user.user_id,
-        otp_code=str(otp_code),
-        expires_at=otp_expires_at
-    )
-    db.add(db_otp)
-    await db.commit()
-    await db.refresh(db_otp)
+    otp_code = generate_otp()
+
+    # Store the challenge in memory; the otp_verifications row is written behind for audit only
+    store = get_otp_store()
+    try:
+        challenge = store.issue(user.email, user.user_id, otp_code)
+    except OTPStoreFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    audit_writer = get_otp_audit_writer()
+    if audit_writer:
+        audit_writer.record_issued(challenge, store.ttl)
 
+    # Delivery happens in the background; the handler does not wait for the SMS provider
+    try:
+        await send_otp(user.phone, otp_code)
+    except OTPQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+    audit.record("otp_request", user_id=user.user_id)
     return {"message": "OTP sent successfully"}
 
-@router.post("/otp/verify", status_code=status.HTTP_200_OK)
+@router.post("/otp/verify", status_code=status.HTTP_200_OK, dependencies=[Depends(limit_otp_verify)])
 async def verify_otp(
     user_email: str,
     otp_code: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_write_db),
+    audit: RequestAudit = Depends(request_audit)
 ):
+    result, challenge = get_otp_store().verify(user_email, otp_code)
+    audit_writer = get_otp_audit_writer()
+
+    if result == MISSING and audit_writer:
+        # The challenge may have been issued by another worker; fall back to the audit table.
+        # Verified and locked challenges are kept as tombstones, so they never get here.
+        return await _verify_otp_from_db(db, user_email, otp_code, audit)
+    if result == LOCKED:
+        if audit_writer:
+            audit_writer.record_locked(challenge)
+        audit.record("otp_verify", FAILURE, user_id=challenge.user_id, reason="locked")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please request a new OTP"
+        )
+    if result == INVALID and audit_writer:
+        # Counted on the row too, so the fallback on other workers shares the budget
+        audit_writer.record_attempt(challenge)
+    if result != VERIFIED:
+        audit.record("otp_verify", FAILURE, user_id=challenge.user_id if challenge else None, email=user_email)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid or expired OTP"
+        )
+
+    if audit_writer:
+        # Consumed in the same commit, so another worker's fallback cannot accept the code
+        # again. A row not inserted yet is marked by the write-behind flush that inserts it;
+        # a row that exists but was locked or superseded through another worker is refused.
+        consumed = await db.execute(
+            update(OTPVerification)
+            .where(
+                OTPVerification.otp_id == challenge.otp_id,
+                OTPVerification.otp_id == _newest_unverified(challenge.user_id),
+                OTPVerification.attempts < OTP_MAX_ATTEMPTS,
+            )
+            .values(verified=True)
+            .returning(OTPVerification.otp_id)
+            .execution_options(synchronize_session=False)
+        )
+        if consumed.first() is None:
+            stored = await db.scalar(select(OTPVerification.otp_id).where(OTPVerification.otp_id == challenge.otp_id))
+            if stored is not None:
+                await db.rollback()
+                audit.record("otp_verify", FAILURE, user_id=challenge.user_id, reason="closed_elsewhere")
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid or expired OTP"
+                )
+    # Mark the user's phone as verified; this is the only statement in the common case
+    await db.execute(
+        update(User).where(User.user_id == challenge.user_id).values(is_phone_verified=True)
+    )
+    await db.commit()
+    invalidate_user(user_email)
+    if audit_writer:
+        audit_writer.record_verified(challenge)
+    audit.record("otp_verify", user_id=challenge.user_id)
+
+    return {"message": "Phone number verified successfully"}
+
+def _newest_unverified(user_id):
+    """
+    The user's most recently issued unverified challenge; older ones are superseded.
+    """
+    return (
+        select(OTPVerification.otp_id)
+        .where(OTPVerification.user_id == user_id, OTPVerification.verified == False)
+        .order_by(OTPVerification.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+async def _verify_otp_from_db(db: AsyncSession, user_email: str, otp_code: str, audit: RequestAudit):
     user = await db.execute(select(User).where(User.email == user_email))
     user = user.scalar_one_or_none()
     if not user:
+        audit.record("otp_verify", FAILURE, email=user_email, reason="unknown_user")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
 
-    otp_verification = await db.execute(
-        select(OTPVerification).where(
-            OTPVerification.user_id == user.user_id,
-            OTPVerification.otp_code == otp_code,
-            OTPVerification.verified == False,
-            OTPVerification.expires_at > datetime.now(timezone.utc)
-        )
+    user_id = user.user_id
+    # Only the newest challenge answers, locked so workers checking it take turns
+    challenge = await db.execute(
+        select(OTPVerification)
+        .where(OTPVerification.otp_id == _newest_unverified(user_id))
+        .with_for_update()
     )
-    otp_verification = otp_verification.scalar_one_or_none()
-    if not otp_verification:
+    challenge = challenge.scalar_one_or_none()
+    if challenge is None or challenge.expires_at <= datetime.now(timezone.utc):
+        audit.record("otp_verify", FAILURE, user_id=user_id)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid or expired OTP"
         )
+    if challenge.attempts < OTP_MAX_ATTEMPTS and not hmac.compare_digest(challenge.otp_code, otp_code):
+        challenge.attempts += 1
+        await db.commit()
+        if challenge.attempts < OTP_MAX_ATTEMPTS:
+            audit.record("otp_verify", FAILURE, user_id=user_id)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid or expired OTP"
+            )
+    if challenge.attempts >= OTP_MAX_ATTEMPTS:
+        await db.rollback()
+        audit.record("otp_verify", FAILURE, user_id=user_id, reason="locked")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please request a new OTP"
+        )
 
-    # Mark OTP as verified and update user status
-    otp_verification.verified = True
+    challenge.verified = True
     user.is_phone_verified = True
     await db.commit()
-    await db.refresh(user)
+    invalidate_user(user.email)
+    audit.record("otp_verify", user_id=user_id)
 
-    return {"message": "Phone number verified successfully"}
\ No newline at end of file
+    return {"message": "Phone number verified successfully"}
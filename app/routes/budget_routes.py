@@ -0,0 +1,133 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, func, select
+
+from app.db.database import get_read_db, get_write_db
+from app.db.models import Budget, CategoryMonthlyRollup
+from app.db.partitions import month_start
+from app.db.schemas import BudgetOut, BudgetSet, BudgetStatus
+from app.utils.alerts import update_alert_budget
+from app.utils.auth import get_current_user, CurrentUser
+
+router = APIRouter(
+    prefix="/budgets",
+    tags=["Budgets"],
+)
+
+@router.get("", response_model=List[BudgetOut], status_code=status.HTTP_200_OK)
+async def list_budgets(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    result = await db.execute(
+        select(Budget).where(Budget.user_id == current_user.user_id).order_by(Budget.category)
+    )
+    return result.scalars().all()
+
+@router.put("/{category}", response_model=BudgetOut, status_code=status.HTTP_200_OK)
+async def set_budget(
+    category: str,
+    budget: BudgetSet,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """
+    Creates or replaces the monthly budget for a category.
+    """
+    if len(category) > 50:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Category is too long"
+        )
+    stmt = insert(Budget).values(user_id=current_user.user_id, category=category, amount_minor=budget.amount_minor)
+    result = await db.execute(
+        stmt.on_conflict_do_update(
+            constraint="uq_budgets_user_category",
+            set_={"amount_minor": stmt.excluded.amount_minor, "updated_at": func.now()},
+        ).returning(Budget)
+    )
+    db_budget = result.scalar_one()
+    await db.commit()
+    update_alert_budget(current_user.user_id, category, db_budget.amount_minor)
+    return db_budget
+
+@router.delete("/{category}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_budget(
+    category: str,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_write_db)
+):
+    result = await db.execute(
+        delete(Budget).where(Budget.user_id == current_user.user_id, Budget.category == category)
+    )
+    await db.commit()
+    update_alert_budget(current_user.user_id, category, None)
+    if not result.rowcount:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Budget not found"
+        )
+
+@router.get("/status", response_model=BudgetStatus, status_code=status.HTTP_200_OK)
+async def budget_status(
+    month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="YYYY-MM, defaults to the current month"),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Spending against budget for every category the user has a budget for or spent in that
+    month. Reads the precomputed monthly rollups, so the cost depends on the number of
+    categories, not the number of transactions.
+    """
+    if month is None:
+        period = month_start(datetime.now(timezone.utc).date())
+    else:
+        try:
+            period = datetime.strptime(month, "%Y-%m").date()
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid month"
+            )
+
+    budgets = (
+        select(Budget.category, Budget.amount_minor)
+        .where(Budget.user_id == current_user.user_id)
+        .subquery()
+    )
+    rollups = (
+        select(CategoryMonthlyRollup.category, CategoryMonthlyRollup.debit_minor,
+               CategoryMonthlyRollup.credit_minor, CategoryMonthlyRollup.txn_count)
+        .where(CategoryMonthlyRollup.user_id == current_user.user_id, CategoryMonthlyRollup.month == period)
+        .subquery()
+    )
+    category = func.coalesce(budgets.c.category, rollups.c.category)
+    result = await db.execute(
+        select(
+            category,
+            budgets.c.amount_minor,
+            func.coalesce(rollups.c.debit_minor, 0),
+            func.coalesce(rollups.c.credit_minor, 0),
+            func.coalesce(rollups.c.txn_count, 0),
+        )
+        .select_from(budgets.join(rollups, budgets.c.category == rollups.c.category, full=True))
+        .order_by(category)
+    )
+
+    items = []
+    for category_name, budget_minor, spent, received, count in result:
+        if budget_minor is None and not count:
+            continue
+        items.append({
+            "category": category_name,
+            "budget_minor": budget_minor,
+            "spent_minor": spent,
+            "received_minor": received,
+            "txn_count": count,
+            "remaining_minor": budget_minor - spent if budget_minor is not None else None,
+        })
+    return {"month": period, "items": items}
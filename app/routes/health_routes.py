@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Request, Response, status
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from app.db.database import check_db_connection, get_pool_status, get_replica_status
+
+router = APIRouter(
+    tags=["Health"],
+)
+
+@router.get("/health", status_code=status.HTTP_200_OK)
+async def health():
+    """
+    Liveness probe. The process is up; the database state is reported but does not fail the check.
+    """
+    database_ok = await check_db_connection()
+    return {"status": "ok", "database": "ok" if database_ok else "unavailable"}
+
+@router.get("/ready", status_code=status.HTTP_200_OK)
+async def ready(request: Request, response: Response):
+    """
+    Readiness probe. Fails with 503 until the worker's resources have started (the database
+    pool is warm by then), once shutdown has begun, and while the database cannot be reached.
+    """
+    resources = getattr(request.app.state, "resources", None)
+    if resources is None or not resources.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": resources.state if resources is not None else "starting"}
+    if not await check_db_connection():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "unavailable", "database": "unavailable"}
+    return {"status": "ready", "database": "ok", "pool": get_pool_status(), "replicas": get_replica_status(),
+            "startup_seconds": resources.startup_seconds}
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,297 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, tuple_
+
+from app.db.database import get_read_db, get_write_db
+from app.db.models import BankAccount, Transaction, TransactionExport
+from app.db.schemas import (
+    ExportJobOut, MerchantSuggestion, TransactionCreate, TransactionOut, TransactionPage, TransactionUpdate,
+)
+from app.utils.alerts import observe_transaction, refresh_alert_spend
+from app.utils.analytics import invalidate_analytics
+from app.utils.auth import get_current_user, CurrentUser
+from app.utils.categorizer import get_categorization_batcher
+from app.utils.export import (
+    EXPORT_FORMATS, EXPORT_INLINE_MAX_ROWS, XLSX_MAX_ROWS, create_export_job, encode_export, estimate_rows,
+    export_filename, export_path, export_query, fetch_batches, is_compressed,
+)
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.rollups import RollupDeltas, apply_transaction
+from app.utils.search import (
+    MAX_SUGGESTIONS, SEARCH_MIN_CHARS, get_merchant_autocomplete, record_merchant, search_conditions,
+)
+
+router = APIRouter(
+    prefix="/transactions",
+    tags=["Transactions"],
+)
+
+async def _keyset_page(db: AsyncSession, query, limit: int, cursor: Optional[str]) -> dict:
+    """
+    Runs `query` for one page, newest first, after the position in `cursor`.
+    """
+    if cursor:
+        try:
+            occurred_at, transaction_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(
+            tuple_(Transaction.occurred_at, Transaction.transaction_id) < tuple_(occurred_at, transaction_id)
+        )
+    query = query.order_by(Transaction.occurred_at.desc(), Transaction.transaction_id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(query)).scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].occurred_at, rows[-1].transaction_id)
+
+    return {"items": rows, "next_cursor": next_cursor}
+
+@router.post("", response_model=TransactionOut, status_code=status.HTTP_201_CREATED)
+async def create_transaction(
+    transaction: TransactionCreate,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_write_db)
+):
+    if transaction.account_id is not None:
+        account = await db.execute(
+            select(BankAccount.account_id).where(
+                BankAccount.account_id == transaction.account_id,
+                BankAccount.user_id == current_user.user_id,
+            )
+        )
+        if account.scalar_one_or_none() is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Bank account not found"
+            )
+
+    values = transaction.model_dump()
+    if values["category"] is None and values["merchant"]:
+        batcher = get_categorization_batcher()
+        if batcher is not None:
+            values["category"] = await batcher.categorize(values["merchant"], values["upi_app"], values["location"])
+
+    db_transaction = Transaction(user_id=current_user.user_id, **values)
+    db.add(db_transaction)
+    await apply_transaction(db, db_transaction)
+    await db.commit()
+    invalidate_analytics(current_user.user_id)
+    record_merchant(current_user.user_id, added=db_transaction.merchant)
+    await observe_transaction(db, db_transaction)
+
+    return db_transaction
+
+@router.get("", response_model=TransactionPage, status_code=status.HTTP_200_OK)
+async def list_transactions(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    account_id: Optional[uuid.UUID] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Lists the user's transactions, newest first. Pages are keyset-paginated on
+    (occurred_at, transaction_id), so every page is a single index range scan
+    regardless of how deep it is; pass the returned next_cursor to get the next page.
+    """
+    query = select(Transaction).where(Transaction.user_id == current_user.user_id)
+    if account_id is not None:
+        query = query.where(Transaction.account_id == account_id)
+    return await _keyset_page(db, query, limit, cursor)
+
+@router.get("/search", response_model=TransactionPage, status_code=status.HTTP_200_OK)
+async def search_transactions(
+    q: Optional[str] = Query(None, max_length=200),
+    merchant: Optional[str] = Query(None, min_length=SEARCH_MIN_CHARS, max_length=150),
+    upi_app: Optional[str] = Query(None, max_length=50),
+    location: Optional[str] = Query(None, min_length=SEARCH_MIN_CHARS, max_length=150),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Searches the user's transactions, newest first, with the same cursors as the listing.
+    merchant and location match anywhere in the field, upi_app matches the whole name, and
+    q matches word prefixes across merchant, UPI app, location and description. Filters
+    combine with AND; matching is case-insensitive.
+    """
+    try:
+        conditions = search_conditions(q, merchant, upi_app, location)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if not conditions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Give at least one of q, merchant, upi_app or location"
+        )
+    query = select(Transaction).where(Transaction.user_id == current_user.user_id, *conditions)
+    return await _keyset_page(db, query, limit, cursor)
+
+@router.get("/merchants", response_model=List[MerchantSuggestion], status_code=status.HTTP_200_OK)
+async def autocomplete_merchants(
+    prefix: str = Query(..., min_length=1, max_length=150),
+    limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    The user's merchants whose name, or a word in it, starts with `prefix`, most used
+    first. Served from an in-memory index of the user's merchants.
+    """
+    return await get_merchant_autocomplete().suggest(db, current_user.user_id, prefix, limit)
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Times without an offset are taken as UTC
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+@router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    responses={status.HTTP_202_ACCEPTED: {"model": ExportJobOut, "description": "Export queued as a job"}},
+)
+async def export_transactions(
+    format: Literal["csv", "jsonl", "xlsx"] = "csv",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    background: bool = False,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Exports the user's transactions with occurred_at in [since, until), oldest first, as
+    CSV, JSON lines or XLSX. Up to EXPORT_INLINE_MAX_ROWS are streamed in the response as
+    they are read. Larger exports, or any export with background=true, are queued instead:
+    the response is 202 with the job, and the finished file is downloaded from
+    /transactions/exports/{export_id}/file.
+    """
+    since, until = _as_utc(since), _as_utc(until)
+    rows = await estimate_rows(db, current_user.user_id, since, until)
+    if format == "xlsx" and rows > XLSX_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"An XLSX sheet holds at most {XLSX_MAX_ROWS:,} transactions; use csv or jsonl, or a shorter range"
+        )
+
+    if background or rows > EXPORT_INLINE_MAX_ROWS:
+        job = await create_export_job(current_user.user_id, format, since, until)
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=jsonable_encoder(ExportJobOut.model_validate(job)),
+            headers={"Location": f"/transactions/exports/{job.export_id}"},
+        )
+
+    batches = fetch_batches(db, export_query(current_user.user_id, since, until))
+    return StreamingResponse(
+        encode_export(batches, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format)}"'},
+    )
+
+async def _get_export(db: AsyncSession, export_id: uuid.UUID, user_id: uuid.UUID) -> TransactionExport:
+    job = await db.get(TransactionExport, export_id)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export not found"
+        )
+    return job
+
+# Export jobs are read from the primary: a replica may not have the job just queued
+@router.get("/exports/{export_id}", response_model=ExportJobOut, status_code=status.HTTP_200_OK)
+async def get_export(
+    export_id: uuid.UUID,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_write_db)
+):
+    return await _get_export(db, export_id, current_user.user_id)
+
+@router.get("/exports/{export_id}/file", status_code=status.HTTP_200_OK)
+async def download_export(
+    export_id: uuid.UUID,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """
+    The finished export: gzip-compressed for csv and jsonl, as is for xlsx.
+    """
+    job = await _get_export(db, export_id, current_user.user_id)
+    if job.status != "done":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Export is {job.status}"
+        )
+    path = export_path(job.export_id, job.format)
+    if not os.path.exists(path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export not found"
+        )
+    compressed = is_compressed(job.format)
+    return FileResponse(
+        path,
+        media_type="application/gzip" if compressed else EXPORT_FORMATS[job.format],
+        filename=export_filename(job.format, compressed),
+    )
+
+@router.patch("/{transaction_id}", response_model=TransactionOut, status_code=status.HTTP_200_OK)
+async def update_transaction(
+    transaction_id: uuid.UUID,
+    changes: TransactionUpdate,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """
+    Edits a transaction. The row is locked while the old amounts are taken out of the
+    monthly rollups and the new ones added, in the same commit as the edit.
+    """
+    values = changes.model_dump(exclude_unset=True)
+    for field in ("amount_minor", "direction"):
+        if field in values and values[field] is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{field} cannot be null"
+            )
+
+    result = await db.execute(
+        select(Transaction)
+        .where(Transaction.transaction_id == transaction_id, Transaction.user_id == current_user.user_id)
+        .with_for_update()
+    )
+    db_transaction = result.scalar_one_or_none()
+    if db_transaction is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Transaction not found"
+        )
+
+    old_merchant = db_transaction.merchant
+    deltas = RollupDeltas()
+    deltas.add_transaction(db_transaction, sign=-1)
+    for field, value in values.items():
+        setattr(db_transaction, field, value)
+    deltas.add_transaction(db_transaction)
+    await deltas.apply(db)
+    await db.commit()
+    invalidate_analytics(current_user.user_id)
+    refresh_alert_spend(current_user.user_id)
+    record_merchant(current_user.user_id, added=db_transaction.merchant, removed=old_merchant)
+
+    return db_transaction
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional
+
+
+class AggregatorProviderError(Exception):
+    """
+    Raised by a provider when an account's data could not be fetched.
+    """
+
+
+class SyncAccount(NamedTuple):
+    account_id: uuid.UUID
+    user_id: uuid.UUID
+    bank_name: str
+    account_mask: str
+    last_sync: Optional[datetime]
+    sync_failures: int
+
+
+class AggregatorTransaction(NamedTuple):
+    occurred_at: datetime
+    amount_minor: int
+    direction: str
+    description: Optional[str]
+    merchant: Optional[str] = None
+    upi_app: Optional[str] = None
+    location: Optional[str] = None
+    category: Optional[str] = None
+
+
+class FetchResult(NamedTuple):
+    transactions: List[AggregatorTransaction]
+    # Point in time the data is complete up to; becomes the account's last_sync
+    as_of: datetime
+
+
+class AccountAggregatorProvider:
+    """
+    Interface for Account Aggregator (FIU) providers used by the account sync scheduler.
+    """
+
+    async def fetch_transactions(self, account: SyncAccount, since: Optional[datetime]) -> FetchResult:
+        """
+        Returns the account's transactions after `since` (its full available history when
+        None). Transactions may repeat across calls; the caller deduplicates them.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+STUB_MERCHANTS = (
+    ("Swiggy", "food"), ("Zomato", "food"), ("BigBasket", "groceries"), ("Blinkit", "groceries"),
+    ("Uber India", "travel"), ("IRCTC", "travel"), ("Airtel Postpaid", "bills"), ("BESCOM", "bills"),
+    ("Amazon", "shopping"), ("Flipkart", "shopping"), ("Apollo Pharmacy", "health"), ("Indian Oil", "fuel"),
+)
+STUB_UPI_APPS = ("GPay", "PhonePe", "Paytm", None)
+
+
+class StubAggregatorProvider(AccountAggregatorProvider):
+    """
+    Local stand-in for tests and load tests. Generates a deterministic ledger per account
+    and day, so overlapping fetches return the same rows, optionally with artificial
+    latency and a random failure rate.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, transactions_per_day: float = 3.0,
+                 history_days: int = 90):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.transactions_per_day = transactions_per_day
+        self.history_days = history_days
+        self.calls = 0
+
+    def _day(self, account_id: uuid.UUID, day: datetime) -> List[AggregatorTransaction]:
+        rng = random.Random(f"{account_id}:{day.date().isoformat()}")
+        count = int(rng.expovariate(1 / self.transactions_per_day)) if self.transactions_per_day else 0
+        transactions = []
+        for _ in range(count):
+            occurred_at = day + timedelta(seconds=rng.randrange(86400))
+            if rng.random() < 0.9:
+                merchant, _ = rng.choice(STUB_MERCHANTS)
+                upi_app = rng.choice(STUB_UPI_APPS)
+                transactions.append(AggregatorTransaction(
+                    occurred_at, rng.randrange(2000, 500_000), "debit",
+                    f"UPI/{upi_app or 'NEFT'}/{merchant}", merchant, upi_app, None,
+                ))
+            else:
+                transactions.append(AggregatorTransaction(
+                    occurred_at, rng.randrange(100_000, 10_000_000), "credit", "NEFT/SALARY CREDIT",
+                ))
+        return transactions
+
+    async def fetch_transactions(self, account: SyncAccount, since: Optional[datetime]) -> FetchResult:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise AggregatorProviderError("Simulated provider failure")
+
+        as_of = datetime.now(timezone.utc)
+        start = since or as_of - timedelta(days=self.history_days)
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        transactions = []
+        while day <= as_of:
+            transactions.extend(t for t in self._day(account.account_id, day) if start < t.occurred_at <= as_of)
+            day += timedelta(days=1)
+        return FetchResult(transactions, as_of)
+
+
+def create_aa_provider(name: Optional[str] = None) -> AccountAggregatorProvider:
+    """
+    Builds the provider named by the AA_PROVIDER environment variable. Only "stub" ships
+    with the app; a real FIU integration implements AccountAggregatorProvider.
+    """
+    name = name or os.getenv("AA_PROVIDER", "stub")
+    if name == "stub":
+        return StubAggregatorProvider(
+            latency=float(os.getenv("STUB_AA_LATENCY", "0")),
+            failure_rate=float(os.getenv("STUB_AA_FAILURE_RATE", "0")),
+            transactions_per_day=float(os.getenv("STUB_AA_TRANSACTIONS_PER_DAY", "3")),
+        )
+    raise ValueError(f"Unknown Account Aggregator provider: {name}")
@@ -0,0 +1,370 @@
+"""
+Background sync of linked bank accounts through an Account Aggregator provider.
+
+Each bank account carries next_sync_at. The scheduler claims due accounts with one indexed
+UPDATE ... FOR UPDATE SKIP LOCKED (so several workers never claim the same account) and
+fetches only what changed since last_sync, minus a small overlap for late-posting banks.
+Fetches run concurrently under a global cap and a token bucket per bank. Fetched rows are
+bulk upserted through the statement import merge, which skips rows already stored by
+fingerprint. The next sync is scheduled a jittered interval later, so accounts linked
+together do not keep syncing together; failures back off exponentially.
+
+One-off pass over every due account, e.g. from cron:
+    python -m app.utils.account_sync
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import text, update
+
+from app.db.models import BankAccount
+from app.utils.aa_provider import (
+    AccountAggregatorProvider, AggregatorProviderError, AggregatorTransaction, FetchResult, SyncAccount, create_aa_provider,
+)
+from app.utils.alerts import refresh_alert_spend
+from app.utils.analytics import invalidate_analytics
+from app.utils.categorizer import categorize_records, get_categorizer
+from app.utils.search import invalidate_merchant_index
+from app.utils.statement_import import (
+    STAGING_COLUMNS, ImportStats, Occurrences, batched, copy_batches,
+)
+
+logger = logging.getLogger(__name__)
+
+SYNC_ENABLED = os.getenv("SYNC_ENABLED", "false").lower() == "true"
+SYNC_INTERVAL_MINUTES = float(os.getenv("SYNC_INTERVAL_MINUTES", "360"))
+# Each next sync lands uniformly within +/- this fraction of the interval
+SYNC_JITTER = float(os.getenv("SYNC_JITTER", "0.2"))
+# Re-fetch this far behind last_sync; banks post some transactions late
+SYNC_OVERLAP_HOURS = float(os.getenv("SYNC_OVERLAP_HOURS", "48"))
+SYNC_MAX_CONCURRENCY = int(os.getenv("SYNC_MAX_CONCURRENCY", "20"))
+# Per-bank request budget; SYNC_BANK_RATES overrides single banks, e.g. "SBI=1,HDFC Bank=4"
+SYNC_BANK_RATE = float(os.getenv("SYNC_BANK_RATE", "2"))
+SYNC_BANK_BURST = int(os.getenv("SYNC_BANK_BURST", "5"))
+SYNC_BANK_RATES = os.getenv("SYNC_BANK_RATES", "")
+SYNC_CLAIM_BATCH = int(os.getenv("SYNC_CLAIM_BATCH", "100"))
+SYNC_POLL_SECONDS = float(os.getenv("SYNC_POLL_SECONDS", "30"))
+# A claimed account becomes due again after this long if its worker dies mid-sync
+SYNC_LEASE_MINUTES = int(os.getenv("SYNC_LEASE_MINUTES", "15"))
+SYNC_MAX_BACKOFF_MINUTES = float(os.getenv("SYNC_MAX_BACKOFF_MINUTES", "720"))
+
+SYNC_ACCOUNTS = Counter("account_sync_accounts_total", "Account syncs by result", ["result"])
+SYNC_TRANSACTIONS = Counter("account_sync_transactions_inserted_total", "New transactions stored by account sync")
+SYNC_FETCH_LATENCY = Histogram("account_sync_fetch_seconds", "Time taken by the provider to return an account's data")
+SYNC_LAG = Histogram(
+    "account_sync_lag_seconds", "Age of an account's data (now - last_sync) when its sync starts",
+    buckets=(60, 300, 900, 1800, 3600, 7200, 14400, 21600, 43200, 86400, 172800, 604800),
+)
+SYNC_OVERDUE = Gauge("account_sync_oldest_overdue_seconds", "How long the most overdue account has been waiting")
+SYNC_ACCOUNTS_PER_MINUTE = Gauge("account_sync_accounts_per_minute", "Accounts synced in the last minute")
+
+ClaimFunc = Callable[[int], Awaitable[List[SyncAccount]]]
+StoreFunc = Callable[[SyncAccount, FetchResult, timedelta], Awaitable[int]]
+FailureFunc = Callable[[SyncAccount, timedelta], Awaitable[None]]
+
+
+def parse_bank_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        bank, _, rate = item.rpartition("=")
+        rates[bank.strip()] = float(rate)
+    return rates
+
+
+def next_sync_delay(interval_minutes: float = SYNC_INTERVAL_MINUTES, jitter: float = SYNC_JITTER) -> timedelta:
+    return timedelta(minutes=interval_minutes * random.uniform(1 - jitter, 1 + jitter))
+
+
+def failure_backoff(failures: int, max_minutes: float = SYNC_MAX_BACKOFF_MINUTES) -> timedelta:
+    """
+    1, 2, 4, ... minutes after consecutive failures, capped, then stretched by a random factor of 1-2.
+    """
+    minutes = min(2 ** min(failures, 20), max_minutes)
+    return timedelta(minutes=minutes * random.uniform(1, 2))
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average and up to `burst` at once.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock makes waiters queue in order instead of all waking for the same token
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BankRateLimiter:
+    """
+    One token bucket per bank, created on first use. Limits apply per process.
+    """
+
+    def __init__(self, default_rate: float = SYNC_BANK_RATE, burst: int = SYNC_BANK_BURST,
+                 overrides: Optional[Dict[str, float]] = None):
+        self.default_rate = default_rate
+        self.burst = burst
+        self.overrides = overrides if overrides is not None else parse_bank_rates(SYNC_BANK_RATES)
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    async def acquire(self, bank_name: str):
+        bucket = self._buckets.get(bank_name)
+        if bucket is None:
+            bucket = self._buckets[bank_name] = TokenBucket(self.overrides.get(bank_name, self.default_rate), self.burst)
+        await bucket.acquire()
+
+
+CLAIM_DUE = text("""
+    UPDATE bank_accounts SET next_sync_at = now() + make_interval(mins => :lease_minutes)
+    WHERE account_id IN (
+        SELECT account_id FROM bank_accounts
+        WHERE next_sync_at <= now()
+        ORDER BY next_sync_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING account_id, user_id, bank_name, account_mask, last_sync, sync_failures
+""")
+
+OLDEST_OVERDUE = text("SELECT extract(epoch FROM now() - min(next_sync_at)) FROM bank_accounts WHERE next_sync_at <= now()")
+
+
+async def claim_due_accounts(limit: int) -> List[SyncAccount]:
+    """
+    Leases up to `limit` of the most overdue accounts to this worker.
+    """
+    from app.db.database import SessionLocal
+
+    async with SessionLocal() as session:
+        overdue = await session.scalar(OLDEST_OVERDUE)
+        SYNC_OVERDUE.set(overdue or 0)
+        result = await session.execute(CLAIM_DUE, {"limit": limit, "lease_minutes": SYNC_LEASE_MINUTES})
+        accounts = [SyncAccount(*row) for row in result]
+        await session.commit()
+    return accounts
+
+
+def _staging_record(account: SyncAccount, transaction: AggregatorTransaction, occurrences: Occurrences) -> tuple:
+    description = transaction.description and transaction.description[:1000]
+    return (
+        uuid.uuid4(), transaction.occurred_at, account.user_id, account.account_id, transaction.amount_minor, "INR",
+        transaction.direction, transaction.category and transaction.category[:50],
+        transaction.merchant and transaction.merchant[:150], transaction.upi_app and transaction.upi_app[:50],
+        transaction.location and transaction.location[:150], description,
+        # Same fingerprint as a statement upload of the same row, so the two never double up
+        occurrences.fingerprint(account.account_id, transaction.occurred_at, transaction.amount_minor,
+                                transaction.direction, description),
+    )
+
+
+async def store_sync_result(account: SyncAccount, result: FetchResult, next_sync_in: timedelta) -> int:
+    """
+    Upserts the fetched transactions and moves last_sync forward in one transaction.
+    Returns the number of new transactions.
+    """
+    from app.db.database import SessionLocal
+
+    occurrences = Occurrences()
+    records = [_staging_record(account, transaction, occurrences) for transaction in result.transactions]
+    stats = ImportStats()
+    batches = categorize_records(
+        batched(records), get_categorizer(),
+        STAGING_COLUMNS.index("category"), STAGING_COLUMNS.index("merchant"),
+    )
+    async with SessionLocal() as session:
+        try:
+            await copy_batches(session, batches, stats)
+            await session.execute(
+                update(BankAccount)
+                .where(BankAccount.account_id == account.account_id)
+                .values(last_sync=result.as_of, next_sync_at=result.as_of + next_sync_in, sync_failures=0)
+            )
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+    if stats.rows_inserted:
+        invalidate_analytics(account.user_id)
+        invalidate_merchant_index(account.user_id)
+        refresh_alert_spend(account.user_id)
+    return stats.rows_inserted
+
+
+async def record_sync_failure(account: SyncAccount, retry_in: timedelta):
+    from app.db.database import SessionLocal
+
+    async with SessionLocal() as session:
+        await session.execute(
+            update(BankAccount)
+            .where(BankAccount.account_id == account.account_id)
+            .values(sync_failures=BankAccount.sync_failures + 1,
+                    next_sync_at=datetime.now(timezone.utc) + retry_in)
+        )
+        await session.commit()
+
+
+class AccountSyncScheduler:
+    """
+    Keeps up to 2 * `concurrency` claimed accounts in flight, fetching at most `concurrency`
+    at a time and each bank no faster than its rate limit. Polls for due accounts every
+    `poll_interval` seconds while there is room.
+    """
+
+    def __init__(self, provider: AccountAggregatorProvider, claim: ClaimFunc = claim_due_accounts,
+                 store: StoreFunc = store_sync_result, record_failure: FailureFunc = record_sync_failure,
+                 concurrency: int = SYNC_MAX_CONCURRENCY, rate_limiter: Optional[BankRateLimiter] = None,
+                 claim_batch: int = SYNC_CLAIM_BATCH, poll_interval: float = SYNC_POLL_SECONDS,
+                 overlap: timedelta = timedelta(hours=SYNC_OVERLAP_HOURS)):
+        self.provider = provider
+        self.claim = claim
+        self.store = store
+        self.record_failure = record_failure
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter or BankRateLimiter()
+        self.claim_batch = claim_batch
+        self.poll_interval = poll_interval
+        self.overlap = overlap
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight: Set[asyncio.Task] = set()
+        self._completed = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            room = 2 * self.concurrency - len(self._in_flight)
+            if room <= 0:
+                await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            requested = min(room, self.claim_batch)
+            try:
+                accounts = await self.claim(requested)
+            except Exception:
+                logger.exception("Claiming due accounts failed")
+                accounts = []
+            for account in accounts:
+                self._spawn(account)
+            if len(accounts) < requested:
+                await asyncio.sleep(self.poll_interval)
+
+    def _spawn(self, account: SyncAccount):
+        task = asyncio.create_task(self.sync_account(account))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def run_once(self) -> Dict[str, int]:
+        """
+        Syncs every account that is due now, then returns the number of syncs per result.
+        """
+        results: Dict[str, int] = {}
+        while True:
+            accounts = await self.claim(self.claim_batch)
+            for result in await asyncio.gather(*(self.sync_account(account) for account in accounts)):
+                results[result] = results.get(result, 0) + 1
+            if len(accounts) < self.claim_batch:
+                return results
+
+    async def sync_account(self, account: SyncAccount) -> str:
+        since = account.last_sync - self.overlap if account.last_sync else None
+        await self.rate_limiter.acquire(account.bank_name)
+        async with self._semaphore:
+            now = datetime.now(timezone.utc)
+            if account.last_sync:
+                SYNC_LAG.observe((now - account.last_sync).total_seconds())
+            try:
+                start = time.perf_counter()
+                fetched = await self.provider.fetch_transactions(account, since)
+                SYNC_FETCH_LATENCY.observe(time.perf_counter() - start)
+                inserted = await self.store(account, fetched, next_sync_delay())
+            except Exception as e:
+                if isinstance(e, AggregatorProviderError):
+                    logger.warning("Sync of account %s failed: %s", account.account_id, e)
+                else:
+                    logger.exception("Sync of account %s failed", account.account_id)
+                try:
+                    await self.record_failure(account, failure_backoff(account.sync_failures))
+                except Exception:
+                    logger.exception("Recording the sync failure of account %s failed", account.account_id)
+                SYNC_ACCOUNTS.labels(result="failed").inc()
+                return "failed"
+        SYNC_TRANSACTIONS.inc(inserted)
+        SYNC_ACCOUNTS.labels(result="synced").inc()
+        self._record_completion()
+        return "synced"
+
+    def _record_completion(self):
+        now = time.monotonic()
+        self._completed.append(now)
+        while self._completed and self._completed[0] < now - 60:
+            self._completed.popleft()
+        SYNC_ACCOUNTS_PER_MINUTE.set(len(self._completed))
+
+    async def stop(self):
+        # Interrupted accounts are retried once their lease runs out
+        tasks = [task for task in (self._task, *self._in_flight) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        await self.provider.close()
+
+
+_scheduler: Optional[AccountSyncScheduler] = None
+
+
+def start_account_sync() -> Optional[AccountSyncScheduler]:
+    """
+    Starts the process-wide sync scheduler when SYNC_ENABLED is set. Several processes can
+    run it at once; claims never overlap.
+    """
+    global _scheduler
+    if not SYNC_ENABLED:
+        return None
+    if _scheduler is None:
+        _scheduler = AccountSyncScheduler(create_aa_provider())
+        _scheduler.start()
+    return _scheduler
+
+
+async def shutdown_account_sync():
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
+
+
+async def _sync_due():
+    scheduler = AccountSyncScheduler(create_aa_provider())
+    try:
+        return await scheduler.run_once()
+    finally:
+        await scheduler.provider.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(_sync_due()))
@@ -0,0 +1,553 @@
+"""
+Streaming alert engine for overspending and suspicious activity.
+
+Each new transaction is evaluated against compact per-user state instead of re-querying the
+ledger: budget limits and this month's spend per category, rolling velocity windows (count
+and amount over the last hour and day, in fixed ring buffers) and a Bloom-filter sketch of
+the merchants and locations the user has used before. A user's state is loaded from the
+database the first time they are seen and takes about 2.5 KB in memory.
+
+Rules:
+    budget_warning / budget_exceeded  spend in a category crosses 80% / 100% of its budget
+    velocity_count / velocity_amount  too many debits in an hour or too much spent in a day
+    new_merchant_location             a large debit at a merchant and a location never seen
+                                      before, once the user has enough history
+
+Alerts are put on an asyncio queue for the push worker. State is per process and can be
+snapshotted to a file on shutdown and restored on startup. Because spend and the velocity
+windows are only updated by the transactions a process observes itself, the engine needs
+every transaction of a user to reach the same process: run the API as a single worker, or
+route requests to workers by user (user-sticky load balancing). With several workers and no
+such routing, each one sees part of a user's debits, so alerts are missed or fired twice.
+The ledger can be replayed through a fresh engine to measure throughput:
+
+    python -m app.utils.alerts replay [--user USER_ID] [--since 2026-01-01]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import pickle
+import time
+import uuid
+import zlib
+from array import array
+from collections import Counter as CounterDict, OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from prometheus_client import Counter, Gauge
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.partitions import month_start
+from app.utils.rollups import UNCATEGORIZED
+
+logger = logging.getLogger(__name__)
+
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "10000"))
+ALERT_MAX_USERS = int(os.getenv("ALERT_MAX_USERS", "100000"))
+ALERT_SNAPSHOT_PATH = os.getenv("ALERT_SNAPSHOT_PATH", "")
+ALERT_BUDGET_WARNING_RATIO = float(os.getenv("ALERT_BUDGET_WARNING_RATIO", "0.8"))
+ALERT_VELOCITY_MAX_PER_HOUR = int(os.getenv("ALERT_VELOCITY_MAX_PER_HOUR", "10"))
+ALERT_VELOCITY_MAX_AMOUNT_PER_DAY = int(os.getenv("ALERT_VELOCITY_MAX_AMOUNT_PER_DAY", "5000000"))
+ALERT_NOVELTY_MIN_AMOUNT = int(os.getenv("ALERT_NOVELTY_MIN_AMOUNT", "500000"))
+# Novelty alerts need this many known transactions, so new users are not flagged for everything
+ALERT_NOVELTY_MIN_HISTORY = int(os.getenv("ALERT_NOVELTY_MIN_HISTORY", "20"))
+ALERT_HISTORY_DAYS = int(os.getenv("ALERT_HISTORY_DAYS", "90"))
+
+SKETCH_BITS = 4096
+SKETCH_HASHES = 4
+SNAPSHOT_VERSION = 1
+
+ALERTS_EMITTED = Counter("alerts_emitted_total", "Alerts raised by the alert engine", ["kind"])
+ALERTS_DROPPED = Counter("alerts_dropped_total", "Alerts dropped because the alert queue was full")
+ALERT_ENGINE_USERS = Gauge("alert_engine_users", "Users with state loaded in the alert engine")
+
+
+class TransactionEvent(NamedTuple):
+    transaction_id: uuid.UUID
+    user_id: uuid.UUID
+    occurred_at: float  # epoch seconds
+    amount_minor: int
+    direction: str
+    category: Optional[str]
+    merchant: Optional[str]
+    location: Optional[str]
+
+
+def event_from_transaction(transaction) -> TransactionEvent:
+    return TransactionEvent(
+        transaction.transaction_id, transaction.user_id, transaction.occurred_at.timestamp(),
+        transaction.amount_minor, transaction.direction, transaction.category,
+        transaction.merchant, transaction.location,
+    )
+
+
+class Alert(NamedTuple):
+    user_id: uuid.UUID
+    kind: str
+    message: str
+    transaction_id: Optional[uuid.UUID]
+    occurred_at: float
+    data: dict
+
+
+class RollingWindow:
+    """
+    Count and amount over the last `buckets * bucket_seconds` seconds. Per-bucket values live
+    in fixed ring buffers and running totals are adjusted as buckets fall out of the window,
+    so reading the totals does not scan the ring.
+    """
+    __slots__ = ("bucket_seconds", "counts", "amounts", "last", "count", "amount")
+
+    def __init__(self, bucket_seconds: int, buckets: int):
+        self.bucket_seconds = bucket_seconds
+        self.counts = array("q", [0]) * buckets
+        self.amounts = array("q", [0]) * buckets
+        self.last = -1
+        self.count = 0
+        self.amount = 0
+
+    def _advance(self, bucket: int):
+        if bucket <= self.last:
+            return
+        size = len(self.counts)
+        if bucket - self.last >= size:
+            # The whole window has expired; the common case for users who pay a few times a day
+            self.counts = array("q", [0]) * size
+            self.amounts = array("q", [0]) * size
+            self.count = self.amount = 0
+            self.last = bucket
+            return
+        for expired in range(self.last + 1, bucket + 1):
+            slot = expired % size
+            self.count -= self.counts[slot]
+            self.amount -= self.amounts[slot]
+            self.counts[slot] = 0
+            self.amounts[slot] = 0
+        self.last = bucket
+
+    def add(self, at: float, amount: int):
+        bucket = int(at // self.bucket_seconds)
+        self._advance(bucket)
+        # Out-of-order events still count if their bucket is inside the window
+        if bucket <= self.last - len(self.counts):
+            return
+        slot = bucket % len(self.counts)
+        self.counts[slot] += 1
+        self.amounts[slot] += amount
+        self.count += 1
+        self.amount += amount
+
+    def totals(self, at: float):
+        """
+        Returns (count, amount) for the window ending at `at`.
+        """
+        self._advance(int(at // self.bucket_seconds))
+        return self.count, self.amount
+
+
+class NoveltySketch:
+    """
+    Bloom filter of merchants and locations seen by one user. A false positive only means a
+    novelty alert is missed; with 4096 bits and 4 hashes that is ~0.4% at 300 distinct values.
+    Hashes are CRC32/Adler-32 rather than hash() so snapshots stay valid across processes.
+    """
+    __slots__ = ("bits",)
+
+    def __init__(self):
+        self.bits = bytearray(SKETCH_BITS // 8)
+
+    def add(self, key: str) -> bool:
+        """
+        Adds a key and returns whether it was (probably) present already.
+        """
+        data = key.encode()
+        h1 = zlib.crc32(data)
+        h2 = zlib.adler32(data) | 1
+        bits = self.bits
+        present = True
+        for i in range(SKETCH_HASHES):
+            position = (h1 + i * h2) % SKETCH_BITS
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                present = False
+                bits[position >> 3] |= mask
+        return present
+
+
+def _normalize(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    return " ".join(value.lower().split()) or None
+
+
+class UserState:
+    __slots__ = ("budgets", "month", "spent", "hourly", "daily", "sketch", "history")
+
+    def __init__(self):
+        self.budgets: Dict[str, int] = {}
+        # Month index (year * 12 + month) that `spent` belongs to; None means reload it
+        self.month: Optional[int] = None
+        self.spent: Dict[str, int] = {}
+        self.hourly = RollingWindow(300, 12)
+        self.daily = RollingWindow(3600, 24)
+        self.sketch = NoveltySketch()
+        self.history = 0
+
+    def remember(self, merchant: Optional[str], location: Optional[str], count: int = 1) -> bool:
+        """
+        Records a merchant and location (already normalized) and returns whether both were new.
+        """
+        known_merchant = self.sketch.add("m:" + merchant) if merchant else True
+        known_location = self.sketch.add("l:" + location) if location else True
+        self.history += count
+        return not known_merchant and not known_location
+
+
+def _month_index(at: float) -> int:
+    day = datetime.fromtimestamp(at, timezone.utc)
+    return day.year * 12 + day.month - 1
+
+
+BUDGET_STATE = text("""
+    SELECT coalesce(b.category, r.category) AS category, b.amount_minor, coalesce(r.debit_minor, 0) AS spent
+    FROM (SELECT category, amount_minor FROM budgets WHERE user_id = :user_id) AS b
+    FULL OUTER JOIN (
+        SELECT category, debit_minor FROM category_monthly_rollups WHERE user_id = :user_id AND month = :month
+    ) AS r ON r.category = b.category
+""")
+
+RECENT_DEBITS = text("""
+    SELECT extract(epoch FROM occurred_at)::float8, amount_minor
+    FROM transactions
+    WHERE user_id = :user_id AND occurred_at >= :since AND direction = 'debit'
+      AND transaction_id IS DISTINCT FROM :transaction_id
+""")
+
+HISTORY_STATE = text("""
+    SELECT merchant, location, count(*) AS seen
+    FROM transactions
+    WHERE user_id = :user_id AND occurred_at >= :since
+      AND transaction_id IS DISTINCT FROM :transaction_id
+    GROUP BY merchant, location
+""")
+
+
+class AlertEngine:
+    """
+    Evaluates transactions one at a time against in-memory per-user state. process() is
+    synchronous and does no I/O; observe() loads missing state from the database first and
+    publishes the alerts. At most `max_users` states are kept, least recently used first out.
+    Requires a single worker or user-sticky routing; see the module docstring.
+    """
+
+    def __init__(self, queue: Optional[asyncio.Queue] = None, max_users: int = ALERT_MAX_USERS):
+        self.queue = queue
+        self.max_users = max_users
+        self._states: "OrderedDict[uuid.UUID, UserState]" = OrderedDict()
+        # One lock per user whose state is being loaded
+        self._loading: Dict[uuid.UUID, asyncio.Lock] = {}
+
+    def __len__(self):
+        return len(self._states)
+
+    def state(self, user_id: uuid.UUID) -> UserState:
+        state = self._states.get(user_id)
+        if state is None:
+            state = self._register(user_id, UserState())
+        else:
+            self._states.move_to_end(user_id)
+        return state
+
+    def _register(self, user_id: uuid.UUID, state: UserState) -> UserState:
+        self._states[user_id] = state
+        while len(self._states) > self.max_users:
+            self._states.popitem(last=False)
+        ALERT_ENGINE_USERS.set(len(self._states))
+        return state
+
+    def process(self, event: TransactionEvent) -> List[Alert]:
+        state = self.state(event.user_id)
+        merchant, location = _normalize(event.merchant), _normalize(event.location)
+        if event.direction != "debit":
+            state.remember(merchant, location)
+            return []
+
+        alerts = []
+        month = _month_index(event.occurred_at)
+        if state.month is None or month > state.month:
+            state.month = month
+            state.spent = {}
+        if month == state.month:
+            category = event.category or UNCATEGORIZED
+            before = state.spent.get(category, 0)
+            after = state.spent[category] = before + event.amount_minor
+            limit = state.budgets.get(category)
+            if limit:
+                if before <= limit < after:
+                    alerts.append(self._alert(event, "budget_exceeded",
+                                              f"You have gone over your {category or 'uncategorized'} budget",
+                                              budget_minor=limit, spent_minor=after))
+                elif before < limit * ALERT_BUDGET_WARNING_RATIO <= after:
+                    alerts.append(self._alert(event, "budget_warning",
+                                              f"You have used {after * 100 // limit}% of your {category or 'uncategorized'} budget",
+                                              budget_minor=limit, spent_minor=after))
+
+        # Velocity rules fire once, when the window first crosses the threshold
+        hourly_count, _ = state.hourly.totals(event.occurred_at)
+        _, daily_amount = state.daily.totals(event.occurred_at)
+        state.hourly.add(event.occurred_at, event.amount_minor)
+        state.daily.add(event.occurred_at, event.amount_minor)
+        if hourly_count < ALERT_VELOCITY_MAX_PER_HOUR <= hourly_count + 1:
+            alerts.append(self._alert(event, "velocity_count",
+                                      f"{hourly_count + 1} payments in the last hour", count=hourly_count + 1))
+        if daily_amount < ALERT_VELOCITY_MAX_AMOUNT_PER_DAY <= daily_amount + event.amount_minor:
+            alerts.append(self._alert(event, "velocity_amount", "Unusually high spending in the last 24 hours",
+                                      amount_minor=daily_amount + event.amount_minor))
+
+        experienced = state.history >= ALERT_NOVELTY_MIN_HISTORY
+        both_new = state.remember(merchant, location)
+        if (both_new and experienced and merchant and location
+                and event.amount_minor >= ALERT_NOVELTY_MIN_AMOUNT):
+            alerts.append(self._alert(event, "new_merchant_location",
+                                      f"Payment at a new merchant ({event.merchant}) in a new location ({event.location})",
+                                      amount_minor=event.amount_minor))
+        return alerts
+
+    @staticmethod
+    def _alert(event: TransactionEvent, kind: str, message: str, **data) -> Alert:
+        ALERTS_EMITTED.labels(kind=kind).inc()
+        return Alert(event.user_id, kind, message, event.transaction_id, event.occurred_at, data)
+
+    async def load_user(self, db: AsyncSession, user_id: uuid.UUID, exclude: Optional[TransactionEvent] = None,
+                        now: Optional[datetime] = None):
+        """
+        Loads budgets, this month's spend, the last day's debits and the recent
+        merchant/location history for a user. `exclude` is a transaction that is already
+        committed but has not been evaluated yet, so it is not counted twice.
+
+        The state is built aside and only registered once complete, so process() never runs
+        on half-loaded windows; concurrent loads of the same user wait for the first one.
+        """
+        lock = self._loading.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                if user_id in self._states:
+                    return
+                now = now or datetime.now(timezone.utc)
+                state = UserState()
+                await self._load_spend(db, state, user_id, exclude, now)
+                params = {"user_id": user_id, "transaction_id": exclude.transaction_id if exclude else None}
+                result = await db.execute(RECENT_DEBITS, {**params, "since": now - timedelta(days=1)})
+                for at, amount in result:
+                    state.hourly.add(at, amount)
+                    state.daily.add(at, amount)
+                result = await db.execute(HISTORY_STATE, {**params, "since": now - timedelta(days=ALERT_HISTORY_DAYS)})
+                for merchant, location, seen in result:
+                    state.remember(_normalize(merchant), _normalize(location), seen)
+                self._register(user_id, state)
+        finally:
+            if not lock.locked():
+                self._loading.pop(user_id, None)
+
+    async def _load_spend(self, db: AsyncSession, state: UserState, user_id: uuid.UUID,
+                          exclude: Optional[TransactionEvent], now: datetime):
+        month = month_start(now.date())
+        result = await db.execute(BUDGET_STATE, {"user_id": user_id, "month": month})
+        state.budgets, state.spent = {}, {}
+        for category, limit, spent in result:
+            if limit is not None:
+                state.budgets[category] = limit
+            if spent:
+                state.spent[category] = spent
+        state.month = month.year * 12 + month.month - 1
+        # The rollups already include the transaction about to be evaluated
+        if exclude is not None and exclude.direction == "debit" and _month_index(exclude.occurred_at) == state.month:
+            category = exclude.category or UNCATEGORIZED
+            state.spent[category] = state.spent.get(category, 0) - exclude.amount_minor
+
+    async def observe(self, db: AsyncSession, transaction) -> List[Alert]:
+        """
+        Evaluates a committed transaction and queues its alerts.
+        """
+        event = event_from_transaction(transaction)
+        state = self._states.get(event.user_id)
+        if state is None:
+            await self.load_user(db, event.user_id, event)
+        elif state.month is None:
+            await self._load_spend(db, state, event.user_id, event, datetime.now(timezone.utc))
+        alerts = self.process(event)
+        self.publish(alerts)
+        return alerts
+
+    def publish(self, alerts: Iterable[Alert]):
+        if self.queue is None:
+            return
+        for alert in alerts:
+            try:
+                self.queue.put_nowait(alert)
+            except asyncio.QueueFull:
+                ALERTS_DROPPED.inc()
+
+    def set_budget(self, user_id: uuid.UUID, category: str, amount_minor: Optional[int]):
+        state = self._states.get(user_id)
+        if state is None:
+            return
+        if amount_minor is None:
+            state.budgets.pop(category, None)
+        else:
+            state.budgets[category] = amount_minor
+
+    def refresh_spend(self, user_id: uuid.UUID):
+        """
+        Marks a user's monthly spend as stale, e.g. after an import or an edit, so it is
+        reloaded from the rollups before the next transaction is evaluated.
+        """
+        state = self._states.get(user_id)
+        if state is not None:
+            state.month = None
+
+    def replay(self, events: Iterable[TransactionEvent]) -> dict:
+        """
+        Runs events through the engine without publishing and reports the throughput.
+        """
+        kinds = CounterDict()
+        count = 0
+        start = time.perf_counter()
+        for event in events:
+            count += 1
+            for alert in self.process(event):
+                kinds[alert.kind] += 1
+        elapsed = time.perf_counter() - start
+        return {
+            "events": count,
+            "users": len(self._states),
+            "alerts": dict(kinds),
+            "elapsed_seconds": round(elapsed, 3),
+            "events_per_second": round(count / elapsed) if elapsed else None,
+        }
+
+    def snapshot(self) -> bytes:
+        return pickle.dumps({"version": SNAPSHOT_VERSION, "states": self._states}, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, data: bytes):
+        snapshot = pickle.loads(data)
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported alert engine snapshot version: {snapshot.get('version')}")
+        self._states = snapshot["states"]
+        ALERT_ENGINE_USERS.set(len(self._states))
+
+    def save_snapshot(self, path: str):
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(self.snapshot())
+        os.replace(temporary, path)
+
+    def load_snapshot(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as file:
+            self.restore(file.read())
+        # Budgets and spend may have changed while the snapshot sat on disk
+        for state in self._states.values():
+            state.month = None
+        logger.info("Restored alert state for %d users from %s", len(self._states), path)
+        return True
+
+
+_alert_engine: Optional[AlertEngine] = None
+
+
+def get_alert_engine() -> AlertEngine:
+    global _alert_engine
+    if _alert_engine is None:
+        _alert_engine = AlertEngine(asyncio.Queue(maxsize=ALERT_QUEUE_SIZE))
+        if ALERT_SNAPSHOT_PATH:
+            try:
+                _alert_engine.load_snapshot(ALERT_SNAPSHOT_PATH)
+            except Exception:
+                logger.exception("Could not restore alert state from %s", ALERT_SNAPSHOT_PATH)
+    return _alert_engine
+
+
+async def observe_transaction(db: AsyncSession, transaction):
+    """
+    Feeds a committed transaction to the alert engine. Alerting problems are logged and never
+    fail the request that wrote the transaction.
+    """
+    try:
+        await get_alert_engine().observe(db, transaction)
+    except Exception:
+        logger.exception("Alert evaluation failed for transaction %s", transaction.transaction_id)
+
+
+def refresh_alert_spend(user_id: uuid.UUID):
+    if _alert_engine is not None:
+        _alert_engine.refresh_spend(user_id)
+
+
+def update_alert_budget(user_id: uuid.UUID, category: str, amount_minor: Optional[int]):
+    if _alert_engine is not None:
+        _alert_engine.set_budget(user_id, category, amount_minor)
+
+
+def shutdown_alert_engine():
+    global _alert_engine
+    if _alert_engine is not None:
+        if ALERT_SNAPSHOT_PATH:
+            _alert_engine.save_snapshot(ALERT_SNAPSHOT_PATH)
+        _alert_engine = None
+
+
+REPLAY_QUERY = text("""
+    SELECT transaction_id, user_id, extract(epoch FROM occurred_at)::float8, amount_minor, direction,
+           category, merchant, location
+    FROM transactions
+    WHERE occurred_at >= :since AND (CAST(:user_id AS uuid) IS NULL OR user_id = :user_id)
+    ORDER BY occurred_at
+""")
+
+
+async def _replay(args) -> dict:
+    from app.db.database import engine
+
+    alert_engine = AlertEngine()
+    events = elapsed = 0
+    kinds = CounterDict()
+    start = time.perf_counter()
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(text("SELECT user_id, category, amount_minor FROM budgets"))
+            for user_id, category, amount_minor in result:
+                alert_engine.state(user_id).budgets[category] = amount_minor
+            # Server-side cursor, so the ledger is streamed in chunks instead of loaded whole
+            stream = await conn.stream(REPLAY_QUERY.execution_options(yield_per=args.chunk),
+                                       {"since": args.since, "user_id": args.user})
+            async for chunk in stream.partitions():
+                report = alert_engine.replay(TransactionEvent(*row) for row in chunk)
+                events += report["events"]
+                elapsed += report["elapsed_seconds"]
+                kinds.update(report["alerts"])
+    finally:
+        await engine.dispose()
+    return {
+        "events": events,
+        "users": len(alert_engine),
+        "alerts": dict(kinds),
+        "engine_seconds": round(elapsed, 3),
+        "events_per_second": round(events / elapsed) if elapsed else None,
+        "wall_seconds_including_fetch": round(time.perf_counter() - start, 3),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("replay",))
+    parser.add_argument("--user", type=uuid.UUID)
+    parser.add_argument("--since", type=lambda value: datetime.fromisoformat(value).replace(tzinfo=timezone.utc),
+                        default=datetime(1970, 1, 1, tzinfo=timezone.utc))
+    parser.add_argument("--chunk", type=int, default=10000)
+    print(asyncio.run(_replay(parser.parse_args())))
@@ -0,0 +1,338 @@
+"""
+Month-rollover funding of the Fixed, Spend and Save allocations.
+
+At the start of a month every user's funds are recomputed from the previous month: income
+is that month's credits, and each fund gets its rule's share (target_pct, or
+target_amount_minor when set; users without rules get ALLOCATION_DEFAULT_SPLIT). Fixed is
+raised to cover at least last month's spending in ALLOCATION_FIXED_CATEGORIES. Income left
+after Fixed, Save and Spend goes to Save, and so does whatever was left of last month's
+Spend. Fixed and Spend start each month afresh; Save keeps its balance. Rules carry over
+into the new month's rows.
+
+The job walks users in primary-key order, ALLOCATION_CHUNK_SIZE at a time. Per chunk:
+- one set-based query reads the chunk's previous-month totals (from the monthly rollups,
+  never the ledger) and its previous allocations, as one row of column arrays;
+- the math runs vectorized with NumPy on a process pool;
+- one INSERT ... ON CONFLICT writes all three funds of every user in the chunk.
+Fetching the next chunk and writing the previous one overlap with the math. Each chunk's
+upsert commits together with the run's checkpoint row in job_checkpoints, so a crashed or
+interrupted run picks up after the last committed chunk when started again. A finished
+month is skipped; with --restart it is recomputed to the same values, since the previous
+month's rows are only read.
+
+    python -m app.utils.allocations [--month 2026-11] [--chunk-size 5000] [--workers 2] [--restart]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from prometheus_client import Counter
+from sqlalchemy import text
+
+from app.db.partitions import month_start
+
+logger = logging.getLogger(__name__)
+
+ALLOCATION_CHUNK_SIZE = int(os.getenv("ALLOCATION_CHUNK_SIZE", "5000"))
+# Process pool size for the allocation math; 0 computes on the event loop
+ALLOCATION_WORKERS = int(os.getenv("ALLOCATION_WORKERS", "2"))
+# Split of income for funds without a rule, in percent
+ALLOCATION_DEFAULT_SPLIT = os.getenv("ALLOCATION_DEFAULT_SPLIT", "fixed=40,spend=40,save=20")
+# Spending in these categories is a commitment that Fixed has to cover
+ALLOCATION_FIXED_CATEGORIES = [
+    category.strip()
+    for category in os.getenv("ALLOCATION_FIXED_CATEGORIES", "bills,rent,emi,insurance,education").split(",")
+    if category.strip()
+]
+
+FIXED = "fixed"
+SPEND = "spend"
+SAVE = "save"
+FUNDS = (FIXED, SPEND, SAVE)
+# Stands in for NULL rules and missing rows in the column arrays
+NO_VALUE = -1
+
+ALLOCATION_USERS = Counter("allocation_rollover_users_total", "Users whose allocations the rollover job funded")
+
+FETCH_CHUNK = """
+    WITH chunk AS (
+        SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2
+    ), ledger AS (
+        SELECT r.user_id,
+               sum(r.credit_minor) AS income,
+               sum(r.debit_minor) FILTER (WHERE r.category = ANY($4::text[])) AS fixed_spent,
+               sum(r.debit_minor) AS spent
+        FROM category_monthly_rollups r JOIN chunk USING (user_id)
+        WHERE r.month = $3
+        GROUP BY r.user_id
+    ), previous AS (
+        SELECT a.user_id,
+               max(a.target_pct) FILTER (WHERE a.name = 'fixed') AS fixed_pct,
+               max(a.target_pct) FILTER (WHERE a.name = 'spend') AS spend_pct,
+               max(a.target_pct) FILTER (WHERE a.name = 'save') AS save_pct,
+               max(a.target_amount_minor) FILTER (WHERE a.name = 'fixed') AS fixed_amount,
+               max(a.target_amount_minor) FILTER (WHERE a.name = 'spend') AS spend_amount,
+               max(a.target_amount_minor) FILTER (WHERE a.name = 'save') AS save_amount,
+               max(a.funded_minor) FILTER (WHERE a.name = 'spend') AS spend_funded,
+               max(a.balance_minor) FILTER (WHERE a.name = 'save') AS save_balance
+        FROM allocations a JOIN chunk USING (user_id)
+        WHERE a.month = $3
+        GROUP BY a.user_id
+    )
+    SELECT array_agg(c.user_id),
+           array_agg(coalesce(l.income, 0)::bigint),
+           array_agg(coalesce(l.fixed_spent, 0)::bigint),
+           array_agg(coalesce(l.spent, 0)::bigint),
+           array_agg(coalesce(p.fixed_pct, -1)),
+           array_agg(coalesce(p.spend_pct, -1)),
+           array_agg(coalesce(p.save_pct, -1)),
+           array_agg(coalesce(p.fixed_amount, -1)),
+           array_agg(coalesce(p.spend_amount, -1)),
+           array_agg(coalesce(p.save_amount, -1)),
+           array_agg(coalesce(p.spend_funded, -1)),
+           array_agg(coalesce(p.save_balance, 0))
+    FROM chunk c LEFT JOIN ledger l USING (user_id) LEFT JOIN previous p USING (user_id)
+"""
+
+UPSERT_ALLOCATIONS = """
+    INSERT INTO allocations (user_id, month, name, target_pct, target_amount_minor, funded_minor, balance_minor,
+                             last_funded)
+    SELECT t.user_id, $2, t.name, nullif(t.pct, -1), nullif(t.amount, -1), t.funded, t.balance, now()
+    FROM unnest($1::uuid[], $3::text[], $4::smallint[], $5::bigint[], $6::bigint[], $7::bigint[])
+        AS t(user_id, name, pct, amount, funded, balance)
+    ON CONFLICT (user_id, month, name) DO UPDATE
+    SET funded_minor = excluded.funded_minor, balance_minor = excluded.balance_minor,
+        last_funded = excluded.last_funded, updated_at = now()
+"""
+
+SAVE_CHECKPOINT = """
+    INSERT INTO job_checkpoints (job, last_key, processed) VALUES ($1, $2, $3)
+    ON CONFLICT (job) DO UPDATE
+    SET last_key = excluded.last_key, processed = job_checkpoints.processed + excluded.processed, updated_at = now()
+"""
+
+# Chunk columns: user ids, income, fixed_spent, spent, three rule percentages, three rule
+# amounts, last month's Spend funding and last month's Save balance
+Chunk = Tuple[List[uuid.UUID], ...]
+
+
+def parse_split(spec: str) -> Tuple[int, int, int]:
+    """
+    Parses "fixed=40,spend=40,save=20" into percentages in FUNDS order.
+    """
+    shares = dict(item.split("=") for item in spec.split(","))
+    split = tuple(int(shares.get(fund, 0)) for fund in FUNDS)
+    if sum(split) > 100:
+        raise ValueError(f"Allocation split adds up to more than 100%: {spec}")
+    return split
+
+
+def compute_allocations(income: Sequence[int], fixed_spent: Sequence[int], spent: Sequence[int],
+                        pcts: Sequence[Sequence[int]], amounts: Sequence[Sequence[int]],
+                        spend_funded: Sequence[int], save_balance: Sequence[int],
+                        default_split: Tuple[int, int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Funds a chunk of users at once. `pcts` and `amounts` hold one sequence per fund in
+    FUNDS order, NO_VALUE where there is no rule. Returns (funded, balance), each of shape
+    (3, users) in FUNDS order. All amounts are integer minor units.
+    """
+    income = np.asarray(income, dtype=np.int64)
+    fixed_spent = np.asarray(fixed_spent, dtype=np.int64)
+    spent = np.asarray(spent, dtype=np.int64)
+    pcts = np.asarray(pcts, dtype=np.int64).reshape(len(FUNDS), -1)
+    amounts = np.asarray(amounts, dtype=np.int64).reshape(len(FUNDS), -1)
+    spend_funded = np.asarray(spend_funded, dtype=np.int64)
+
+    shares = np.where(pcts == NO_VALUE, np.asarray(default_split, dtype=np.int64)[:, None], pcts)
+    targets = np.where(amounts == NO_VALUE, income * shares // 100, amounts)
+
+    fixed = np.minimum(np.maximum(targets[0], fixed_spent), income)
+    save = np.minimum(targets[2], income - fixed)
+    spend = np.minimum(targets[1], income - fixed - save)
+    unallocated = income - fixed - save - spend
+    # What last month's Spend did not use moves to Save; fixed-category spending is Fixed's
+    unspent = np.where(spend_funded == NO_VALUE, 0, np.maximum(spend_funded - (spent - fixed_spent), 0))
+    save_funded = save + unallocated + unspent
+
+    funded = np.stack([fixed, spend, save_funded])
+    balance = np.stack([fixed, spend, np.asarray(save_balance, dtype=np.int64) + save_funded])
+    return funded, balance
+
+
+def _compute_chunk(columns: Chunk, default_split: Tuple[int, int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    # The chunk's columns after the user ids, which the worker process has no use for
+    income, fixed_spent, spent, *rules, spend_funded, save_balance = columns
+    return compute_allocations(income, fixed_spent, spent, rules[0:3], rules[3:6], spend_funded, save_balance,
+                               default_split)
+
+
+class AllocationRollover:
+    """
+    One month's rollover run, resumable through its job_checkpoints row.
+    """
+
+    def __init__(self, month: date, session_factory=None, engine=None, chunk_size: int = ALLOCATION_CHUNK_SIZE,
+                 workers: int = ALLOCATION_WORKERS, default_split: str = ALLOCATION_DEFAULT_SPLIT,
+                 fixed_categories: Sequence[str] = tuple(ALLOCATION_FIXED_CATEGORIES)):
+        self.month = month_start(month)
+        self.previous_month = month_start(self.month, -1)
+        self.job = f"allocation_rollover:{self.month:%Y-%m}"
+        self._session_factory = session_factory
+        self._engine = engine
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.default_split = parse_split(default_split)
+        self.fixed_categories = list(fixed_categories)
+
+    def _sessions(self):
+        if self._session_factory is None:
+            from app.db.database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    @staticmethod
+    async def _driver(session):
+        connection = await session.connection()
+        raw = await connection.get_raw_connection()
+        return raw.driver_connection
+
+    async def _fetch(self, after: uuid.UUID) -> Chunk:
+        async with self._sessions() as session:
+            driver = await self._driver(session)
+            row = await driver.fetchrow(FETCH_CHUNK, after, self.chunk_size, self.previous_month,
+                                        self.fixed_categories)
+        return tuple(column or [] for column in row)
+
+    async def _write(self, chunk: Chunk, funded: np.ndarray, balance: np.ndarray):
+        user_ids = chunk[0]
+        rules = chunk[4:10]
+        count = len(user_ids)
+        async with self._sessions() as session:
+            driver = await self._driver(session)
+            # Statements on the driver connection bypass the session's transaction, which the
+            # adapter only begins on its first execute; without this block each one autocommits
+            async with driver.transaction():
+                await driver.execute(
+                    UPSERT_ALLOCATIONS, user_ids * len(FUNDS), self.month,
+                    [fund for fund in FUNDS for _ in range(count)],
+                    [pct for fund_pcts in rules[0:3] for pct in fund_pcts],
+                    [amount for fund_amounts in rules[3:6] for amount in fund_amounts],
+                    funded.ravel().tolist(), balance.ravel().tolist(),
+                )
+                await driver.execute(SAVE_CHECKPOINT, self.job, str(max(user_ids)), count)
+        ALLOCATION_USERS.inc(count)
+
+    async def run(self, restart: bool = False) -> Dict[str, float]:
+        """
+        Funds every user's allocations for the month, continuing a previous run of the same
+        month unless `restart` is set. Returns counts and throughput.
+        """
+        if self._engine is None:
+            from app.db.database import engine
+            self._engine = engine
+        start = time.perf_counter()
+        job = {"job": self.job}
+        # A dedicated connection holds the advisory lock, so only one run per month goes at a time
+        async with self._engine.connect() as lock:
+            if not await lock.scalar(text("SELECT pg_try_advisory_lock(hashtext(:job))"), job):
+                raise RuntimeError(f"{self.job} is already running")
+            try:
+                if restart:
+                    await lock.execute(text("DELETE FROM job_checkpoints WHERE job = :job"), job)
+                checkpoint = (await lock.execute(
+                    text("SELECT last_key, processed, completed_at FROM job_checkpoints WHERE job = :job"), job
+                )).first()
+                await lock.commit()
+                if checkpoint is not None and checkpoint.completed_at is not None:
+                    logger.info("%s already completed at %s", self.job, checkpoint.completed_at)
+                    return {"users": 0, "resumed_after": checkpoint.processed, "elapsed_seconds": 0.0,
+                            "users_per_second": 0.0}
+
+                resumed_after = checkpoint.processed if checkpoint is not None else 0
+                last_key = checkpoint.last_key if checkpoint is not None else None
+                users = await self._process(uuid.UUID(last_key) if last_key else uuid.UUID(int=0))
+
+                await lock.execute(text(
+                    "INSERT INTO job_checkpoints (job, completed_at) VALUES (:job, now()) "
+                    "ON CONFLICT (job) DO UPDATE SET completed_at = now(), updated_at = now()"
+                ), job)
+                await lock.commit()
+            finally:
+                await lock.rollback()
+                await lock.execute(text("SELECT pg_advisory_unlock(hashtext(:job))"), job)
+                await lock.commit()
+
+        elapsed = time.perf_counter() - start
+        report = {
+            "users": users,
+            "resumed_after": resumed_after,
+            "elapsed_seconds": round(elapsed, 3),
+            "users_per_second": round(users / elapsed, 1) if elapsed else 0.0,
+        }
+        logger.info("%s finished: %s", self.job, report)
+        return report
+
+    async def _process(self, after: uuid.UUID) -> int:
+        loop = asyncio.get_running_loop()
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers else None
+        users = 0
+        next_fetch: Optional[asyncio.Task] = None
+        pending_write: Optional[asyncio.Task] = None
+        try:
+            chunk = await self._fetch(after)
+            while chunk[0]:
+                # The next chunk is read and the previous one written while this one is computed
+                next_fetch = asyncio.create_task(self._fetch(max(chunk[0])))
+                if executor is not None:
+                    funded, balance = await loop.run_in_executor(executor, _compute_chunk, chunk[1:],
+                                                                 self.default_split)
+                else:
+                    funded, balance = _compute_chunk(chunk[1:], self.default_split)
+                if pending_write is not None:
+                    await pending_write
+                pending_write = asyncio.create_task(self._write(chunk, funded, balance))
+                users += len(chunk[0])
+                chunk = await next_fetch
+            if pending_write is not None:
+                await pending_write
+        finally:
+            # After a failure, nothing is left running; the checkpoint says where to resume
+            for task in (next_fetch, pending_write):
+                if task is not None and not task.done():
+                    task.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        return users
+
+
+def _parse_month(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+async def _main(args) -> int:
+    from app.db.database import engine
+
+    month = _parse_month(args.month) if args.month else month_start(datetime.now(timezone.utc).date())
+    try:
+        report = await AllocationRollover(month, chunk_size=args.chunk_size, workers=args.workers).run(args.restart)
+    finally:
+        await engine.dispose()
+    print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--month", help="month to fund, YYYY-MM (default: current month)")
+    parser.add_argument("--chunk-size", type=int, default=ALLOCATION_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=ALLOCATION_WORKERS)
+    parser.add_argument("--restart", action="store_true", help="ignore the month's checkpoint and start over")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,263 @@
+"""
+Spending analytics computed with NumPy/pandas on a process pool.
+
+A user's transactions for the lookback window are fetched as one row of column arrays
+(array_agg in Postgres, decoded by asyncpg into lists), turned into NumPy arrays in a worker
+process and reduced with vectorized group sums and cumulative sums. The event loop only waits
+on the future. Reports are memoized per user and dropped whenever the user's ledger changes.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.utils.cache import TTLCache
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "2"))
+ANALYTICS_LOOKBACK_DAYS = int(os.getenv("ANALYTICS_LOOKBACK_DAYS", "365"))
+# Days, months and hours are bucketed in the users' local time
+ANALYTICS_TIMEZONE = os.getenv("ANALYTICS_TIMEZONE", "Asia/Kolkata")
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "5000"))
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "300"))
+# Start the worker processes when the app starts rather than on the first report
+ANALYTICS_PREWARM = os.getenv("ANALYTICS_PREWARM", "true").lower() == "true"
+MOVING_AVERAGE_WINDOWS = (7, 30)
+
+Columns = Tuple[List[int], List[int], List[bool], List[str]]
+
+FETCH_COLUMNS = """
+    SELECT array_agg((extract(epoch FROM occurred_at) * 1000000)::bigint),
+           array_agg(amount_minor),
+           array_agg(direction = 'debit'),
+           array_agg(coalesce(category, ''))
+    FROM transactions
+    WHERE user_id = $1 AND occurred_at >= $2
+"""
+
+
+async def fetch_columns(db: AsyncSession, user_id: uuid.UUID, since: datetime) -> Columns:
+    """
+    Returns (epoch microseconds, amounts, is_debit, categories) for the user's transactions
+    since `since`, as four parallel lists. No ORM objects or per-row records are built.
+    """
+    connection = await db.connection()
+    raw = await connection.get_raw_connection()
+    row = await raw.driver_connection.fetchrow(FETCH_COLUMNS, user_id, since)
+    return tuple(column or [] for column in row)
+
+
+def compute_report(timestamps_us: List[int], amounts: List[int], is_debit: List[bool], categories: List[str],
+                   now_us: int, tz: str = ANALYTICS_TIMEZONE, lookback_days: int = ANALYTICS_LOOKBACK_DAYS) -> dict:
+    """
+    Builds the full analytics report from column arrays. Pure function so it can run in a
+    worker process; amounts stay in integer minor units throughout.
+    """
+    # NumPy and pandas take a third of a second to import, so only the pool's workers do
+    import numpy as np
+    import pandas as pd
+
+    # Local wall-clock times as naive datetime64, so calendar arithmetic is plain integer math
+    local = pd.to_datetime(np.asarray(timestamps_us, dtype=np.int64), unit="us", utc=True) \
+        .tz_convert(tz).tz_localize(None).values
+    days = local.astype("datetime64[D]")
+    today = pd.Timestamp(now_us, unit="us", tz="UTC").tz_convert(tz).tz_localize(None) \
+        .to_datetime64().astype("datetime64[D]")
+    first_day = today - np.timedelta64(lookback_days - 1, "D")
+
+    in_window = (days >= first_day) & (days <= today)
+    local, days = local[in_window], days[in_window]
+    amount = np.asarray(amounts, dtype=np.int64)[in_window]
+    debit = np.asarray(is_debit, dtype=bool)[in_window]
+    categories = np.asarray(categories, dtype=object)[in_window]
+    spend = np.where(debit, amount, 0)
+    income = amount - spend
+
+    # Monthly trend with month-over-month deltas, including months without any spending
+    month_keys = np.arange(first_day.astype("datetime64[M]"), today.astype("datetime64[M]") + 1)
+    month_index = (days.astype("datetime64[M]") - month_keys[0]).astype(np.int64)
+    spent_by_month = _sum_by(month_index, spend, len(month_keys))
+    received_by_month = _sum_by(month_index, income, len(month_keys))
+    change = np.diff(spent_by_month, prepend=0)
+    previous = np.concatenate(([0], spent_by_month[:-1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change_pct = np.where(previous > 0, change * 100.0 / previous, np.nan)
+    monthly = [
+        {
+            "month": str(month_keys[i]),
+            "spent_minor": int(spent_by_month[i]),
+            "received_minor": int(received_by_month[i]),
+            "spent_change_minor": int(change[i]) if i else None,
+            "spent_change_pct": round(float(change_pct[i]), 2) if i and not np.isnan(change_pct[i]) else None,
+        }
+        for i in range(len(month_keys))
+    ]
+
+    # Daily spending with trailing moving averages (shorter windows at the start of the range)
+    day_index = (days - first_day).astype(np.int64)
+    spent_by_day = _sum_by(day_index, spend, lookback_days)
+    running = np.concatenate(([0], np.cumsum(spent_by_day)))
+    positions = np.arange(1, lookback_days + 1)
+    averages = {}
+    for window in MOVING_AVERAGE_WINDOWS:
+        start = np.maximum(positions - window, 0)
+        averages[window] = (running[positions] - running[start]) / (positions - start)
+    day_keys = np.arange(first_day, today + 1)
+    daily = [
+        {
+            "date": str(day_keys[i]),
+            "spent_minor": int(spent_by_day[i]),
+            **{f"moving_average_{window}d": round(float(averages[window][i]), 2) for window in MOVING_AVERAGE_WINDOWS},
+        }
+        for i in range(lookback_days)
+    ]
+
+    # Category share of spending over the whole window
+    codes, names = pd.factorize(categories)
+    spent_by_category = _sum_by(codes[debit], amount[debit], len(names))
+    count_by_category = np.bincount(codes[debit], minlength=len(names))
+    total_spent = int(spent_by_category.sum())
+    order = np.argsort(-spent_by_category, kind="stable")
+    category_share = [
+        {
+            "category": names[i],
+            "spent_minor": int(spent_by_category[i]),
+            "txn_count": int(count_by_category[i]),
+            "share_pct": round(float(spent_by_category[i]) * 100 / total_spent, 2) if total_spent else 0.0,
+        }
+        for i in order if count_by_category[i]
+    ]
+
+    # Weekday x hour heatmap; 1970-01-01 was a Thursday, so +3 makes Monday 0
+    weekday = (days.astype(np.int64) + 3) % 7
+    hour = (local.astype("datetime64[h]") - days).astype(np.int64)
+    heatmap = _sum_by(weekday * 24 + hour, spend, 7 * 24).reshape(7, 24)
+
+    return {
+        "timezone": tz,
+        "lookback_days": lookback_days,
+        "total_spent_minor": int(spend.sum()),
+        "total_received_minor": int(income.sum()),
+        "monthly": monthly,
+        "daily": daily,
+        "categories": category_share,
+        "heatmap": heatmap.tolist(),
+    }
+
+
+def _import_numeric_modules():
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+
+
+def _sum_by(index: "np.ndarray", values: "np.ndarray", size: int) -> "np.ndarray":
+    """
+    Exact integer group sums: np.add.at keeps int64, unlike bincount's float weights.
+    """
+    import numpy as np
+
+    totals = np.zeros(size, dtype=np.int64)
+    np.add.at(totals, index, values)
+    return totals
+
+
+class AnalyticsEngine:
+    """
+    Computes and memoizes per-user analytics reports. Reports are cached for
+    ANALYTICS_CACHE_TTL and dropped by invalidate() when the user's ledger changes; a report
+    that was being computed while an invalidation happened is returned but not cached.
+    Caches are per worker process, so the TTL bounds how stale another worker can be.
+    """
+
+    def __init__(self, workers: int = ANALYTICS_WORKERS, lookback_days: int = ANALYTICS_LOOKBACK_DAYS,
+                 tz: str = ANALYTICS_TIMEZONE, cache_size: int = ANALYTICS_CACHE_SIZE,
+                 cache_ttl: float = ANALYTICS_CACHE_TTL):
+        self.workers = workers
+        self.lookback_days = lookback_days
+        self.timezone = tz
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cache = TTLCache("analytics", cache_size, cache_ttl)
+        self._generations = TTLCache("analytics_generations", cache_size, cache_ttl)
+        # Generations come from one counter, so a re-created entry never repeats an old value
+        self._counter = itertools.count(1)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def report(self, db: AsyncSession, user_id: uuid.UUID) -> dict:
+        report = self._cache.get(user_id)
+        if report is not None:
+            return report
+
+        generation = self._generations.get(user_id, 0, record=False)
+        now = datetime.now(timezone.utc)
+        # One extra day covers the local day that started before the UTC cut-off
+        columns = await fetch_columns(db, user_id, now - timedelta(days=self.lookback_days + 1))
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        report = await loop.run_in_executor(
+            self._get_executor(), compute_report, *columns,
+            int(now.timestamp() * 1_000_000), self.timezone, self.lookback_days,
+        )
+        logger.debug("Analytics for %s: %d rows in %.1f ms", user_id, len(columns[0]),
+                     (time.perf_counter() - start) * 1000)
+
+        if self._generations.get(user_id, 0, record=False) == generation:
+            self._cache.set(user_id, report)
+        return report
+
+    def warm(self):
+        """
+        Starts the worker processes and has each import NumPy and pandas, without waiting,
+        so the first report does not pay for either.
+        """
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_import_numeric_modules)
+
+    def invalidate(self, user_id: uuid.UUID):
+        self._cache.pop(user_id)
+        self._generations.set(user_id, next(self._counter))
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+_analytics_engine: Optional[AnalyticsEngine] = None
+
+
+def get_analytics_engine() -> AnalyticsEngine:
+    global _analytics_engine
+    if _analytics_engine is None:
+        _analytics_engine = AnalyticsEngine()
+    return _analytics_engine
+
+
+def invalidate_analytics(user_id: uuid.UUID):
+    """
+    Drops the user's memoized report. Call after any write to the user's transactions.
+    """
+    if _analytics_engine is not None:
+        _analytics_engine.invalidate(user_id)
+
+
+def shutdown_analytics_engine(wait: bool = True):
+    global _analytics_engine
+    if _analytics_engine is not None:
+        _analytics_engine.shutdown(wait=wait)
+        _analytics_engine = None
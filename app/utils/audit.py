@@ -0,0 +1,311 @@
+"""
+Write-behind audit log.
+
+Route handlers record events through the request-scoped RequestAudit dependency; recording
+only appends a tuple to an in-process buffer, so auth requests never wait on the audit
+table. A background task COPYs the buffer into audit_logs when it reaches
+AUDIT_BATCH_SIZE events or every AUDIT_FLUSH_INTERVAL seconds. When the database is slow
+or down (a flush fails or times out, or the buffer reaches AUDIT_MAX_BUFFER) events are
+appended to JSON-lines spill files in AUDIT_SPILL_DIR instead of piling up in memory, and
+replayed into the table once writes succeed again. stop() flushes whatever is left.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from fastapi import Request
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "true").lower() == "true"
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "1000"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+# A flush slower than this is abandoned and its events are spilled
+AUDIT_FLUSH_TIMEOUT = float(os.getenv("AUDIT_FLUSH_TIMEOUT", "5.0"))
+AUDIT_MAX_BUFFER = int(os.getenv("AUDIT_MAX_BUFFER", "50000"))
+AUDIT_SPILL_DIR = os.getenv("AUDIT_SPILL_DIR", "audit_spill")
+# After a failed replay, spill files are left alone for this long
+AUDIT_REPLAY_RETRY_SECONDS = float(os.getenv("AUDIT_REPLAY_RETRY_SECONDS", "30"))
+
+SUCCESS = "success"
+FAILURE = "failure"
+
+AUDIT_COLUMNS = ("audit_id", "occurred_at", "user_id", "action", "outcome", "ip_address", "user_agent", "details")
+
+AUDIT_EVENTS = Counter("audit_events_total", "Audit events by where they ended up", ["result"])
+AUDIT_BUFFERED = Gauge("audit_buffered_events", "Audit events waiting to be written")
+AUDIT_FLUSH_SECONDS = Histogram("audit_flush_seconds", "Time taken to write one batch of audit events")
+
+
+def _to_spill_line(record: tuple) -> str:
+    audit_id, occurred_at, user_id, *rest = record
+    return json.dumps([str(audit_id), occurred_at.isoformat(), str(user_id) if user_id else None, *rest])
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by someone else
+    return True
+
+
+def _from_spill_line(line: str) -> tuple:
+    audit_id, occurred_at, user_id, *rest = json.loads(line)
+    return (uuid.UUID(audit_id), datetime.fromisoformat(occurred_at),
+            uuid.UUID(user_id) if user_id else None, *rest)
+
+
+class AuditLogWriter:
+    """
+    Buffers audit events in memory and writes them in batches with COPY. record() never
+    blocks and never raises.
+    """
+
+    def __init__(self, session_factory=None, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL, flush_timeout: float = AUDIT_FLUSH_TIMEOUT,
+                 max_buffer: int = AUDIT_MAX_BUFFER, spill_dir: str = AUDIT_SPILL_DIR):
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_timeout = flush_timeout
+        self.max_buffer = max_buffer
+        self.spill_dir = spill_dir
+        self.spill_path = os.path.join(spill_dir, f"audit-{os.getpid()}.jsonl")
+        self._buffer: List[tuple] = []
+        self._spill_lock = threading.Lock()
+        self._spilled = False
+        self._next_replay = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            # Spill files left by an earlier run (of any worker) are replayed first
+            self._spilled = bool(self._spill_files())
+            self._task = asyncio.create_task(self._run())
+
+    def record(self, action: str, outcome: str = SUCCESS, user_id: Optional[uuid.UUID] = None,
+               ip_address: Optional[str] = None, user_agent: Optional[str] = None, details: Optional[dict] = None):
+        self._buffer.append((
+            uuid.uuid4(), datetime.now(timezone.utc), user_id, action, outcome, ip_address,
+            user_agent[:255] if user_agent else None, json.dumps(details) if details else None,
+        ))
+        if self._task is None:
+            self.start()
+        if len(self._buffer) >= self.max_buffer:
+            # The flush task is not keeping up; move the backlog to disk
+            backlog, self._buffer = self._buffer, []
+            asyncio.get_running_loop().run_in_executor(None, self._spill, backlog)
+        elif len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        AUDIT_BUFFERED.set(len(self._buffer))
+
+    def _spill(self, records: List[tuple]):
+        try:
+            with self._spill_lock:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    f.writelines(_to_spill_line(record) + "\n" for record in records)
+            self._spilled = True
+            AUDIT_EVENTS.labels(result="spilled").inc(len(records))
+        except OSError:
+            logger.exception("Could not spill %d audit events to %s; they are lost", len(records), self.spill_path)
+            AUDIT_EVENTS.labels(result="dropped").inc(len(records))
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                if await self.flush() and self._spilled and time.monotonic() >= self._next_replay:
+                    await self.replay_spill()
+            except Exception:
+                logger.exception("Audit flush failed")
+
+    async def _write(self, records: List[tuple]):
+        if self._session_factory is None:
+            from app.db.database import SessionLocal
+            self._session_factory = SessionLocal
+        start = time.perf_counter()
+        async with self._session_factory() as session:
+            connection = await session.connection()
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table("audit_logs", records=records, columns=AUDIT_COLUMNS)
+            await session.commit()
+        AUDIT_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    async def flush(self) -> bool:
+        """
+        Writes everything buffered, a batch at a time. Batches that cannot be written in
+        time are spilled to disk. Returns whether every batch reached the database.
+        """
+        pending, self._buffer = self._buffer, []
+        AUDIT_BUFFERED.set(0)
+        offset = 0
+        try:
+            for offset in range(0, len(pending), self.batch_size):
+                batch = pending[offset:offset + self.batch_size]
+                try:
+                    await asyncio.wait_for(self._write(batch), timeout=self.flush_timeout)
+                    AUDIT_EVENTS.labels(result="written").inc(len(batch))
+                except Exception as e:
+                    logger.warning("Writing %d audit events failed (%r); spilling them", len(batch), e)
+                    # Anything after a failed batch would most likely fail the same way
+                    await asyncio.to_thread(self._spill, pending[offset:])
+                    return False
+        except asyncio.CancelledError:
+            # The swapped-out batches are only referenced here; keep the unwritten ones on disk
+            self._spill(pending[offset:])
+            raise
+        return True
+
+    def _spill_files(self) -> List[str]:
+        """
+        Spill files waiting to be replayed: every audit-*.jsonl, plus files a replay claimed
+        but never finished, i.e. claimed by this process or by one that no longer runs.
+        """
+        paths = glob.glob(os.path.join(self.spill_dir, "audit-*.jsonl"))
+        for path in glob.glob(os.path.join(self.spill_dir, "audit-*.jsonl.*.replaying")):
+            try:
+                pid = int(path.rsplit(".", 2)[1])
+            except ValueError:
+                continue
+            if pid == os.getpid() or not _process_alive(pid):
+                paths.append(path)
+        return paths
+
+    @staticmethod
+    def _read_spill(path: str) -> List[tuple]:
+        """
+        Parses a claimed spill file. Lines that do not parse, such as a last line cut short
+        by a killed worker, are moved to a .rejected file next to it instead of failing the file.
+        """
+        records, rejected = [], []
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(_from_spill_line(line))
+                except (ValueError, TypeError):
+                    rejected.append(line if line.endswith("\n") else line + "\n")
+        if rejected:
+            quarantine = path[:path.index(".jsonl") + len(".jsonl")] + ".rejected"
+            with open(quarantine, "a", encoding="utf-8") as f:
+                f.writelines(rejected)
+            logger.warning("Moved %d unreadable spilled audit events to %s", len(rejected), quarantine)
+            AUDIT_EVENTS.labels(result="rejected").inc(len(rejected))
+        return records
+
+    async def replay_spill(self) -> int:
+        """
+        Moves spilled events into the table. Each file is renamed before it is read, so
+        events spilled meanwhile go to a fresh file and nothing is replayed twice.
+        """
+        self._spilled = False
+        replayed = 0
+        for path in self._spill_files():
+            original = path[:path.index(".jsonl") + len(".jsonl")]
+            claimed = f"{original}.{os.getpid()}.replaying"
+            if path != claimed:
+                try:
+                    with self._spill_lock:
+                        os.rename(path, claimed)
+                except OSError:
+                    continue  # Another worker claimed it
+            records: List[tuple] = []
+            offset = 0
+            try:
+                records = await asyncio.to_thread(self._read_spill, claimed)
+                for offset in range(0, len(records), self.batch_size):
+                    await asyncio.wait_for(self._write(records[offset:offset + self.batch_size]), self.flush_timeout)
+            except Exception as e:
+                # Put the rest back for a later attempt; batches already written are not repeated.
+                # A file that could not even be read stays claimed and is picked up again.
+                logger.warning("Replaying spilled audit events failed (%r); retrying later", e)
+                if records:
+                    await asyncio.to_thread(self._spill, records[offset:])
+                    os.remove(claimed)
+                self._spilled = True
+                self._next_replay = time.monotonic() + AUDIT_REPLAY_RETRY_SECONDS
+                return replayed
+            os.remove(claimed)
+            replayed += len(records)
+            AUDIT_EVENTS.labels(result="replayed").inc(len(records))
+        return replayed
+
+    async def stop(self):
+        """
+        Lets the loop finish its current flush and exit, then writes what is still buffered.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+_audit_writer: Optional[AuditLogWriter] = None
+
+
+def get_audit_writer() -> Optional[AuditLogWriter]:
+    """
+    Returns the process-wide writer, or None when AUDIT_ENABLED is off.
+    """
+    global _audit_writer
+    if AUDIT_ENABLED and _audit_writer is None:
+        _audit_writer = AuditLogWriter()
+    return _audit_writer
+
+
+async def shutdown_audit_writer():
+    global _audit_writer
+    if _audit_writer is not None:
+        await _audit_writer.stop()
+        _audit_writer = None
+
+
+class RequestAudit:
+    """
+    Records audit events tagged with the current request's client address and user agent.
+    Behind a proxy, run uvicorn with --proxy-headers so the client address is the real one.
+    """
+
+    __slots__ = ("ip_address", "user_agent", "writer")
+
+    def __init__(self, request: Request):
+        self.ip_address = request.client.host if request.client else None
+        self.user_agent = request.headers.get("user-agent")
+        self.writer = get_audit_writer()
+
+    def record(self, action: str, outcome: str = SUCCESS, user_id: Optional[uuid.UUID] = None, **details):
+        if self.writer is not None:
+            self.writer.record(action, outcome, user_id, self.ip_address, self.user_agent, details or None)
+
+
+def request_audit(request: Request) -> RequestAudit:
+    """
+    Dependency giving a route a RequestAudit for the current request.
+    """
+    return RequestAudit(request)
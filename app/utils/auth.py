@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from fastapi import Depends, Header, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import jwt, JWTError
+from prometheus_client import Gauge
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import RevokedAccessToken, User
+from app.utils.cache import TTLCache
+from app.utils.refresh_tokens import REVOCATION_SYNC_INTERVAL, REVOCATION_SYNC_OVERLAP
+from app.utils.security import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+
+logger = logging.getLogger(__name__)
+
+ACCESS_REVOCATIONS = Gauge("auth_access_revocations", "Access token revocations held by this worker", ["kind"])
+
+# Configuration for the authentication caches
+# The caches are per worker, so invalidation only reaches the worker it runs in;
+# the TTLs bound how long other workers may keep serving a stale entry. Revocations
+# are not cached here: they live in the database and in AccessRevocations.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "100000"))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+# Shared secret for operator-only endpoints; unset disables them
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+
+# Decoded access token claims, keyed by a digest of the raw token
+token_cache = TTLCache("auth_token_claims", TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+# CurrentUser snapshots, keyed by token subject (the user's email)
+user_cache = TTLCache("auth_users", USER_CACHE_SIZE, USER_CACHE_TTL)
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+class CurrentUser:
+    """
+    Read-only snapshot of a user row, safe to share between requests.
+    Load the ORM object with User.get() when a route needs to modify the user.
+    """
+    __slots__ = ("user_id", "name", "email", "phone", "is_phone_verified", "created_at", "updated_at")
+
+    def __init__(self, user: User):
+        self.user_id = user.user_id
+        self.name = user.name
+        self.email = user.email
+        self.phone = user.phone
+        self.is_phone_verified = user.is_phone_verified
+        self.created_at = user.created_at
+        self.updated_at = user.updated_at
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+def _decode_access_token(token: str, digest: bytes) -> dict:
+    claims = token_cache.get(digest)
+    if claims is not None:
+        return claims
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if claims.get("type") != "access" or not claims.get("sub"):
+        raise credentials_exception
+    # Never cache a token past its own expiry
+    token_cache.set(digest, claims, ttl=min(TOKEN_CACHE_TTL, claims["exp"] - time.time()))
+    return claims
+
+
+class AccessRevocations:
+    """
+    Per-worker mirror of revoked access tokens (revoked_access_tokens) and of per-subject
+    cutoffs (users.tokens_not_before), so a signed-out token is rejected without a query.
+    Unlike the caches above nothing is evicted for space: an entry only goes once every
+    token it could match has expired. Other workers pick up a revocation on their next
+    sync, polled like the refresh token RevocationFilter.
+    """
+
+    def __init__(self, session_factory=None, interval: float = REVOCATION_SYNC_INTERVAL,
+                 overlap: timedelta = REVOCATION_SYNC_OVERLAP):
+        self._session_factory = session_factory
+        self.interval = interval
+        self.overlap = overlap
+        # digest -> token expiry, as a unix timestamp
+        self._tokens: Dict[bytes, float] = {}
+        # subject -> cutoff; tokens issued before it are rejected
+        self._not_before: Dict[str, float] = {}
+        self._tokens_synced_until: Optional[datetime] = None
+        self._subjects_synced_until: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self._tokens
+
+    def add_token(self, digest: bytes, expires_at: float):
+        self._tokens[digest] = expires_at
+
+    def add_cutoff(self, subject: str, not_before: float):
+        if not_before > self._not_before.get(subject, 0):
+            self._not_before[subject] = not_before
+
+    def is_revoked(self, subject: str, issued_at: float) -> bool:
+        not_before = self._not_before.get(subject)
+        return not_before is not None and issued_at < not_before
+
+    def prune(self):
+        now = time.time()
+        for digest in [digest for digest, expires_at in self._tokens.items() if expires_at <= now]:
+            del self._tokens[digest]
+        # A token issued before the cutoff has expired by cutoff + its lifetime
+        horizon = now - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        for subject in [subject for subject, cutoff in self._not_before.items() if cutoff <= horizon]:
+            del self._not_before[subject]
+
+    def report(self):
+        ACCESS_REVOCATIONS.labels(kind="tokens").set(len(self._tokens))
+        ACCESS_REVOCATIONS.labels(kind="subjects").set(len(self._not_before))
+
+    async def sync(self):
+        """
+        Pulls revocations made since the newest one seen so far, less the overlap (or every
+        one that can still match an unexpired token on the first run).
+        """
+        if self._session_factory is None:
+            from app.db.database import SessionLocal
+            self._session_factory = SessionLocal
+        now = datetime.now(timezone.utc)
+        tokens = select(RevokedAccessToken.token_hash, RevokedAccessToken.expires_at,
+                        RevokedAccessToken.revoked_at).where(RevokedAccessToken.expires_at > now)
+        if self._tokens_synced_until is not None:
+            tokens = tokens.where(RevokedAccessToken.revoked_at >= self._tokens_synced_until - self.overlap)
+        if self._subjects_synced_until is not None:
+            since = self._subjects_synced_until - self.overlap
+        else:
+            since = now - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        subjects = select(User.email, User.tokens_not_before).where(User.tokens_not_before >= since)
+        async with self._session_factory() as session:
+            token_rows = (await session.execute(tokens)).all()
+            subject_rows = (await session.execute(subjects)).all()
+        for token_hash, expires_at, revoked_at in token_rows:
+            self._tokens[token_hash] = expires_at.timestamp()
+            if self._tokens_synced_until is None or revoked_at > self._tokens_synced_until:
+                self._tokens_synced_until = revoked_at
+        for subject, not_before in subject_rows:
+            self.add_cutoff(subject, not_before.timestamp())
+            if self._subjects_synced_until is None or not_before > self._subjects_synced_until:
+                self._subjects_synced_until = not_before
+        if self._tokens_synced_until is None:
+            self._tokens_synced_until = now
+        if self._subjects_synced_until is None:
+            self._subjects_synced_until = now
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+                self.prune()
+                self.report()
+            except Exception:
+                logger.exception("Failed to sync access token revocations")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+_access_revocations: Optional[AccessRevocations] = None
+
+
+def get_access_revocations() -> AccessRevocations:
+    global _access_revocations
+    if _access_revocations is None:
+        _access_revocations = AccessRevocations()
+    return _access_revocations
+
+
+async def shutdown_access_revocations():
+    global _access_revocations
+    if _access_revocations is not None:
+        await _access_revocations.stop()
+        _access_revocations = None
+
+
+async def _load_user(subject: str) -> Optional[CurrentUser]:
+    from app.db.database import SessionLocal  # Only opened on a cache miss
+
+    async with SessionLocal() as session:
+        result = await session.execute(select(User).where(User.email == subject))
+        user = result.scalar_one_or_none()
+    return CurrentUser(user) if user else None
+
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> CurrentUser:
+    """
+    Dependency that resolves the bearer access token to the current user.
+    With warm caches this needs no database round trip and no session checkout.
+    """
+    if credentials is None:
+        raise credentials_exception
+    token = credentials.credentials
+    digest = token_digest(token)
+    revocations = get_access_revocations()
+    if digest in revocations:
+        raise credentials_exception
+
+    claims = _decode_access_token(token, digest)
+    subject = claims["sub"]
+    if revocations.is_revoked(subject, claims.get("iat", 0)):
+        raise credentials_exception
+
+    user = user_cache.get(subject)
+    if user is None:
+        user = await _load_user(subject)
+        if user is None:
+            raise credentials_exception
+        user_cache.set(subject, user)
+    return user
+
+
+def require_admin(x_admin_key: Optional[str] = Header(default=None)):
+    """
+    Dependency guarding admin endpoints with the X-Admin-Key header.
+    """
+    if not ADMIN_API_KEY or not x_admin_key or not hmac.compare_digest(x_admin_key, ADMIN_API_KEY):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+
+
+def invalidate_user(subject: str):
+    """
+    Drops the cached user row, e.g. after a profile update.
+    """
+    user_cache.pop(subject)
+
+
+async def revoke_user_tokens(db: AsyncSession, subject: str):
+    """
+    Rejects every access token issued so far for the subject, which is what a password
+    change or "sign out everywhere" needs. The caller commits; this worker applies the
+    cutoff straight away, the others on their next sync.
+    """
+    # iat has whole-second resolution, so the cutoff is rounded up to the next second: a
+    # token issued earlier in this second is rejected too (so is one issued later in it)
+    now = datetime.now(timezone.utc)
+    not_before = now.replace(microsecond=0)
+    if now.microsecond:
+        not_before += timedelta(seconds=1)
+    await db.execute(
+        update(User).where(User.email == subject).values(tokens_not_before=not_before)
+    )
+    user_cache.pop(subject)
+    get_access_revocations().add_cutoff(subject, not_before.timestamp())
+
+
+async def revoke_access_token(db: AsyncSession, token: str):
+    """
+    Rejects a single access token from now on, e.g. on sign out. Tokens that no longer
+    validate need nothing. The caller commits.
+    """
+    digest = token_digest(token)
+    try:
+        claims = _decode_access_token(token, digest)
+    except HTTPException:
+        return
+    token_cache.pop(digest)
+    expires_at = datetime.fromtimestamp(claims["exp"], timezone.utc)
+    await db.execute(
+        insert(RevokedAccessToken)
+        .values(token_hash=digest, expires_at=expires_at)
+        .on_conflict_do_nothing(index_elements=[RevokedAccessToken.token_hash])
+    )
+    get_access_revocations().add_token(digest, claims["exp"])
+
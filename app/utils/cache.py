@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from prometheus_client import Counter
+
+CACHE_HITS = Counter("cache_hits_total", "Cache hits", ["cache"])
+CACHE_MISSES = Counter("cache_misses_total", "Cache misses", ["cache"])
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Entries evicted to stay within the size bound", ["cache"])
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries also expire after a TTL.
+    Not shared between workers; every worker keeps its own copy.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, clock=time.monotonic):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, record=False) is not None
+
+    def get(self, key: Hashable, default: Any = None, record: bool = True) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            value, deadline = entry
+            if deadline > self._clock():
+                self._data.move_to_end(key)
+                if record:
+                    self.hits += 1
+                    CACHE_HITS.labels(cache=self.name).inc()
+                return value
+            del self._data[key]
+        if record:
+            self.misses += 1
+            CACHE_MISSES.labels(cache=self.name).inc()
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self._data[key] = (value, self._clock() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+            CACHE_EVICTIONS.labels(cache=self.name).inc()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
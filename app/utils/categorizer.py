@@ -0,0 +1,360 @@
+"""
+Transaction auto-categorization.
+
+A scikit-learn pipeline (character n-gram hashing vectorizer + linear classifier) predicts a
+category from merchant, UPI app and location. It is trained offline and saved uncompressed
+with joblib, so each worker loads it with mmap_mode="r" and the coefficient matrix is shared
+through the page cache instead of copied into every process.
+
+Online requests go through CategorizationBatcher: merchants seen before are answered from an
+exact-match LRU cache; everything else waits a few milliseconds to be predicted together with
+other pending requests in one vectorized call. Statement imports categorize whole batches.
+
+    python -m app.utils.categorizer train [--csv labelled.csv] [--out models/categorizer.joblib]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Histogram
+
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CATEGORIZER_MODEL_PATH = os.getenv("CATEGORIZER_MODEL_PATH", "models/categorizer.joblib")
+# Predictions below this probability are left uncategorized
+CATEGORIZER_MIN_CONFIDENCE = float(os.getenv("CATEGORIZER_MIN_CONFIDENCE", "0.5"))
+CATEGORIZER_BATCH_SIZE = int(os.getenv("CATEGORIZER_BATCH_SIZE", "256"))
+CATEGORIZER_BATCH_WAIT_MS = float(os.getenv("CATEGORIZER_BATCH_WAIT_MS", "5"))
+CATEGORIZER_CACHE_SIZE = int(os.getenv("CATEGORIZER_CACHE_SIZE", "100000"))
+CATEGORIZER_CACHE_TTL = float(os.getenv("CATEGORIZER_CACHE_TTL", "86400"))
+HASH_FEATURES = 2 ** 18
+
+CATEGORIZER_PREDICTIONS = Counter(
+    "categorizer_predictions_total", "Categorization requests by how they were answered", ["source"],
+)
+CATEGORIZER_BATCH_SIZES = Histogram(
+    "categorizer_batch_size", "Transactions per model call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+
+Features = Tuple[Optional[str], Optional[str], Optional[str]]
+
+_MISSING = object()
+
+
+def merchant_key(merchant: Optional[str]) -> Optional[str]:
+    if not merchant:
+        return None
+    return " ".join(merchant.lower().split()) or None
+
+
+def feature_text(merchant: Optional[str], upi_app: Optional[str], location: Optional[str]) -> str:
+    return f"{merchant or ''} | {upi_app or ''} | {location or ''}".lower()
+
+
+def build_model():
+    """
+    Returns an untrained pipeline. The hashing vectorizer has no vocabulary to store, so the
+    saved model is a fixed-size coefficient matrix whatever the training set size.
+    """
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import make_pipeline
+
+    return make_pipeline(
+        HashingVectorizer(analyzer="char_wb", ngram_range=(2, 4), n_features=HASH_FEATURES,
+                          alternate_sign=False, norm="l2"),
+        SGDClassifier(loss="log_loss", alpha=1e-6, max_iter=20, tol=None, random_state=0),
+    )
+
+
+def train_model(features: Sequence[Features], labels: Sequence[str]):
+    model = build_model()
+    model.fit([feature_text(*row) for row in features], labels)
+    return model
+
+
+def save_model(model, path: str = CATEGORIZER_MODEL_PATH):
+    import joblib
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Uncompressed so the arrays can be memory-mapped on load
+    joblib.dump(model, path, compress=0)
+
+
+class Categorizer:
+    """
+    A loaded model plus the exact-match merchant cache in front of it. predict_batch() and
+    categorize() are synchronous and CPU-bound; call them from a worker thread.
+    """
+
+    def __init__(self, model, min_confidence: float = CATEGORIZER_MIN_CONFIDENCE,
+                 cache_size: int = CATEGORIZER_CACHE_SIZE, cache_ttl: float = CATEGORIZER_CACHE_TTL):
+        self.model = model
+        self.min_confidence = min_confidence
+        self.cache = TTLCache("categorizer_merchants", cache_size, cache_ttl)
+        self._classes = model.classes_
+        # The cache is shared by the event loop and import threads
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = CATEGORIZER_MODEL_PATH, **kwargs) -> "Categorizer":
+        import joblib
+
+        start = time.perf_counter()
+        model = joblib.load(path, mmap_mode="r")
+        logger.info("Loaded categorization model from %s in %.0f ms", path, (time.perf_counter() - start) * 1000)
+        return cls(model, **kwargs)
+
+    def cached(self, merchant: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """
+        Returns (hit, category) for an exact merchant match.
+        """
+        key = merchant_key(merchant)
+        if key is None:
+            return False, None
+        with self._lock:
+            category = self.cache.get(key, _MISSING)
+        if category is _MISSING:
+            return False, None
+        CATEGORIZER_PREDICTIONS.labels(source="cache").inc()
+        return True, category
+
+    def remember(self, features: Sequence[Features], categories: Sequence[Optional[str]]):
+        with self._lock:
+            for (merchant, _, _), category in zip(features, categories):
+                key = merchant_key(merchant)
+                if key is not None:
+                    self.cache.set(key, category)
+
+    def predict_batch(self, features: Sequence[Features]) -> List[Optional[str]]:
+        """
+        Predicts categories for many transactions in one model call. Low-confidence
+        predictions come back as None.
+        """
+        if not features:
+            return []
+        CATEGORIZER_BATCH_SIZES.observe(len(features))
+        CATEGORIZER_PREDICTIONS.labels(source="model").inc(len(features))
+        probabilities = self.model.predict_proba([feature_text(*row) for row in features])
+        best = probabilities.argmax(axis=1)
+        confidence = probabilities[range(len(best)), best]
+        return [
+            str(self._classes[index]) if score >= self.min_confidence else None
+            for index, score in zip(best, confidence)
+        ]
+
+    def categorize(self, features: Sequence[Features]) -> List[Optional[str]]:
+        """
+        Cache first, then one model call for the misses, whose answers are remembered.
+        """
+        results: List[Optional[str]] = [None] * len(features)
+        misses = []
+        for i, row in enumerate(features):
+            hit, category = self.cached(row[0])
+            if hit:
+                results[i] = category
+            else:
+                misses.append(i)
+        missed = [features[i] for i in misses]
+        predicted = self.predict_batch(missed)
+        self.remember(missed, predicted)
+        for i, category in zip(misses, predicted):
+            results[i] = category
+        return results
+
+
+class CategorizationBatcher:
+    """
+    Collects single-transaction requests for up to `max_wait_ms` (or until `max_batch` are
+    pending) and predicts them with one model call in a worker thread.
+    """
+
+    def __init__(self, categorizer: Categorizer, max_batch: int = CATEGORIZER_BATCH_SIZE,
+                 max_wait_ms: float = CATEGORIZER_BATCH_WAIT_MS):
+        self.categorizer = categorizer
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[Features, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def categorize(self, merchant: Optional[str], upi_app: Optional[str] = None,
+                         location: Optional[str] = None) -> Optional[str]:
+        hit, category = self.categorizer.cached(merchant)
+        if hit:
+            return category
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((merchant, upi_app, location), future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._predict(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _predict(self, batch: List[Tuple[Features, asyncio.Future]]):
+        features = [features for features, _ in batch]
+        try:
+            categories = await asyncio.to_thread(self.categorizer.predict_batch, features)
+        except Exception:
+            # Categories are optional; the transactions are stored uncategorized instead
+            logger.exception("Categorization batch of %d failed", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+            return
+        self.categorizer.remember(features, categories)
+        for (_, future), category in zip(batch, categories):
+            if not future.done():
+                future.set_result(category)
+
+    async def close(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def categorize_records(batches: Iterable[List[tuple]], categorizer: Optional[Categorizer],
+                       category_index: int, merchant_index: int) -> Iterator[List[tuple]]:
+    """
+    Pipeline stage for bulk imports: fills in missing categories batch by batch. Records are
+    tuples with merchant, UPI app and location in consecutive fields starting at merchant_index.
+    """
+    for batch in batches:
+        if categorizer is not None:
+            missing = [i for i, record in enumerate(batch) if record[category_index] is None]
+            if missing:
+                features = [batch[i][merchant_index:merchant_index + 3] for i in missing]
+                try:
+                    categories = categorizer.categorize(features)
+                except Exception:
+                    logger.exception("Categorizing %d imported rows failed; leaving them uncategorized", len(missing))
+                    categories = []
+                for i, category in zip(missing, categories):
+                    if category is not None:
+                        record = batch[i]
+                        batch[i] = record[:category_index] + (category,) + record[category_index + 1:]
+        yield batch
+
+
+_categorizer: Optional[Categorizer] = None
+_categorizer_loaded = False
+_batcher: Optional[CategorizationBatcher] = None
+
+
+def get_categorizer() -> Optional[Categorizer]:
+    """
+    Loads the model once per process. Returns None when no model has been trained yet, in
+    which case transactions are simply left uncategorized.
+    """
+    global _categorizer, _categorizer_loaded
+    if not _categorizer_loaded:
+        _categorizer_loaded = True
+        if os.path.exists(CATEGORIZER_MODEL_PATH):
+            _categorizer = Categorizer.load(CATEGORIZER_MODEL_PATH)
+        else:
+            logger.warning("No categorization model at %s; auto-categorization is off", CATEGORIZER_MODEL_PATH)
+    return _categorizer
+
+
+async def load_categorizer() -> Optional[Categorizer]:
+    """
+    Loads the model at startup in a worker thread, so joblib never blocks the event loop
+    on the first create, sync or import.
+    """
+    return await asyncio.to_thread(get_categorizer)
+
+
+def get_categorization_batcher() -> Optional[CategorizationBatcher]:
+    global _batcher
+    if _batcher is None:
+        categorizer = get_categorizer()
+        if categorizer is not None:
+            _batcher = CategorizationBatcher(categorizer)
+    return _batcher
+
+
+async def shutdown_categorization_batcher():
+    global _batcher
+    if _batcher is not None:
+        await _batcher.close()
+        _batcher = None
+
+
+async def _load_training_rows() -> Tuple[List[Features], List[str]]:
+    """
+    Uses the categories users have already assigned, one row per distinct
+    (merchant, UPI app, location, category).
+    """
+    from sqlalchemy import text
+    from app.db.database import engine
+
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(text(
+                "SELECT DISTINCT merchant, upi_app, location, category FROM transactions "
+                "WHERE category IS NOT NULL AND merchant IS NOT NULL"
+            ))
+            rows = result.fetchall()
+    finally:
+        await engine.dispose()
+    return [tuple(row[:3]) for row in rows], [row[3] for row in rows]
+
+
+def _read_training_csv(path: str) -> Tuple[List[Features], List[str]]:
+    import csv
+
+    features, labels = [], []
+    with open(path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            if row.get("category"):
+                features.append((row.get("merchant") or None, row.get("upi_app") or None, row.get("location") or None))
+                labels.append(row["category"])
+    return features, labels
+
+
+def _train(args):
+    from sklearn.model_selection import train_test_split
+
+    if args.csv:
+        features, labels = _read_training_csv(args.csv)
+    else:
+        features, labels = asyncio.run(_load_training_rows())
+    if len(set(labels)) < 2:
+        raise SystemExit("Need labelled rows for at least two categories")
+
+    train_x, test_x, train_y, test_y = train_test_split(features, labels, test_size=0.1, random_state=0)
+    start = time.perf_counter()
+    model = train_model(train_x, train_y)
+    accuracy = model.score([feature_text(*row) for row in test_x], test_y)
+    print(f"trained on {len(train_x):,} rows in {time.perf_counter() - start:.1f}s, "
+          f"holdout accuracy {accuracy:.3f} over {len(model.classes_)} categories")
+    save_model(train_model(features, labels), args.out)
+    print(f"saved {args.out}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("train",))
+    parser.add_argument("--csv", help="labelled rows with merchant, upi_app, location, category columns "
+                                      "(default: categorized transactions from the database)")
+    parser.add_argument("--out", default=CATEGORIZER_MODEL_PATH)
+    _train(parser.parse_args())
@@ -0,0 +1,124 @@
+"""
+Local stand-in for the FCM HTTP v1 API, for tests and offline load tests.
+
+Speaks just enough HTTP/1.1 (with keep-alive) for httpx: every POST to
+/v1/projects/<project>/messages:send is accepted after an optional latency, except tokens
+starting with "invalid", which get FCM's 404 UNREGISTERED error, and a random share of
+requests that get 503 when a failure rate is set.
+
+    python -m app.utils.fake_fcm --port 9099 --latency-ms 20 --failure-rate 0.01
+    # then run the API with FCM_BASE_URL=http://127.0.0.1:9099 FCM_PROJECT_ID=local PUSH_ENABLED=true
+"""
+import argparse
+import asyncio
+import json
+import random
+from collections import Counter
+from typing import Optional
+
+UNREGISTERED = json.dumps({
+    "error": {
+        "code": 404, "message": "Requested entity was not found.", "status": "NOT_FOUND",
+        "details": [{"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError", "errorCode": "UNREGISTERED"}],
+    },
+}).encode()
+UNAVAILABLE = json.dumps({"error": {"code": 503, "message": "The service is currently unavailable.",
+                                    "status": "UNAVAILABLE"}}).encode()
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+class FakeFCMServer:
+    """
+    Counts what it receives in `stats` (accepted, unregistered, unavailable, connections).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, failure_rate: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.stats = Counter()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                status, payload = await self._respond(request_line.split()[1].decode(), body)
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, path: str, body: bytes):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not path.endswith("/messages:send"):
+            return 404, b"{}"
+        try:
+            token = json.loads(body)["message"]["token"]
+        except (ValueError, KeyError, TypeError):
+            return 400, b'{"error": {"code": 400, "status": "INVALID_ARGUMENT"}}'
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.stats["unavailable"] += 1
+            return 503, UNAVAILABLE
+        if token.startswith("invalid"):
+            self.stats["unregistered"] += 1
+            return 404, UNREGISTERED
+        self.stats["accepted"] += 1
+        return 200, json.dumps({"name": f"projects/local/messages/{self.stats['accepted']}"}).encode()
+
+
+async def _serve(args):
+    server = FakeFCMServer(args.host, args.port, args.latency_ms / 1000, args.failure_rate)
+    await server.start()
+    print(f"fake FCM listening on {server.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        print(dict(server.stats))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -1,69 +1,181 @@
+import asyncio
+import logging
 import os
 import random
-from datetime import datetime, timezone
+import secrets
+import time
+from typing import Dict, List, Optional
 
-from twilio.rest import Client
-from dotenv import load_dotenv
-from fastapi import HTTPException
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from prometheus_client import Counter, Gauge, Histogram
 
-from app.db.models import User, OTPVerification
+from app.utils.sms import SMSProvider, SMSProviderError, create_sms_provider
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-async def send_otp(db: AsyncSession, phone: str):
+# Configuration for the OTP dispatcher
+OTP_QUEUE_SIZE = int(os.getenv("OTP_QUEUE_SIZE", "1000"))
+OTP_WORKERS = int(os.getenv("OTP_WORKERS", "4"))
+OTP_BATCH_SIZE = int(os.getenv("OTP_BATCH_SIZE", "20"))
+OTP_MAX_RETRIES = int(os.getenv("OTP_MAX_RETRIES", "3"))
+OTP_RETRY_BASE_DELAY = float(os.getenv("OTP_RETRY_BASE_DELAY", "0.5"))
+
+OTP_QUEUE_DEPTH = Gauge("otp_dispatch_queue_depth", "OTP messages waiting to be sent")
+OTP_SEND_LATENCY = Histogram("otp_send_latency_seconds", "Time taken by the SMS provider to accept an OTP message")
+OTP_SEND_TOTAL = Counter("otp_send_total", "OTP send attempts by result", ["result"])
+OTP_COALESCED_TOTAL = Counter("otp_coalesced_total", "OTP requests merged into an already queued message")
+
+
+class OTPQueueFull(Exception):
+    """
+    Raised when the dispatch queue cannot accept more messages.
+    """
+
+
+class OTPDispatcher:
+    """
+    In-process async OTP sender.
+
+    Requests are put on a bounded queue and sent by worker tasks, so the HTTP handler
+    returns as soon as the OTP is stored. Each worker drains up to `batch_size` queued
+    phones at a time and sends them concurrently. If a phone already has a message
+    waiting, a new request only replaces its code, so repeated taps never send
+    duplicate SMS. Failed sends are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, provider: SMSProvider, queue_size: int = OTP_QUEUE_SIZE, workers: int = OTP_WORKERS,
+                 batch_size: int = OTP_BATCH_SIZE, max_retries: int = OTP_MAX_RETRIES,
+                 retry_base_delay: float = OTP_RETRY_BASE_DELAY):
+        self.provider = provider
+        self.queue_size = queue_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[str, str] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def enqueue(self, phone: str, otp_code: str):
+        """
+        Queues an OTP for delivery without waiting for the provider.
+        """
+        if not self._tasks:
+            self.start()
+        if phone in self._pending:
+            self._pending[phone] = otp_code
+            OTP_COALESCED_TOTAL.inc()
+            return
+        try:
+            self._queue.put_nowait(phone)
+        except asyncio.QueueFull:
+            raise OTPQueueFull("OTP dispatch queue is full")
+        self._pending[phone] = otp_code
+        OTP_QUEUE_DEPTH.set(len(self._pending))
+
+    async def _worker(self):
+        while True:
+            phones = [await self._queue.get()]
+            while len(phones) < self.batch_size and not self._queue.empty():
+                phones.append(self._queue.get_nowait())
+            # Take the latest code for each phone; a request arriving after this point queues a new send
+            batch = [(phone, self._pending.pop(phone)) for phone in phones]
+            OTP_QUEUE_DEPTH.set(len(self._pending))
+            try:
+                # One failing send must not cancel the rest of the batch, nor end the worker
+                results = await asyncio.gather(
+                    *(self._send_with_retry(phone, code) for phone, code in batch), return_exceptions=True
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        OTP_SEND_TOTAL.labels(result="failed").inc()
+                        logger.error("Sending an OTP message failed", exc_info=result)
+            except Exception:
+                logger.exception("OTP dispatch batch failed")
+            finally:
+                for _ in phones:
+                    self._queue.task_done()
+
+    async def _send_with_retry(self, phone: str, otp_code: str):
+        body = f"Your OTP code is {otp_code}"
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                await self.provider.send(phone, body)
+                OTP_SEND_LATENCY.observe(time.perf_counter() - start)
+                OTP_SEND_TOTAL.labels(result="sent").inc()
+                return
+            except SMSProviderError as e:
+                OTP_SEND_LATENCY.observe(time.perf_counter() - start)
+                if attempt == self.max_retries:
+                    OTP_SEND_TOTAL.labels(result="failed").inc()
+                    logger.warning("Failed to send OTP message after %d attempts: %s", attempt + 1, e)
+                    return
+                OTP_SEND_TOTAL.labels(result="retry").inc()
+                delay = self.retry_base_delay * (2 ** attempt)
+                await asyncio.sleep(delay + random.uniform(0, delay))
+
+    async def drain(self):
+        """
+        Waits until every queued message has been sent or given up on.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self, drain: bool = True):
+        if drain:
+            await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pending.clear()
+        await self.provider.close()
+
+
+_dispatcher: Optional[OTPDispatcher] = None
+
+
+def get_otp_dispatcher() -> OTPDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OTPDispatcher(create_sms_provider())
+    return _dispatcher
+
+
+def set_otp_dispatcher(dispatcher: Optional[OTPDispatcher]):
     """
-    Generates and sends an OTP to the specified phone number using Twilio.
+    Replaces the process-wide dispatcher, e.g. with one using FakeSMSProvider in tests.
     """
-    TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-    TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-    TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
-
-    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
-    otp = random.randint(100000, 999999)
-
-    # In a production app, you would handle the Twilio response and errors
-    try:
-        message = client.messages.create(
-            body=f"Your OTP code is {otp}",
-            from_=TWILIO_PHONE_NUMBER,
-            to=phone
-        )
-        print(f"OTP message sent successfully with SID: {message.sid}")
-    except Exception as e:
-        print(f"Failed to send OTP message: {e}")
-        # Depending on your app's logic, you might want to raise an HTTPException here
-        # raise HTTPException(status_code=500, detail="Failed to send OTP")
-
-    return otp
-
-async def verify_otp(db: AsyncSession, user_id: str, otp_code: str):
+    global _dispatcher
+    _dispatcher = dispatcher
+
+
+async def shutdown_otp_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop()
+        _dispatcher = None
+
+
+def generate_otp() -> str:
+    """
+    Generates a random 6-digit OTP code.
+    """
+    return str(secrets.randbelow(900000) + 100000)
+
+
+async def send_otp(phone: str, otp_code: str):
     """
-    Verifies the provided OTP code against the database.
+    Queues the OTP for delivery by SMS. Returns immediately; delivery happens in the background.
     """
-    otp_verification = await db.execute(
-        select(OTPVerification).where(
-            OTPVerification.user_id == user_id,
-            OTPVerification.otp_code == otp_code,
-            OTPVerification.verified == False,
-            OTPVerification.expires_at > datetime.now(timezone.utc)
-        )
-    )
-    otp_verification = otp_verification.scalar_one_or_none()
-    if not otp_verification:
-        raise HTTPException(status_code=400, detail="Invalid or expired OTP")
-
-    # Mark OTP as verified and update user's phone verification status
-    otp_verification.verified = True
-    user = await User.get(db, user_id)
-    if user:
-        user.is_phone_verified = True
-    
-    await db.commit()
-    await db.refresh(otp_verification)
-    if user:
-        await db.refresh(user)
-
-    return {"message": "OTP verified successfully"}
\ No newline at end of file
+    get_otp_dispatcher().enqueue(phone, otp_code)
@@ -0,0 +1,322 @@
+"""
+OTP challenge storage.
+
+Pending challenges live in memory and expire through a min-heap keyed on expiry time,
+so expiring entries costs O(log n) each and nothing ever scans the whole store.
+Attempt counters live on the challenge itself. A verified or locked challenge stays behind
+as a tombstone until its deadline, so it can be neither replayed nor retried. Persisting
+challenges to the otp_verifications table is optional and asynchronous; with several
+workers it is also where a worker verifies a challenge issued elsewhere. Wrong codes are
+written behind to the row as well, and the table only answers for a user's newest
+unverified challenge, so guesses spread over workers share one attempt budget.
+
+With OTP_AUDIT_ENABLED=false, the default, challenges exist only in the memory of the
+worker that issued them: in a multi-worker deployment every verify that lands on a
+different worker fails. Enable it, or route OTP requests to workers by user.
+
+Memory bound: each pending challenge costs roughly 450 bytes (the dict entry, the
+slotted OTPChallenge, the email key, the code string and one heap entry), so one
+million pending challenges need about 450 MB per worker; see
+benchmarks/bench_otp_store.py to re-measure. Entries, tombstones included, are dropped
+when they expire, and OTP_STORE_MAX_ENTRIES caps the total.
+"""
+import asyncio
+import heapq
+import hmac
+import itertools
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, update
+
+from app.db.models import OTPVerification
+
+logger = logging.getLogger(__name__)
+
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "600"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+OTP_STORE_MAX_ENTRIES = int(os.getenv("OTP_STORE_MAX_ENTRIES", "1000000"))
+OTP_AUDIT_ENABLED = os.getenv("OTP_AUDIT_ENABLED", "false").lower() == "true"
+OTP_AUDIT_BATCH_SIZE = int(os.getenv("OTP_AUDIT_BATCH_SIZE", "500"))
+OTP_AUDIT_FLUSH_INTERVAL = float(os.getenv("OTP_AUDIT_FLUSH_INTERVAL", "1.0"))
+# Records kept per kind while the database is unreachable; the oldest go first beyond this
+OTP_AUDIT_MAX_BUFFER = int(os.getenv("OTP_AUDIT_MAX_BUFFER", "100000"))
+
+# Results of OTPStore.verify
+VERIFIED = "verified"
+INVALID = "invalid"
+MISSING = "missing"
+LOCKED = "locked"
+# The challenge was already verified
+USED = "used"
+
+
+class OTPStoreFull(Exception):
+    """
+    Raised when the store already holds OTP_STORE_MAX_ENTRIES pending challenges.
+    """
+
+
+class OTPChallenge:
+    __slots__ = ("otp_id", "user_id", "code", "attempts", "deadline", "seq", "closed")
+
+    def __init__(self, otp_id: uuid.UUID, user_id: uuid.UUID, code: str, deadline: float, seq: int):
+        self.otp_id = otp_id
+        self.user_id = user_id
+        self.code = code
+        self.attempts = 0
+        self.deadline = deadline
+        self.seq = seq
+        # VERIFIED or LOCKED once the challenge can no longer be answered
+        self.closed: Optional[str] = None
+
+
+class InMemoryOTPStore:
+    """
+    Holds one pending challenge per key (the user's email). Issuing a new challenge
+    replaces the previous one; the stale heap entry is skipped when it surfaces.
+    """
+
+    def __init__(self, ttl: int = OTP_TTL_SECONDS, max_attempts: int = OTP_MAX_ATTEMPTS,
+                 max_entries: int = OTP_STORE_MAX_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.max_entries = max_entries
+        self._clock = clock
+        self._challenges: Dict[str, OTPChallenge] = {}
+        self._expiry_heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._challenges)
+
+    def expire(self) -> int:
+        """
+        Drops every challenge whose deadline has passed. Returns the number removed.
+        """
+        now = self._clock()
+        heap = self._expiry_heap
+        removed = 0
+        while heap and heap[0][0] <= now:
+            _, seq, key = heapq.heappop(heap)
+            challenge = self._challenges.get(key)
+            if challenge is not None and challenge.seq == seq:
+                del self._challenges[key]
+                removed += 1
+        # Stale entries left behind by replaced or consumed challenges are compacted away
+        if len(heap) > 2 * len(self._challenges) + 1024:
+            self._expiry_heap = [(c.deadline, c.seq, k) for k, c in self._challenges.items()]
+            heapq.heapify(self._expiry_heap)
+        return removed
+
+    def issue(self, key: str, user_id: uuid.UUID, code: str) -> OTPChallenge:
+        self.expire()
+        if key not in self._challenges and len(self._challenges) >= self.max_entries:
+            raise OTPStoreFull("Too many pending OTP challenges")
+        seq = next(self._seq)
+        challenge = OTPChallenge(uuid.uuid4(), user_id, code, self._clock() + self.ttl, seq)
+        self._challenges[key] = challenge
+        heapq.heappush(self._expiry_heap, (challenge.deadline, seq, key))
+        return challenge
+
+    def verify(self, key: str, code: str) -> Tuple[str, Optional[OTPChallenge]]:
+        """
+        Checks a code against the pending challenge for `key`.
+        Returns (result, challenge). The challenge is closed on success or once attempts run
+        out; after that it answers USED or LOCKED until it expires.
+        """
+        self.expire()
+        challenge = self._challenges.get(key)
+        if challenge is None or challenge.deadline <= self._clock():
+            return MISSING, None
+        if challenge.closed == VERIFIED:
+            return USED, challenge
+        if challenge.closed == LOCKED:
+            return LOCKED, challenge
+        if hmac.compare_digest(challenge.code, code):
+            challenge.closed = VERIFIED
+            return VERIFIED, challenge
+        challenge.attempts += 1
+        if challenge.attempts >= self.max_attempts:
+            challenge.closed = LOCKED
+            return LOCKED, challenge
+        return INVALID, challenge
+
+
+class OTPAuditWriter:
+    """
+    Write-behind persistence of OTP challenges to otp_verifications, for audit only.
+    Events are buffered and flushed in batches by a background task; requests never wait on it.
+    A flush that fails puts its records back in front of the buffers for the next one; while
+    the database stays away, each buffer keeps at most `max_buffer` records, newest first.
+    """
+
+    def __init__(self, session_factory=None, batch_size: int = OTP_AUDIT_BATCH_SIZE,
+                 flush_interval: float = OTP_AUDIT_FLUSH_INTERVAL, max_buffer: int = OTP_AUDIT_MAX_BUFFER):
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._issued: List[dict] = []
+        self._verified: List[uuid.UUID] = []
+        self._locked: List[uuid.UUID] = []
+        # Wrong codes per challenge, added to the row's attempts
+        self._attempts: Dict[uuid.UUID, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def record_issued(self, challenge: OTPChallenge, ttl: int):
+        self._issued.append({
+            "otp_id": challenge.otp_id,
+            "user_id": challenge.user_id,
+            "otp_code": challenge.code,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl),
+            "verified": False,
+            # Issue time, not flush time, decides which of a user's challenges is the newest
+            "created_at": datetime.now(timezone.utc),
+        })
+        self._maybe_wake()
+
+    def record_verified(self, challenge: OTPChallenge):
+        self._verified.append(challenge.otp_id)
+        self._maybe_wake()
+
+    def record_locked(self, challenge: OTPChallenge):
+        self._locked.append(challenge.otp_id)
+        self._maybe_wake()
+
+    def record_attempt(self, challenge: OTPChallenge):
+        self._attempts[challenge.otp_id] = self._attempts.get(challenge.otp_id, 0) + 1
+        self._maybe_wake()
+
+    def _maybe_wake(self):
+        if self._task is None:
+            self.start()
+        if len(self._issued) + len(self._verified) + len(self._locked) + len(self._attempts) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to persist OTP audit records")
+
+    async def flush(self):
+        if not self._issued and not self._verified and not self._locked and not self._attempts:
+            return
+        issued, self._issued = self._issued, []
+        verified, self._verified = self._verified, []
+        locked, self._locked = self._locked, []
+        attempts, self._attempts = self._attempts, {}
+        try:
+            await self._write(issued, verified, locked, attempts)
+        except BaseException:
+            # Cancelled or failed: nothing was committed, so the whole batch goes back
+            self._requeue(issued, verified, locked, attempts)
+            raise
+
+    def _requeue(self, issued: List[dict], verified: List[uuid.UUID], locked: List[uuid.UUID],
+                 attempts: Dict[uuid.UUID, int]):
+        now = datetime.now(timezone.utc)
+        # A challenge that has expired meanwhile can no longer be verified anywhere
+        self._issued[:0] = [record for record in issued if record["expires_at"] > now]
+        self._verified[:0] = verified
+        self._locked[:0] = locked
+        for otp_id, count in self._attempts.items():
+            attempts[otp_id] = attempts.get(otp_id, 0) + count
+        self._attempts = attempts
+        for name in ("_issued", "_verified", "_locked"):
+            buffer = getattr(self, name)
+            if len(buffer) > self.max_buffer:
+                logger.warning("OTP audit buffer %s is full; dropping %d records", name,
+                               len(buffer) - self.max_buffer)
+                del buffer[:len(buffer) - self.max_buffer]
+        if len(self._attempts) > self.max_buffer:
+            logger.warning("OTP audit buffer _attempts is full; dropping %d records",
+                           len(self._attempts) - self.max_buffer)
+            self._attempts = dict(itertools.islice(
+                self._attempts.items(), len(self._attempts) - self.max_buffer, None
+            ))
+
+    async def _write(self, issued: List[dict], verified: List[uuid.UUID], locked: List[uuid.UUID],
+                     attempts: Dict[uuid.UUID, int]):
+        if self._session_factory is None:
+            from app.db.database import SessionLocal
+            self._session_factory = SessionLocal
+        async with self._session_factory() as session:
+            if issued:
+                await session.execute(insert(OTPVerification), issued)
+            if attempts:
+                table = OTPVerification.__table__
+                await session.execute(
+                    table.update()
+                    .where(table.c.otp_id == bindparam("b_otp_id"))
+                    .values(attempts=table.c.attempts + bindparam("b_attempts")),
+                    [{"b_otp_id": otp_id, "b_attempts": count} for otp_id, count in attempts.items()],
+                )
+            if verified:
+                await session.execute(
+                    update(OTPVerification)
+                    .where(OTPVerification.otp_id.in_(verified))
+                    .values(verified=True)
+                    .execution_options(synchronize_session=False)
+                )
+            if locked:
+                # Other workers verifying from the table see the challenge as locked too
+                await session.execute(
+                    update(OTPVerification)
+                    .where(OTPVerification.otp_id.in_(locked))
+                    .values(attempts=OTP_MAX_ATTEMPTS)
+                    .execution_options(synchronize_session=False)
+                )
+            await session.commit()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+_store: Optional[InMemoryOTPStore] = None
+_audit_writer: Optional[OTPAuditWriter] = None
+
+
+def get_otp_store() -> InMemoryOTPStore:
+    global _store
+    if _store is None:
+        _store = InMemoryOTPStore()
+    return _store
+
+
+def get_otp_audit_writer() -> Optional[OTPAuditWriter]:
+    """
+    Returns the audit writer, or None when OTP_AUDIT_ENABLED is off.
+    """
+    global _audit_writer
+    if OTP_AUDIT_ENABLED and _audit_writer is None:
+        _audit_writer = OTPAuditWriter()
+    return _audit_writer
+
+
+async def shutdown_otp_audit_writer():
+    global _audit_writer
+    if _audit_writer is not None:
+        await _audit_writer.stop()
+        _audit_writer = None
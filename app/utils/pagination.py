@@ -0,0 +1,24 @@
+import base64
+import uuid
+from datetime import datetime
+from typing import Tuple
+
+
+def encode_cursor(occurred_at: datetime, row_id: uuid.UUID) -> str:
+    """
+    Encodes the keyset position of the last row on a page as an opaque cursor.
+    """
+    raw = f"{occurred_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """
+    Reverses encode_cursor. Raises ValueError for anything that is not a valid cursor.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        occurred_at, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(occurred_at), uuid.UUID(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
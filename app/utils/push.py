@@ -0,0 +1,318 @@
+"""
+Push notification fan-out through Firebase Cloud Messaging (HTTP v1 API).
+
+PushWorker consumes the alert engine's queue in batches. Alerts for the same user within a
+batch are coalesced into one notification; device tokens for every user in the batch are
+loaded with one query; messages go out through one pooled httpx client with bounded
+concurrency, with retries for throttling and server errors. Tokens that FCM reports as
+unregistered (or registered to another sender) are deleted in one statement per batch.
+
+Point FCM_BASE_URL at app/utils/fake_fcm.py to run everything offline.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import delete, select
+
+from app.db.models import FCMToken
+from app.utils.alerts import Alert
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+PUSH_ENABLED = os.getenv("PUSH_ENABLED", "false").lower() == "true"
+FCM_BASE_URL = os.getenv("FCM_BASE_URL", "https://fcm.googleapis.com")
+FCM_PROJECT_ID = os.getenv("FCM_PROJECT_ID", "")
+# OAuth2 access token for the FCM service account, refreshed outside the app
+FCM_ACCESS_TOKEN = os.getenv("FCM_ACCESS_TOKEN", "")
+# httpx's pool bookkeeping grows with the number of open connections, so past a few dozen
+# extra connections cost more CPU than they save in latency
+PUSH_MAX_CONCURRENCY = int(os.getenv("PUSH_MAX_CONCURRENCY", "50"))
+PUSH_MAX_CONNECTIONS = int(os.getenv("PUSH_MAX_CONNECTIONS", "50"))
+PUSH_BATCH_SIZE = int(os.getenv("PUSH_BATCH_SIZE", "500"))
+# How long a batch keeps collecting alerts after the first one arrives
+PUSH_BATCH_WAIT_MS = float(os.getenv("PUSH_BATCH_WAIT_MS", "200"))
+PUSH_MAX_RETRIES = int(os.getenv("PUSH_MAX_RETRIES", "3"))
+PUSH_RETRY_BASE_DELAY = float(os.getenv("PUSH_RETRY_BASE_DELAY", "0.5"))
+PUSH_TIMEOUT = float(os.getenv("PUSH_TIMEOUT", "10"))
+
+SENT = "sent"
+INVALID_TOKEN = "invalid_token"
+RETRY = "retry"
+FAILED = "failed"
+
+PUSH_MESSAGES = Counter("push_messages_total", "Push send attempts by result", ["result"])
+PUSH_SEND_LATENCY = Histogram("push_send_latency_seconds", "Time taken by FCM to accept a message")
+PUSH_ALERTS_COALESCED = Counter("push_alerts_coalesced_total", "Alerts merged into another alert's notification")
+PUSH_TOKENS_PRUNED = Counter("push_tokens_pruned_total", "Device tokens deleted after FCM rejected them")
+PUSH_BATCH_USERS = Histogram(
+    "push_batch_users", "Users notified per fan-out batch",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+
+TokenLoader = Callable[[Sequence[uuid.UUID]], Awaitable[Dict[uuid.UUID, List[str]]]]
+TokenPruner = Callable[[Sequence[str]], Awaitable[int]]
+
+# FCM error codes meaning the token will never work again. Anything else, such as a bare
+# 404 from a wrong project ID or INVALID_ARGUMENT from a bad payload, says nothing about
+# the token and would otherwise prune every device.
+_DEAD_TOKEN_CODES = {"UNREGISTERED", "SENDER_ID_MISMATCH"}
+
+
+class FCMClient:
+    """
+    Sends messages through the FCM HTTP v1 API over one pooled connection set.
+    send() never raises for HTTP errors; it classifies the outcome instead.
+    """
+
+    def __init__(self, base_url: str = FCM_BASE_URL, project_id: str = FCM_PROJECT_ID,
+                 access_token: str = FCM_ACCESS_TOKEN, max_connections: int = PUSH_MAX_CONNECTIONS,
+                 timeout: float = PUSH_TIMEOUT):
+        import httpx  # Imported lazily, only when push is enabled
+
+        self.path = f"/v1/projects/{project_id}/messages:send"
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {access_token}"} if access_token else None,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+        )
+
+    async def send(self, token: str, title: str, body: str, data: Optional[Dict[str, str]] = None) -> str:
+        import httpx
+
+        message = {"token": token, "notification": {"title": title, "body": body}}
+        if data:
+            message["data"] = data
+        try:
+            response = await self._client.post(self.path, json={"message": message})
+        except httpx.TransportError as e:
+            logger.debug("FCM transport error: %s", e)
+            return RETRY
+        if response.status_code == 200:
+            return SENT
+        if response.status_code == 429 or response.status_code >= 500:
+            return RETRY
+        if _error_code(response) in _DEAD_TOKEN_CODES:
+            return INVALID_TOKEN
+        logger.warning("FCM rejected a message: %s %s", response.status_code, response.text[:200])
+        return FAILED
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def _error_code(response: "httpx.Response") -> Optional[str]:
+    """
+    The FcmError errorCode from the response's error details, if there is one.
+    """
+    try:
+        error = response.json().get("error", {})
+    except (ValueError, AttributeError):
+        return None
+    for detail in error.get("details", []):
+        if "errorCode" in detail:
+            return detail["errorCode"]
+    return None
+
+
+def coalesce(alerts: Sequence[Alert]) -> Dict[uuid.UUID, Tuple[str, str, Dict[str, str]]]:
+    """
+    Builds one (title, body, data) notification per user from the user's alerts.
+    """
+    by_user: Dict[uuid.UUID, List[Alert]] = defaultdict(list)
+    for alert in alerts:
+        by_user[alert.user_id].append(alert)
+
+    messages = {}
+    for user_id, user_alerts in by_user.items():
+        PUSH_ALERTS_COALESCED.inc(len(user_alerts) - 1)
+        latest = user_alerts[-1]
+        if len(user_alerts) == 1:
+            title, body = "Expense Tracker alert", latest.message
+        else:
+            title = f"{len(user_alerts)} new alerts"
+            body = f"{latest.message} and {len(user_alerts) - 1} more"
+        data = {
+            "kinds": ",".join(sorted({alert.kind for alert in user_alerts})),
+            "transaction_id": str(latest.transaction_id or ""),
+        }
+        messages[user_id] = (title, body, data)
+    return messages
+
+
+async def load_device_tokens(user_ids: Sequence[uuid.UUID]) -> Dict[uuid.UUID, List[str]]:
+    """
+    Loads every device token of the given users with one query.
+    """
+    from app.db.database import SessionLocal
+
+    tokens: Dict[uuid.UUID, List[str]] = defaultdict(list)
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(FCMToken.user_id, FCMToken.token).where(FCMToken.user_id.in_(user_ids))
+        )
+        for user_id, token in result:
+            tokens[user_id].append(token)
+    return tokens
+
+
+async def prune_tokens(tokens: Sequence[str]) -> int:
+    from app.db.database import SessionLocal
+
+    async with SessionLocal() as session:
+        result = await session.execute(
+            delete(FCMToken).where(FCMToken.token.in_(tokens)).execution_options(synchronize_session=False)
+        )
+        await session.commit()
+    return result.rowcount or 0
+
+
+class PushWorker:
+    """
+    Background task turning queued alerts into push notifications. Each batch waits up to
+    `batch_wait_ms` after its first alert so bursts are coalesced per user.
+    """
+
+    def __init__(self, queue: asyncio.Queue, client: FCMClient, token_loader: TokenLoader = load_device_tokens,
+                 token_pruner: TokenPruner = prune_tokens, batch_size: int = PUSH_BATCH_SIZE,
+                 batch_wait_ms: float = PUSH_BATCH_WAIT_MS, concurrency: int = PUSH_MAX_CONCURRENCY,
+                 max_retries: int = PUSH_MAX_RETRIES, retry_base_delay: float = PUSH_RETRY_BASE_DELAY):
+        self.queue = queue
+        self.client = client
+        self.token_loader = token_loader
+        self.token_pruner = token_pruner
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Alerts taken off the queue for the batch being collected; stop() delivers them
+        self._collected: List[Alert] = []
+        self._delivering = False
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def _collect(self) -> List[Alert]:
+        self._collected.append(await self.queue.get())
+        deadline = asyncio.get_running_loop().time() + self.batch_wait
+        while len(self._collected) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                self._collected.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        alerts, self._collected = self._collected, []
+        return alerts
+
+    async def _run(self):
+        while not self._stopping:
+            alerts = await self._collect()
+            self._delivering = True
+            try:
+                await self.deliver(alerts)
+            except Exception:
+                logger.exception("Push fan-out failed for %d alerts", len(alerts))
+            finally:
+                self._delivering = False
+
+    async def deliver(self, alerts: Sequence[Alert]) -> Dict[str, int]:
+        """
+        Sends one notification per user to each of the user's devices and prunes dead tokens.
+        Returns the number of messages per result.
+        """
+        messages = coalesce(alerts)
+        PUSH_BATCH_USERS.observe(len(messages))
+        tokens = await self.token_loader(list(messages))
+        jobs = [(token, messages[user_id]) for user_id, user_tokens in tokens.items() for token in user_tokens]
+        results = await asyncio.gather(*(self._send_with_retry(token, *message) for token, message in jobs))
+
+        summary: Dict[str, int] = defaultdict(int)
+        for result in results:
+            summary[result] += 1
+        dead = [token for (token, _), result in zip(jobs, results) if result == INVALID_TOKEN]
+        if dead:
+            PUSH_TOKENS_PRUNED.inc(await self.token_pruner(dead))
+        return dict(summary)
+
+    async def _send_with_retry(self, token: str, title: str, body: str, data: Dict[str, str]) -> str:
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                start = time.perf_counter()
+                result = await self.client.send(token, title, body, data)
+                PUSH_SEND_LATENCY.observe(time.perf_counter() - start)
+            if result != RETRY:
+                PUSH_MESSAGES.labels(result=result).inc()
+                return result
+            if attempt == self.max_retries:
+                PUSH_MESSAGES.labels(result=FAILED).inc()
+                return FAILED
+            PUSH_MESSAGES.labels(result=RETRY).inc()
+            delay = self.retry_base_delay * (2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+        return FAILED
+
+    async def stop(self, drain: bool = True):
+        """
+        Lets a batch that is being delivered finish, then delivers what was being collected
+        and what is still queued, and closes the client whatever happens.
+        """
+        try:
+            if self._task is not None:
+                self._stopping = True
+                if not self._delivering:
+                    # Waiting on the queue: nothing is in flight, and collected alerts are kept
+                    self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+                self._task = None
+            if drain:
+                # Deliver whatever is still pending so alerts are not lost on a clean shutdown
+                alerts, self._collected = self._collected, []
+                while not self.queue.empty():
+                    alerts.append(self.queue.get_nowait())
+                for offset in range(0, len(alerts), self.batch_size):
+                    await self.deliver(alerts[offset:offset + self.batch_size])
+        finally:
+            await self.client.close()
+
+
+_push_worker: Optional[PushWorker] = None
+
+
+def start_push_worker(queue: asyncio.Queue) -> Optional[PushWorker]:
+    """
+    Starts the process-wide push worker when PUSH_ENABLED is set.
+    """
+    global _push_worker
+    if not PUSH_ENABLED:
+        return None
+    if not FCM_PROJECT_ID:
+        logger.warning("PUSH_ENABLED is set but FCM_PROJECT_ID is empty; push notifications are off")
+        return None
+    if _push_worker is None:
+        _push_worker = PushWorker(queue, FCMClient())
+        _push_worker.start()
+    return _push_worker
+
+
+async def shutdown_push_worker():
+    global _push_worker
+    if _push_worker is not None:
+        await _push_worker.stop()
+        _push_worker = None
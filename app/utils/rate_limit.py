@@ -0,0 +1,237 @@
+"""
+Rate limiting for the login and OTP endpoints.
+
+Limits are enforced by route dependencies that run before the database session
+dependencies, so a rejected request never checks out a session (or, for OTPs, reaches the
+SMS provider). Each policy allows `limit` requests per `period` seconds per key (client
+IP, email or phone) using GCRA, a token bucket that stores a single timestamp per key:
+the key's theoretical arrival time (TAT).
+
+Keys live in a fixed-size, 8-way set-associative table of 16-byte slots (a 64-bit key
+fingerprint and the TAT), whatever the key lengths. A slot whose TAT has passed holds no
+information and is reused; when all ways of a set are busy, the slot nearest to expiring
+is evicted, which at worst lets that key start over with a full bucket. Filled to
+capacity the table keeps about 86% of the keys, so size RATE_LIMIT_CAPACITY at 1.5x the
+keys active within a period: one million keys then take 24 MiB and about 97% are kept
+(a dict of key to timestamp needs about 55 MiB); see benchmarks/bench_rate_limit.py. With RATE_LIMIT_SHARED the table lives in POSIX shared
+memory and every uvicorn worker on the host uses the same limits. Updates across workers
+are not locked: two workers racing on one key can each admit a request, which lets a
+burst slightly exceed the limit but never corrupts the table. The segment outlives the
+workers (so limits survive a restart); remove /dev/shm/<RATE_LIMIT_SHM_NAME> to reset it.
+"""
+import hashlib
+import logging
+import math
+import os
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from prometheus_client import Counter
+
+from app.db.schemas import UserLogin
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Number of keys tracked at once; rounded up to a multiple of RATE_LIMIT_WAYS
+RATE_LIMIT_CAPACITY = int(os.getenv("RATE_LIMIT_CAPACITY", "1500000"))
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "false").lower() == "true"
+RATE_LIMIT_SHM_NAME = os.getenv("RATE_LIMIT_SHM_NAME", "expense_tracker_rate_limit")
+RATE_LIMIT_WAYS = 8
+
+RATE_LIMITED = Counter("rate_limited_requests_total", "Requests rejected by a rate limit policy", ["policy"])
+
+
+class RatePolicy(NamedTuple):
+    name: str
+    limit: int
+    period: float
+
+
+def parse_policy(name: str, spec: str) -> RatePolicy:
+    """
+    Parses a "<limit>/<seconds>" spec such as "30/60".
+    """
+    limit, _, period = spec.partition("/")
+    return RatePolicy(name, int(limit), float(period))
+
+
+LOGIN_PER_IP = parse_policy("login_ip", os.getenv("RATE_LIMIT_LOGIN_PER_IP", "30/60"))
+LOGIN_PER_EMAIL = parse_policy("login_email", os.getenv("RATE_LIMIT_LOGIN_PER_EMAIL", "10/300"))
+OTP_REQUEST_PER_IP = parse_policy("otp_request_ip", os.getenv("RATE_LIMIT_OTP_REQUEST_PER_IP", "10/60"))
+OTP_REQUEST_PER_EMAIL = parse_policy("otp_request_email", os.getenv("RATE_LIMIT_OTP_REQUEST_PER_EMAIL", "5/600"))
+OTP_REQUEST_PER_PHONE = parse_policy("otp_request_phone", os.getenv("RATE_LIMIT_OTP_REQUEST_PER_PHONE", "5/600"))
+OTP_VERIFY_PER_IP = parse_policy("otp_verify_ip", os.getenv("RATE_LIMIT_OTP_VERIFY_PER_IP", "30/60"))
+
+
+class SlotTable:
+    """
+    Fixed-size table mapping 64-bit key fingerprints to TATs, stored in one flat buffer:
+    `capacity` fingerprints followed by `capacity` TATs. Fingerprint 0 marks an empty slot.
+    """
+
+    def __init__(self, capacity: int = RATE_LIMIT_CAPACITY, buffer=None):
+        self.sets = max(1, -(-capacity // RATE_LIMIT_WAYS))
+        self.capacity = self.sets * RATE_LIMIT_WAYS
+        self._buffer = buffer if buffer is not None else bytearray(self.nbytes(self.capacity))
+        view = memoryview(self._buffer)
+        self._fingerprints = view[:8 * self.capacity].cast("Q")
+        self._tats = view[8 * self.capacity:16 * self.capacity].cast("d")
+
+    @staticmethod
+    def nbytes(capacity: int) -> int:
+        return 16 * max(1, -(-capacity // RATE_LIMIT_WAYS)) * RATE_LIMIT_WAYS
+
+    def __len__(self):
+        """
+        Number of keys whose bucket is not yet full again. Scans the whole table.
+        """
+        now = time.monotonic()
+        return sum(1 for fingerprint, tat in zip(self._fingerprints, self._tats) if fingerprint and tat > now)
+
+    def acquire(self, key: str, interval: float, tolerance: float, now: float) -> float:
+        """
+        Admits one request for `key` if its bucket has a token. Returns 0.0 when admitted,
+        otherwise the seconds until the next request would be.
+        """
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+        fingerprint = digest or 1
+        base = (digest >> 32) % self.sets * RATE_LIMIT_WAYS
+        fingerprints = self._fingerprints
+        tats = self._tats
+
+        slot = -1
+        victim = base
+        victim_tat = math.inf
+        for i in range(base, base + RATE_LIMIT_WAYS):
+            if fingerprints[i] == fingerprint:
+                slot = i
+                break
+            tat = tats[i] if fingerprints[i] else -math.inf
+            if tat < victim_tat:
+                victim, victim_tat = i, tat
+
+        tat = tats[slot] if slot >= 0 else now
+        if tat < now:
+            tat = now
+        wait = tat - tolerance - now
+        if wait > 0:
+            return wait
+        if slot < 0:
+            slot = victim
+            fingerprints[slot] = fingerprint
+        tats[slot] = tat + interval
+        return 0.0
+
+    def close(self):
+        self._fingerprints.release()
+        self._tats.release()
+
+
+class RateLimiter:
+    """
+    Applies RatePolicies to keys over one SlotTable shared by every policy.
+    """
+
+    def __init__(self, table: SlotTable, clock=time.monotonic):
+        self.table = table
+        self._clock = clock
+
+    def hit(self, policy: RatePolicy, key: str) -> float:
+        """
+        Counts one request for `key` under `policy`. Returns 0.0 when it is allowed,
+        otherwise the number of seconds to wait before retrying.
+        """
+        interval = policy.period / policy.limit
+        return self.table.acquire(f"{policy.name}:{key}", interval, policy.period - interval, self._clock())
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_shared_memory: Optional[SharedMemory] = None
+
+
+def _attach_shared_table(capacity: int) -> Optional[SlotTable]:
+    global _shared_memory
+    size = SlotTable.nbytes(capacity)
+    try:
+        shm = SharedMemory(RATE_LIMIT_SHM_NAME, create=True, size=size)
+    except FileExistsError:
+        shm = SharedMemory(RATE_LIMIT_SHM_NAME)
+    except OSError:
+        logger.exception("Could not map shared memory %s; rate limits are per worker", RATE_LIMIT_SHM_NAME)
+        return None
+    # The segment belongs to the host, not to whichever worker happens to exit first
+    resource_tracker.unregister(shm._name, "shared_memory")
+    if shm.size < size:
+        logger.warning("Shared memory %s is smaller than RATE_LIMIT_CAPACITY needs; rate limits are per worker",
+                       RATE_LIMIT_SHM_NAME)
+        shm.close()
+        return None
+    _shared_memory = shm
+    return SlotTable(capacity, shm.buf)
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _rate_limiter
+    if _rate_limiter is None:
+        table = _attach_shared_table(RATE_LIMIT_CAPACITY) if RATE_LIMIT_SHARED else None
+        _rate_limiter = RateLimiter(table if table is not None else SlotTable(RATE_LIMIT_CAPACITY))
+    return _rate_limiter
+
+
+def shutdown_rate_limiter():
+    """
+    Unmaps the table. A shared segment is left in place for the other workers.
+    """
+    global _rate_limiter, _shared_memory
+    if _rate_limiter is not None:
+        _rate_limiter.table.close()
+        _rate_limiter = None
+    if _shared_memory is not None:
+        _shared_memory.close()
+        _shared_memory = None
+
+
+def enforce(*checks: Tuple[RatePolicy, Optional[str]]):
+    """
+    Counts the request against each (policy, key) pair in turn and raises 429 with a
+    Retry-After header at the first one over its limit. Pairs with no key are skipped.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return
+    limiter = get_rate_limiter()
+    for policy, key in checks:
+        if not key:
+            continue
+        wait = limiter.hit(policy, key)
+        if wait:
+            RATE_LIMITED.labels(policy=policy.name).inc()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please retry later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+
+def client_ip(request: Request) -> Optional[str]:
+    # Behind a proxy, run uvicorn with --proxy-headers so this is the real client
+    return request.client.host if request.client else None
+
+
+# Route dependencies. They are async so FastAPI calls them inline rather than in its
+# threadpool, and they declare the same body and query parameters as their routes,
+# which FastAPI parses once and hands to both.
+
+async def limit_login(request: Request, user_credentials: UserLogin):
+    enforce((LOGIN_PER_IP, client_ip(request)), (LOGIN_PER_EMAIL, user_credentials.email.lower()))
+
+
+async def limit_otp_request(request: Request, user_email: str):
+    enforce((OTP_REQUEST_PER_IP, client_ip(request)), (OTP_REQUEST_PER_EMAIL, user_email.lower()))
+
+
+async def limit_otp_verify(request: Request):
+    enforce((OTP_VERIFY_PER_IP, client_ip(request)))
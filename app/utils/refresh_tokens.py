@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from jose import jwt, JWTError
+from sqlalchemy import false, func, insert, literal, select, true, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import RefreshToken, User
+from app.utils.security import (
+    SECRET_KEY, ALGORITHM, REFRESH_TOKEN_EXPIRE_DAYS, create_access_token, create_refresh_token,
+)
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "5"))
+# updated_at is the revoking transaction's start time, so a row can commit after a sync
+# that already looked past it; each sync re-reads this far back to catch such rows
+REVOCATION_SYNC_OVERLAP = timedelta(seconds=float(os.getenv("REVOCATION_SYNC_OVERLAP_SECONDS", "60")))
+
+
+class InvalidRefreshToken(Exception):
+    """
+    Raised when a refresh token is malformed, expired, revoked or already rotated.
+    """
+
+
+def hash_refresh_token(token: str) -> bytes:
+    """
+    Refresh tokens are only ever stored and looked up by their fixed-length SHA-256 digest.
+    """
+    return hashlib.sha256(token.encode()).digest()
+
+
+def _decode_refresh_token(token: str) -> dict:
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise InvalidRefreshToken("Invalid refresh token")
+    if claims.get("type") != "refresh" or not claims.get("sub"):
+        raise InvalidRefreshToken("Invalid refresh token")
+    return claims
+
+
+class RevocationFilter:
+    """
+    Per-worker set of revoked refresh token digests, so replayed or signed-out tokens are
+    rejected without a query. Entries are dropped once the token would have expired anyway.
+    The set is loaded once and then kept up to date by polling for rows revoked since the
+    last sync (less REVOCATION_SYNC_OVERLAP), which the partial index on (updated_at) WHERE
+    revoked keeps cheap.
+
+    Each entry costs about 150 bytes, so a million revoked-but-unexpired tokens need ~150 MB.
+    """
+
+    def __init__(self, session_factory=None, interval: float = REVOCATION_SYNC_INTERVAL,
+                 overlap: timedelta = REVOCATION_SYNC_OVERLAP):
+        self._session_factory = session_factory
+        self.interval = interval
+        self.overlap = overlap
+        self._revoked: Dict[bytes, datetime] = {}
+        self._synced_until: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self._revoked
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def add(self, digest: bytes, expires_at: datetime):
+        self._revoked[digest] = expires_at
+
+    def prune(self):
+        now = datetime.now(timezone.utc)
+        expired = [digest for digest, expires_at in self._revoked.items() if expires_at <= now]
+        for digest in expired:
+            del self._revoked[digest]
+
+    async def sync(self):
+        """
+        Pulls rows revoked since the newest one seen so far, less the overlap (or all
+        unexpired revoked rows on the first run).
+        """
+        if self._session_factory is None:
+            from app.db.database import SessionLocal
+            self._session_factory = SessionLocal
+        now = datetime.now(timezone.utc)
+        query = select(RefreshToken.token_hash, RefreshToken.expires_at, RefreshToken.updated_at).where(
+            RefreshToken.revoked == true(),
+            RefreshToken.expires_at > now,
+        )
+        if self._synced_until is not None:
+            query = query.where(RefreshToken.updated_at >= self._synced_until - self.overlap)
+        async with self._session_factory() as session:
+            rows = (await session.execute(query)).all()
+        for token_hash, expires_at, updated_at in rows:
+            self._revoked[token_hash] = expires_at
+            if self._synced_until is None or updated_at > self._synced_until:
+                self._synced_until = updated_at
+        if self._synced_until is None:
+            self._synced_until = now
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+                self.prune()
+            except Exception:
+                logger.exception("Failed to sync refresh token revocations")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+_revocation_filter: Optional[RevocationFilter] = None
+
+
+def get_revocation_filter() -> RevocationFilter:
+    global _revocation_filter
+    if _revocation_filter is None:
+        _revocation_filter = RevocationFilter()
+    return _revocation_filter
+
+
+async def shutdown_revocation_filter():
+    global _revocation_filter
+    if _revocation_filter is not None:
+        await _revocation_filter.stop()
+        _revocation_filter = None
+
+
+def _new_refresh_token(subject: str) -> Tuple[str, bytes, datetime]:
+    # jti keeps tokens unique even when two are issued for the same user in the same second
+    expires_delta = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    token = create_refresh_token(data={"sub": subject, "jti": uuid.uuid4().hex}, expires_delta=expires_delta)
+    expires_at = datetime.now(timezone.utc) + expires_delta
+    return token, hash_refresh_token(token), expires_at
+
+
+async def issue_refresh_token(db: AsyncSession, user_id: uuid.UUID, subject: str) -> str:
+    """
+    Creates a refresh token for a user and stores its digest. The caller commits.
+    """
+    token, token_hash, expires_at = _new_refresh_token(subject)
+    await db.execute(
+        insert(RefreshToken).values(user_id=user_id, token_hash=token_hash, expires_at=expires_at)
+    )
+    return token
+
+
+async def rotate_refresh_token(db: AsyncSession, token: str) -> Tuple[str, str]:
+    """
+    Exchanges a refresh token for a new access/refresh token pair.
+
+    The old row is revoked and the new one inserted by a single statement
+    (UPDATE ... RETURNING feeding INSERT ... SELECT), so rotation is one round trip.
+    Presenting an already rotated token is treated as theft and revokes every
+    active token for the user, whether the filter or the database catches it.
+    """
+    claims = _decode_refresh_token(token)
+    old_hash = hash_refresh_token(token)
+    subject = claims["sub"]
+    revocation_filter = get_revocation_filter()
+    if old_hash in revocation_filter:
+        await _revoke_all_for_subject(db, subject)
+        raise InvalidRefreshToken("Refresh token has been revoked")
+
+    new_token, new_hash, new_expires_at = _new_refresh_token(subject)
+    revoked = (
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == old_hash,
+            RefreshToken.revoked == false(),
+            RefreshToken.expires_at > func.now(),
+        )
+        .values(revoked=True, updated_at=func.now())
+        .returning(RefreshToken.user_id)
+        .cte("revoked")
+    )
+    rotated = await db.execute(
+        insert(RefreshToken)
+        .from_select(
+            ["token_id", "user_id", "token_hash", "expires_at", "revoked"],
+            select(literal(uuid.uuid4()), revoked.c.user_id, literal(new_hash),
+                   literal(new_expires_at), false()),
+        )
+        .returning(RefreshToken.user_id)
+    )
+    if rotated.first() is None:
+        await db.rollback()
+        await _revoke_all_for_subject(db, subject)
+        raise InvalidRefreshToken("Invalid or expired refresh token")
+    await db.commit()
+
+    revocation_filter.add(old_hash, datetime.fromtimestamp(claims["exp"], timezone.utc))
+    access_token = create_access_token(data={"sub": subject})
+    return access_token, new_token
+
+
+async def _revoke_all_for_subject(db: AsyncSession, subject: str):
+    await db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.user_id == select(User.user_id).where(User.email == subject).scalar_subquery(),
+            RefreshToken.revoked == false(),
+        )
+        .values(revoked=True, updated_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def revoke_all_refresh_tokens(db: AsyncSession, subject: str):
+    """
+    Revokes every active refresh token of a user, e.g. to sign out everywhere. Commits.
+    """
+    await _revoke_all_for_subject(db, subject)
+
+
+async def revoke_refresh_token(db: AsyncSession, token: str):
+    """
+    Revokes a single refresh token, e.g. on sign out.
+    """
+    claims = _decode_refresh_token(token)
+    token_hash = hash_refresh_token(token)
+    await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.token_hash == token_hash)
+        .values(revoked=True, updated_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    get_revocation_filter().add(token_hash, datetime.fromtimestamp(claims["exp"], timezone.utc))
@@ -0,0 +1,110 @@
+"""
+User registration without check-then-insert.
+
+The users table's unique constraints decide whether an email or phone is taken: a signup
+is one INSERT ... RETURNING, and a unique violation is mapped back to the field it is about.
+This is one round trip instead of four, and two concurrent signups with the same email can
+no longer both pass a pre-check.
+"""
+from typing import List, Optional, Sequence
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import User
+
+# Default Postgres names of the UNIQUE (email) and UNIQUE (phone) constraints on users
+USERS_EMAIL_KEY = "users_email_key"
+USERS_PHONE_KEY = "users_phone_key"
+
+EMAIL_TAKEN = "Email already registered"
+PHONE_TAKEN = "Phone number already registered"
+CONFLICT_DETAILS = {USERS_EMAIL_KEY: EMAIL_TAKEN, USERS_PHONE_KEY: PHONE_TAKEN}
+
+CREATED = "created"
+CONFLICT = "conflict"
+
+
+class RegistrationConflict(Exception):
+    """
+    Raised when the email or phone number already belongs to a user.
+    """
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def violated_constraint(error: IntegrityError) -> Optional[str]:
+    """
+    Returns the name of the constraint behind an IntegrityError, if it can be told.
+    """
+    # asyncpg's exception carries the name; the DBAPI adapter keeps it as the cause
+    name = getattr(getattr(error.orig, "__cause__", None), "constraint_name", None)
+    if name:
+        return name
+    message = str(error.orig)
+    for constraint in CONFLICT_DETAILS:
+        if constraint in message:
+            return constraint
+    return None
+
+
+async def create_user(db: AsyncSession, name: str, email: str, phone: str, password_hash: str) -> User:
+    """
+    Inserts and commits a user, returning the row with its server defaults filled in.
+    Raises RegistrationConflict when the email or phone is taken.
+    """
+    try:
+        user = await db.scalar(
+            insert(User)
+            .values(name=name, email=email, phone=phone, password_hash=password_hash)
+            .returning(User)
+        )
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        constraint = violated_constraint(e)
+        if constraint in CONFLICT_DETAILS:
+            raise RegistrationConflict(CONFLICT_DETAILS[constraint]) from e
+        raise
+    return user
+
+
+async def create_users(db: AsyncSession, rows: Sequence[dict]) -> List[dict]:
+    """
+    Inserts many users with one multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING and
+    commits. Rows are dicts with name, email, phone and password_hash. Returns one result
+    per row, in order: status "created" with the user_id, or "conflict" with the reason.
+    Rows repeating an email or phone from earlier in the same batch are conflicts too.
+    """
+    result = await db.execute(
+        pg_insert(User)
+        .values(list(rows))
+        .on_conflict_do_nothing()
+        .returning(User.user_id, User.email, User.phone)
+    )
+    inserted = {(email, phone): user_id for user_id, email, phone in result}
+
+    results = []
+    missing = []
+    for index, row in enumerate(rows):
+        user_id = inserted.pop((row["email"], row["phone"]), None)
+        if user_id is not None:
+            results.append({"index": index, "email": row["email"], "status": CREATED, "user_id": user_id})
+        else:
+            results.append({"index": index, "email": row["email"], "status": CONFLICT})
+            missing.append(row)
+
+    if missing:
+        # One lookup tells which field each skipped row collided on
+        taken_emails = set(await db.scalars(
+            select(User.email).where(User.email.in_([row["email"] for row in missing]))
+        ))
+        for entry in results:
+            if entry["status"] == CONFLICT:
+                entry["detail"] = EMAIL_TAKEN if entry["email"] in taken_emails else PHONE_TAKEN
+    await db.commit()
+    return results
@@ -0,0 +1,122 @@
+import contextvars
+import logging
+import os
+import time
+from typing import List, Optional
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this are logged with the SQL they ran; 0 disables the slow-request log
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "0"))
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "50"))
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per request",
+    ["method", "route"], buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 50, 100),
+)
+HTTP_REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per request",
+    ["method", "route"],
+)
+DB_QUERIES_TOTAL = Counter("db_queries_total", "SQL statements executed, by the route that caused them", ["route"])
+
+
+class RequestStats:
+    __slots__ = ("route", "queries", "db_time", "statements")
+
+    def __init__(self, collect_statements: bool):
+        self.route: Optional[str] = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements: Optional[List[str]] = [] if collect_statements else None
+
+
+_current_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _current_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = _current_stats.get()
+    if stats is None:
+        DB_QUERIES_TOTAL.labels(route="background").inc()
+        return
+    stats.queries += 1
+    stats.db_time += elapsed
+    if stats.statements is not None and len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+        stats.statements.append(f"{elapsed * 1000:.1f} ms  {statement}")
+
+
+def instrument_engine(engine):
+    """
+    Attaches query counting and timing hooks to an engine (sync or async).
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording latency per route template, plus the number of SQL statements
+    and the DB time each request caused. Statements run by background tasks are not attributed
+    to a request. Routes slower than SLOW_REQUEST_THRESHOLD_MS are logged with their SQL.
+    """
+
+    def __init__(self, app, slow_request_threshold_ms: float = SLOW_REQUEST_THRESHOLD_MS):
+        self.app = app
+        self.slow_request_threshold = slow_request_threshold_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(collect_statements=self.slow_request_threshold > 0)
+        token = _current_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_stats.reset(token)
+            # The router stores the matched route in the scope; use its template, not the raw path
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+
+            HTTP_REQUEST_DURATION.labels(method=method, route=route_path, status=str(status_code)).observe(elapsed)
+            HTTP_REQUEST_DB_QUERIES.labels(method=method, route=route_path).observe(stats.queries)
+            HTTP_REQUEST_DB_SECONDS.labels(method=method, route=route_path).observe(stats.db_time)
+            if stats.queries:
+                DB_QUERIES_TOTAL.labels(route=route_path).inc(stats.queries)
+
+            if self.slow_request_threshold and elapsed >= self.slow_request_threshold:
+                logger.warning(
+                    "Slow request %s %s: %.1f ms, %d queries, %.1f ms in DB\n%s",
+                    method, route_path, elapsed * 1000, stats.queries, stats.db_time * 1000,
+                    "\n".join(stats.statements or []),
+                )
@@ -0,0 +1,112 @@
+"""
+Lifespan-managed resources.
+
+Every long-lived thing a worker owns (database engines, worker pools, queues and their
+consumers, SMS and push clients) is registered with a ResourceRegistry by name, with an
+optional start and stop callable. The FastAPI lifespan starts them in registration order
+and stops them in reverse, so a resource can rely on everything registered before it for
+its whole life: the engine is registered first and disposed last, after every queue that
+writes through it has drained. A stop that fails or exceeds RESOURCE_STOP_TIMEOUT is logged
+and the rest still run. The registry reports ready only between a complete startup and the
+start of shutdown, which /ready exposes along with its state.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from prometheus_client import Gauge
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_STOP_TIMEOUT = float(os.getenv("RESOURCE_STOP_TIMEOUT", "30"))
+
+RESOURCE_STARTUP_SECONDS = Gauge("resource_startup_seconds", "Time taken to start a resource", ["resource"])
+
+
+class Resource(NamedTuple):
+    name: str
+    start: Optional[Callable[[], Any]]
+    stop: Optional[Callable[[], Any]]
+
+
+async def _call(function: Callable[[], Any]):
+    result = function()
+    if inspect.isawaitable(result):
+        await result
+
+
+class ResourceRegistry:
+    """
+    Starts registered resources in order and stops the started ones in reverse.
+    Start and stop callables may be plain functions or coroutine functions.
+    """
+
+    def __init__(self, stop_timeout: float = RESOURCE_STOP_TIMEOUT):
+        self.stop_timeout = stop_timeout
+        # "starting", "ready", "stopping" or "stopped"
+        self.state = "starting"
+        # Seconds each resource took to start, in start order
+        self.startup_seconds: Dict[str, float] = {}
+        self._resources: List[Resource] = []
+        self._started: List[Resource] = []
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def register(self, name: str, start: Optional[Callable[[], Any]] = None,
+                 stop: Optional[Callable[[], Any]] = None):
+        if any(resource.name == name for resource in self._resources):
+            raise ValueError(f"Resource already registered: {name}")
+        self._resources.append(Resource(name, start, stop))
+
+    async def startup(self):
+        """
+        Starts every resource in turn. If one fails, the ones already started are stopped
+        before the error propagates.
+        """
+        self.state = "starting"
+        try:
+            for resource in self._resources:
+                start = time.perf_counter()
+                if resource.start is not None:
+                    await _call(resource.start)
+                self._started.append(resource)
+                elapsed = time.perf_counter() - start
+                self.startup_seconds[resource.name] = round(elapsed, 4)
+                RESOURCE_STARTUP_SECONDS.labels(resource=resource.name).set(elapsed)
+        except BaseException:
+            await self.shutdown()
+            raise
+        self.state = "ready"
+        logger.info("Started %d resources in %.3fs", len(self._started), sum(self.startup_seconds.values()))
+
+    async def shutdown(self):
+        self.state = "stopping"
+        while self._started:
+            resource = self._started.pop()
+            if resource.stop is None:
+                continue
+            try:
+                await asyncio.wait_for(_call(resource.stop), timeout=self.stop_timeout)
+            except asyncio.TimeoutError:
+                logger.error("Stopping %s took longer than %.0fs; moving on", resource.name, self.stop_timeout)
+            except Exception:
+                logger.exception("Stopping %s failed", resource.name)
+        self.state = "stopped"
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        """
+        FastAPI lifespan running the registry; also published as app.state.resources.
+        """
+        app.state.resources = self
+        await self.startup()
+        try:
+            yield
+        finally:
+            await self.shutdown()
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge
+from sqlalchemy import delete, or_, select
+
+from app.db.models import OTPVerification, RefreshToken, RevokedAccessToken
+from app.db.partitions import drop_monthly_partitions_before, ensure_monthly_partitions, month_start
+
+logger = logging.getLogger(__name__)
+
+# Configuration for the retention job
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+# Rows are kept for a grace period after they expire so recent activity can still be inspected
+OTP_RETENTION_GRACE = timedelta(days=int(os.getenv("OTP_RETENTION_GRACE_DAYS", "1")))
+REFRESH_TOKEN_RETENTION_GRACE = timedelta(days=int(os.getenv("REFRESH_TOKEN_RETENTION_GRACE_DAYS", "1")))
+# Monthly partitions are created this many months ahead of the current month
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITIONED_TABLES = ("transactions", "audit_logs")
+# Whole monthly partitions older than this are dropped; tables not listed keep everything
+AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", "12"))
+PARTITION_RETENTION_MONTHS = {"audit_logs": AUDIT_RETENTION_MONTHS}
+
+RETENTION_ROWS_DELETED = Counter("retention_rows_deleted_total", "Rows removed by the retention job", ["table"])
+RETENTION_LAST_DURATION = Gauge("retention_last_run_seconds", "Duration of the last retention run")
+
+
+async def _purge_in_batches(session_factory, model, pk_column, condition, batch_size: int, pause: float) -> int:
+    """
+    Deletes rows matching `condition` a batch at a time, committing and pausing between
+    batches so the purge never holds long locks or saturates the primary.
+    """
+    total = 0
+    while True:
+        async with session_factory() as session:
+            batch = select(pk_column).where(condition).limit(batch_size).scalar_subquery()
+            result = await session.execute(
+                delete(model).where(pk_column.in_(batch)).execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        deleted = result.rowcount or 0
+        total += deleted
+        if deleted < batch_size:
+            return total
+        await asyncio.sleep(pause)
+
+
+async def purge_expired(session_factory=None, batch_size: int = RETENTION_BATCH_SIZE,
+                        pause: float = RETENTION_BATCH_PAUSE) -> Dict[str, float]:
+    """
+    Removes expired OTPs, expired or revoked refresh tokens and revocations of access
+    tokens that have expired.
+    Returns the number of rows removed per table and how long the run took.
+    """
+    if session_factory is None:
+        from app.db.database import SessionLocal
+        session_factory = SessionLocal
+
+    start = time.perf_counter()
+    now = datetime.now(timezone.utc)
+
+    otp_deleted = await _purge_in_batches(
+        session_factory, OTPVerification, OTPVerification.otp_id,
+        OTPVerification.expires_at < now - OTP_RETENTION_GRACE,
+        batch_size, pause,
+    )
+    token_cutoff = now - REFRESH_TOKEN_RETENTION_GRACE
+    token_deleted = await _purge_in_batches(
+        session_factory, RefreshToken, RefreshToken.token_id,
+        or_(RefreshToken.expires_at < token_cutoff,
+            (RefreshToken.revoked == True) & (RefreshToken.updated_at < token_cutoff)),
+        batch_size, pause,
+    )
+    access_deleted = await _purge_in_batches(
+        session_factory, RevokedAccessToken, RevokedAccessToken.token_hash,
+        RevokedAccessToken.expires_at < now,
+        batch_size, pause,
+    )
+
+    elapsed = time.perf_counter() - start
+    RETENTION_ROWS_DELETED.labels(table="otp_verifications").inc(otp_deleted)
+    RETENTION_ROWS_DELETED.labels(table="refresh_tokens").inc(token_deleted)
+    RETENTION_ROWS_DELETED.labels(table="revoked_access_tokens").inc(access_deleted)
+    RETENTION_LAST_DURATION.set(elapsed)
+    report = {
+        "otp_verifications": otp_deleted,
+        "refresh_tokens": token_deleted,
+        "revoked_access_tokens": access_deleted,
+        "elapsed_seconds": round(elapsed, 3),
+    }
+    logger.info("Retention run finished: %s", report)
+    return report
+
+
+async def maintain_partitions(engine=None, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """
+    Makes sure upcoming monthly partitions exist for every range-partitioned table, and drops
+    partitions that have aged out of their table's retention period. Every statement runs in
+    its own transaction, so one table or month failing does not undo the others.
+    """
+    if engine is None:
+        from app.db.database import engine
+    current = month_start(datetime.now(timezone.utc).date())
+    for table in PARTITIONED_TABLES:
+        created = await ensure_monthly_partitions(engine, table, months_ahead)
+        if created:
+            logger.info("Created partitions: %s", ", ".join(created))
+        if table in PARTITION_RETENTION_MONTHS:
+            dropped = await drop_monthly_partitions_before(
+                engine, table, month_start(current, -PARTITION_RETENTION_MONTHS[table])
+            )
+            if dropped:
+                logger.info("Dropped expired partitions: %s", ", ".join(dropped))
+
+
+class RetentionJob:
+    """
+    Runs purge_expired() and maintain_partitions() periodically in the background.
+    """
+
+    def __init__(self, interval: int = RETENTION_INTERVAL_SECONDS, session_factory=None):
+        self.interval = interval
+        self._session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await maintain_partitions()
+            except Exception:
+                logger.exception("Partition maintenance failed")
+            try:
+                await purge_expired(self._session_factory)
+            except Exception:
+                logger.exception("Retention run failed")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+if __name__ == "__main__":
+    # One-off run, e.g. from cron: python -m app.utils.retention
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(purge_expired()))
@@ -0,0 +1,251 @@
+"""
+Per-category monthly rollups of the transactions ledger.
+
+category_monthly_rollups holds, for every (user, month, category), the debit and credit
+totals and the number of transactions. Every write to transactions applies its delta to the
+rollup in the same database transaction, so budget reads are a lookup over the user's
+categories instead of a SUM over the ledger. Months are calendar months in UTC, matching the
+ledger partitions; uncategorized transactions roll up under the empty category.
+
+Every rollup write takes the owning user's transaction-scoped advisory lock first, so a
+rebuild serializes with that user's writers only, never with other users'.
+
+rebuild_rollups() recomputes a user's months from the ledger and find_rollup_drift() compares
+the two, for repairs and periodic checks:
+
+    python -m app.utils.rollups check [--user USER_ID] [--from 2026-01] [--to 2026-10] [--repair]
+    python -m app.utils.rollups rebuild --user USER_ID [--from 2026-01] [--to 2026-10]
+"""
+import argparse
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, time, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import CategoryMonthlyRollup
+from app.db.partitions import month_start
+
+logger = logging.getLogger(__name__)
+
+UNCATEGORIZED = ""
+
+# SQL spellings of rollup_key(), for statements that aggregate inside the database
+MONTH_SQL = "date_trunc('month', {column} AT TIME ZONE 'UTC')::date"
+CATEGORY_SQL = "coalesce({column}, '')"
+# The per-user rollup lock, held until the transaction ends; uuid::text matches str(uuid)
+USER_LOCK_SQL = "pg_advisory_xact_lock(hashtext({column}::text))"
+
+# Appended to an INSERT INTO category_monthly_rollups AS r ... so repeated keys add up
+ROLLUP_ON_CONFLICT = """
+    ON CONFLICT (user_id, month, category) DO UPDATE SET
+        debit_minor = r.debit_minor + excluded.debit_minor,
+        credit_minor = r.credit_minor + excluded.credit_minor,
+        txn_count = r.txn_count + excluded.txn_count,
+        updated_at = now()
+"""
+
+RollupKey = Tuple[uuid.UUID, date, str]
+
+
+def rollup_key(user_id: uuid.UUID, occurred_at: datetime, category: Optional[str]) -> RollupKey:
+    if occurred_at.tzinfo is not None:
+        occurred_at = occurred_at.astimezone(timezone.utc)
+    return user_id, month_start(occurred_at.date()), category or UNCATEGORIZED
+
+
+async def lock_user_rollups(db: AsyncSession, user_ids):
+    """
+    Takes the rollup lock of each user, in sorted order so concurrent writers never deadlock.
+    """
+    for user_id in sorted(set(user_ids)):
+        await db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:user_id))"), {"user_id": str(user_id)})
+
+
+def month_bounds(start_month: date, end_month: date) -> Tuple[datetime, datetime]:
+    """
+    Returns the UTC timestamps covering start_month up to and including end_month.
+    """
+    start = datetime.combine(month_start(start_month), time.min, tzinfo=timezone.utc)
+    end = datetime.combine(month_start(end_month, 1), time.min, tzinfo=timezone.utc)
+    return start, end
+
+
+class RollupDeltas:
+    """
+    Collects the rollup changes caused by one or more ledger writes so they can be applied
+    with a single upsert. Deltas for the same key are merged first, because one
+    INSERT ... ON CONFLICT DO UPDATE cannot touch the same row twice.
+    """
+
+    def __init__(self):
+        self._deltas: Dict[RollupKey, List[int]] = defaultdict(lambda: [0, 0, 0])
+
+    def add(self, user_id: uuid.UUID, occurred_at: datetime, category: Optional[str],
+            direction: str, amount_minor: int, sign: int = 1):
+        delta = self._deltas[rollup_key(user_id, occurred_at, category)]
+        delta[0 if direction == "debit" else 1] += sign * amount_minor
+        delta[2] += sign
+
+    def add_transaction(self, transaction, sign: int = 1):
+        self.add(transaction.user_id, transaction.occurred_at, transaction.category,
+                 transaction.direction, transaction.amount_minor, sign)
+
+    def rows(self) -> List[dict]:
+        return [
+            {"user_id": user_id, "month": month, "category": category,
+             "debit_minor": debit, "credit_minor": credit, "txn_count": count}
+            for (user_id, month, category), (debit, credit, count) in sorted(self._deltas.items())
+            if debit or credit or count
+        ]
+
+    async def apply(self, db: AsyncSession):
+        """
+        Upserts the merged deltas. Rows are written in key order so concurrent writers lock
+        rollup rows in the same order. The caller commits.
+        """
+        rows = self.rows()
+        if not rows:
+            return
+        await lock_user_rollups(db, (row["user_id"] for row in rows))
+        stmt = insert(CategoryMonthlyRollup).values(rows)
+        table = CategoryMonthlyRollup.__table__
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.month, table.c.category],
+            set_={
+                "debit_minor": table.c.debit_minor + stmt.excluded.debit_minor,
+                "credit_minor": table.c.credit_minor + stmt.excluded.credit_minor,
+                "txn_count": table.c.txn_count + stmt.excluded.txn_count,
+                "updated_at": func.now(),
+            },
+        ))
+
+
+async def apply_transaction(db: AsyncSession, transaction, sign: int = 1):
+    deltas = RollupDeltas()
+    deltas.add_transaction(transaction, sign)
+    await deltas.apply(db)
+
+
+LEDGER_AGGREGATE = f"""
+    SELECT user_id, {MONTH_SQL.format(column="occurred_at")} AS month,
+           {CATEGORY_SQL.format(column="category")} AS category,
+           sum(CASE WHEN direction = 'debit' THEN amount_minor ELSE 0 END)::bigint AS debit_minor,
+           sum(CASE WHEN direction = 'credit' THEN amount_minor ELSE 0 END)::bigint AS credit_minor,
+           count(*)::int AS txn_count
+    FROM transactions
+    WHERE occurred_at >= :start AND occurred_at < :end
+      AND (CAST(:user_id AS uuid) IS NULL OR user_id = :user_id)
+    GROUP BY 1, 2, 3
+"""
+
+REBUILD_DELETE = text("""
+    DELETE FROM category_monthly_rollups
+    WHERE user_id = :user_id AND month >= :start_month AND month <= :end_month
+""")
+
+REBUILD_INSERT = text(f"""
+    INSERT INTO category_monthly_rollups (user_id, month, category, debit_minor, credit_minor, txn_count)
+    {LEDGER_AGGREGATE}
+""")
+
+DRIFT_QUERY = text(f"""
+    WITH ledger AS ({LEDGER_AGGREGATE}),
+    rollups AS (
+        SELECT user_id, month, category, debit_minor, credit_minor, txn_count
+        FROM category_monthly_rollups
+        WHERE month >= :start_month AND month <= :end_month AND txn_count <> 0
+          AND (CAST(:user_id AS uuid) IS NULL OR user_id = :user_id)
+    )
+    SELECT coalesce(l.user_id, r.user_id) AS user_id, coalesce(l.month, r.month) AS month,
+           coalesce(l.category, r.category) AS category,
+           l.debit_minor AS ledger_debit_minor, r.debit_minor AS rollup_debit_minor,
+           l.credit_minor AS ledger_credit_minor, r.credit_minor AS rollup_credit_minor,
+           l.txn_count AS ledger_txn_count, r.txn_count AS rollup_txn_count
+    FROM ledger l
+    FULL OUTER JOIN rollups r USING (user_id, month, category)
+    WHERE l.user_id IS NULL OR r.user_id IS NULL
+       OR (l.debit_minor, l.credit_minor, l.txn_count) IS DISTINCT FROM (r.debit_minor, r.credit_minor, r.txn_count)
+    ORDER BY 1, 2, 3
+""")
+
+
+async def rebuild_rollups(db: AsyncSession, user_id: uuid.UUID, start_month: date, end_month: date) -> int:
+    """
+    Recomputes a user's rollups for start_month..end_month (inclusive) from the ledger and
+    returns the number of rollup rows written. The user's rollup lock is held until the
+    caller commits, so a transaction of theirs committed mid-rebuild is neither lost nor
+    counted twice; other users' writers and all readers are not blocked.
+    """
+    start, end = month_bounds(start_month, end_month)
+    await lock_user_rollups(db, [user_id])
+    await db.execute(REBUILD_DELETE, {
+        "user_id": user_id, "start_month": month_start(start_month), "end_month": month_start(end_month),
+    })
+    result = await db.execute(REBUILD_INSERT, {"user_id": user_id, "start": start, "end": end})
+    return result.rowcount or 0
+
+
+async def find_rollup_drift(db: AsyncSession, start_month: date, end_month: date,
+                            user_id: Optional[uuid.UUID] = None) -> List[dict]:
+    """
+    Compares rollups with the ledger for start_month..end_month, for one user or all of them.
+    Returns one dict per (user, month, category) that disagrees; an empty list means consistent.
+    """
+    start, end = month_bounds(start_month, end_month)
+    result = await db.execute(DRIFT_QUERY, {
+        "user_id": user_id, "start": start, "end": end,
+        "start_month": month_start(start_month), "end_month": month_start(end_month),
+    })
+    return [dict(row) for row in result.mappings()]
+
+
+def _parse_month(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+async def _main(args) -> int:
+    from app.db.database import SessionLocal, engine
+
+    today = datetime.now(timezone.utc).date()
+    start_month = _parse_month(args.start) if args.start else date(today.year - 1, today.month, 1)
+    end_month = _parse_month(args.end) if args.end else month_start(today)
+    try:
+        async with SessionLocal() as db:
+            if args.command == "rebuild":
+                rows = await rebuild_rollups(db, args.user, start_month, end_month)
+                await db.commit()
+                print(f"rebuilt {rows} rollup rows for {args.user}")
+                return 0
+
+            drift = await find_rollup_drift(db, start_month, end_month, args.user)
+            for row in drift:
+                print(row)
+            print(f"{len(drift)} inconsistent rollup rows")
+            if drift and args.repair:
+                for drifted_user in sorted({row["user_id"] for row in drift}):
+                    await rebuild_rollups(db, drifted_user, start_month, end_month)
+                    await db.commit()
+                    print(f"rebuilt rollups for {drifted_user}")
+            return 1 if drift and not args.repair else 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("check", "rebuild"))
+    parser.add_argument("--user", type=uuid.UUID)
+    parser.add_argument("--from", dest="start", help="first month, YYYY-MM (default: 12 months ago)")
+    parser.add_argument("--to", dest="end", help="last month, YYYY-MM (default: current month)")
+    parser.add_argument("--repair", action="store_true", help="rebuild every user with drift")
+    arguments = parser.parse_args()
+    if arguments.command == "rebuild" and arguments.user is None:
+        parser.error("rebuild needs --user")
+    raise SystemExit(asyncio.run(_main(arguments)))
@@ -0,0 +1,217 @@
+"""
+Transaction search and merchant autocomplete.
+
+Search runs in Postgres on indexes made for it. Merchant and location substrings become
+ILIKE '%...%' patterns, which the pg_trgm GIN indexes on (user_id, merchant) and (user_id,
+location) answer without scanning the user's ledger; trigrams need at least
+SEARCH_MIN_CHARS characters to narrow anything, so shorter substrings are refused. `q`
+matches word prefixes anywhere in merchant, UPI app, location and description through the
+search_vector column and its GIN index.
+
+Autocomplete does not touch the database once warm. Each user's distinct merchants live
+in a MerchantIndex, a sorted array searched by bisection (rankings for one- and
+two-character prefixes are memoized), loaded on first use with one GROUP BY and kept in a
+bounded TTL cache. Transactions created or edited through this
+worker update the index in place; bulk imports drop it. Other workers' copies catch up
+within MERCHANT_INDEX_TTL.
+"""
+import bisect
+import heapq
+import itertools
+import os
+import re
+import uuid
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Transaction
+from app.utils.cache import TTLCache
+
+SEARCH_MIN_CHARS = 3
+MERCHANT_INDEX_CACHE_SIZE = int(os.getenv("MERCHANT_INDEX_CACHE_SIZE", "10000"))
+MERCHANT_INDEX_TTL = float(os.getenv("MERCHANT_INDEX_TTL", "600"))
+# Rankings for prefixes up to this long match much of the index, so they are memoized
+MEMO_PREFIX_CHARS = 2
+MAX_SUGGESTIONS = 50
+
+WORD = re.compile(r"\w+")
+
+
+def contains_pattern(value: str) -> str:
+    """
+    ILIKE pattern matching `value` anywhere, with its own wildcards escaped.
+    """
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def prefix_tsquery(text: str) -> Optional[str]:
+    """
+    to_tsquery input requiring every word of `text` as a prefix: "swig blr" becomes
+    "swig:* & blr:*". Returns None when there are no words. Only word characters are kept,
+    so the result is always valid tsquery syntax.
+    """
+    words = WORD.findall(text.lower())
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def search_conditions(q: Optional[str] = None, merchant: Optional[str] = None, upi_app: Optional[str] = None,
+                      location: Optional[str] = None) -> list:
+    """
+    WHERE clauses for a transaction search, one per given filter.
+    """
+    conditions = []
+    if q:
+        query = prefix_tsquery(q)
+        if query is None:
+            raise ValueError("q has no words to search for")
+        conditions.append(Transaction.search_vector.op("@@")(func.to_tsquery("simple", query)))
+    if merchant:
+        conditions.append(Transaction.merchant.ilike(contains_pattern(merchant)))
+    if location:
+        conditions.append(Transaction.location.ilike(contains_pattern(location)))
+    if upi_app:
+        conditions.append(func.lower(Transaction.upi_app) == upi_app.lower())
+    return conditions
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class MerchantIndex:
+    """
+    One user's merchants, searchable by prefix. Entries are "<key>\\0<merchant>" strings in
+    one sorted list, where the keys of a merchant are its normalized name and every suffix
+    of it that starts at a word, so "pay" finds "Amazon Pay". Ranked by how many of the
+    user's transactions name the merchant.
+    """
+
+    def __init__(self, counts: Optional[Dict[str, int]] = None):
+        self.counts: Dict[str, int] = dict(counts or {})
+        self._entries: List[str] = sorted(
+            entry for merchant in self.counts for entry in self._entries_for(merchant)
+        )
+        self._memo: Dict[str, List[str]] = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    @staticmethod
+    def _entries_for(merchant: str) -> set:
+        words = _normalize(merchant).split()
+        return {f"{' '.join(words[i:])}\0{merchant}" for i in range(len(words))}
+
+    def add(self, merchant: str, count: int = 1):
+        self._memo.clear()
+        if merchant in self.counts:
+            self.counts[merchant] += count
+            return
+        self.counts[merchant] = count
+        for entry in self._entries_for(merchant):
+            bisect.insort(self._entries, entry)
+
+    def remove(self, merchant: str, count: int = 1):
+        self._memo.clear()
+        remaining = self.counts.get(merchant, 0) - count
+        if remaining > 0:
+            self.counts[merchant] = remaining
+            return
+        if self.counts.pop(merchant, None) is None:
+            return
+        for entry in self._entries_for(merchant):
+            i = bisect.bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def lookup(self, prefix: str, limit: int = 10) -> List[dict]:
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        if len(prefix) > MEMO_PREFIX_CHARS:
+            best = self._rank(prefix, limit)
+        else:
+            best = self._memo.get(prefix)
+            if best is None:
+                best = self._memo[prefix] = self._rank(prefix, MAX_SUGGESTIONS)
+        return [{"merchant": merchant, "transactions": self.counts[merchant]} for merchant in best[:limit]]
+
+    def _rank(self, prefix: str, limit: int) -> List[str]:
+        matches = set()
+        for i in range(bisect.bisect_left(self._entries, prefix), len(self._entries)):
+            entry = self._entries[i]
+            if not entry.startswith(prefix):
+                break
+            matches.add(entry[entry.index("\0") + 1:])
+        return heapq.nsmallest(limit, matches, key=lambda merchant: (-self.counts[merchant], merchant.lower()))
+
+
+class MerchantAutocomplete:
+    """
+    Per-user MerchantIndexes for this worker. An index being loaded while the user's
+    merchants change is used for that request but not cached, the same way analytics
+    reports are.
+    """
+
+    def __init__(self, cache_size: int = MERCHANT_INDEX_CACHE_SIZE, ttl: float = MERCHANT_INDEX_TTL):
+        self._indexes = TTLCache("merchant_index", cache_size, ttl)
+        self._generations = TTLCache("merchant_index_generations", cache_size, ttl)
+        self._counter = itertools.count(1)
+
+    async def suggest(self, db: AsyncSession, user_id: uuid.UUID, prefix: str, limit: int = 10) -> List[dict]:
+        index = self._indexes.get(user_id)
+        if index is None:
+            generation = self._generations.get(user_id, 0, record=False)
+            result = await db.execute(
+                select(Transaction.merchant, func.count())
+                .where(Transaction.user_id == user_id, Transaction.merchant.is_not(None))
+                .group_by(Transaction.merchant)
+            )
+            index = MerchantIndex(dict(result.all()))
+            if self._generations.get(user_id, 0, record=False) == generation:
+                self._indexes.set(user_id, index)
+        return index.lookup(prefix, limit)
+
+    def record(self, user_id: uuid.UUID, added: Optional[str] = None, removed: Optional[str] = None):
+        index = self._indexes.get(user_id, record=False)
+        if index is not None:
+            if removed:
+                index.remove(removed)
+            if added:
+                index.add(added)
+        self._generations.set(user_id, next(self._counter))
+
+    def invalidate(self, user_id: uuid.UUID):
+        self._indexes.pop(user_id)
+        self._generations.set(user_id, next(self._counter))
+
+
+_merchant_autocomplete: Optional[MerchantAutocomplete] = None
+
+
+def get_merchant_autocomplete() -> MerchantAutocomplete:
+    global _merchant_autocomplete
+    if _merchant_autocomplete is None:
+        _merchant_autocomplete = MerchantAutocomplete()
+    return _merchant_autocomplete
+
+
+def record_merchant(user_id: uuid.UUID, added: Optional[str] = None, removed: Optional[str] = None):
+    """
+    Updates the user's merchant index after one transaction was created (`added`) or had
+    its merchant changed (`removed` to `added`). Commit first.
+    """
+    if _merchant_autocomplete is not None and (added or removed) and added != removed:
+        _merchant_autocomplete.record(user_id, added, removed)
+
+
+def invalidate_merchant_index(user_id: uuid.UUID):
+    """
+    Drops the user's merchant index, to be reloaded on next use. For bulk writes.
+    """
+    if _merchant_autocomplete is not None:
+        _merchant_autocomplete.invalidate(user_id)
@@ -1,8 +1,14 @@
+import asyncio
 import hashlib
+import hmac
+import os
 import secrets
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import List, Optional, Sequence, Tuple
 
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError, VerifyMismatchError
 from jose import jwt, JWTError
 
 # Configuration for JWT
@@ -12,18 +18,221 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # 30 minutes
 REFRESH_TOKEN_EXPIRE_DAYS = 7    # 7 days
 
-# Reverted to original password hashing and verification
+# Configuration for password hashing
+# PASSWORD_HASHER selects the backend used for new hashes ("argon2" or "sha256" for legacy setups).
+# PASSWORD_HASH_POOL is "thread" or "process"; argon2 releases the GIL, so threads are usually enough.
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "argon2")
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
+
+class Argon2Hasher:
+    """
+    Memory-hard argon2id hasher. This is the default backend for new hashes.
+    """
+    name = "argon2"
+
+    def __init__(self, time_cost: int = ARGON2_TIME_COST, memory_cost: int = ARGON2_MEMORY_COST,
+                 parallelism: int = ARGON2_PARALLELISM):
+        self._hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+    def identify(self, hashed_password: str) -> bool:
+        return hashed_password.startswith("$argon2")
+
+    def hash(self, password: str) -> str:
+        return self._hasher.hash(password)
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        try:
+            return self._hasher.verify(hashed_password, plain_password)
+        except (VerifyMismatchError, VerificationError, InvalidHashError):
+            return False
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return self._hasher.check_needs_rehash(hashed_password)
+
+
+class LegacySHA256Hasher:
+    """
+    The original salted SHA-256 scheme, stored as "salt:hexdigest".
+    Kept so existing users can still log in; their hashes are upgraded on the next successful login.
+    """
+    name = "sha256"
+
+    def identify(self, hashed_password: str) -> bool:
+        return ":" in hashed_password and not hashed_password.startswith("$")
+
+    def hash(self, password: str) -> str:
+        salt = secrets.token_hex(16)
+        pwd_hash = hashlib.sha256(f"{password}{salt}".encode()).hexdigest()
+        return f"{salt}:{pwd_hash}"
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        try:
+            salt, pwd_hash = hashed_password.split(':', 1)
+            expected = hashlib.sha256(f"{plain_password}{salt}".encode()).hexdigest()
+            return hmac.compare_digest(pwd_hash, expected)
+        except (ValueError, TypeError):
+            return False
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return True
+
+
+HASHERS = {
+    Argon2Hasher.name: Argon2Hasher,
+    LegacySHA256Hasher.name: LegacySHA256Hasher,
+}
+
+_default_hasher = HASHERS[PASSWORD_HASHER]()
+_known_hashers = [_default_hasher] + [cls() for name, cls in HASHERS.items() if name != PASSWORD_HASHER]
+
+
+def _identify_hasher(hashed_password: str):
+    for hasher in _known_hashers:
+        if hasher.identify(hashed_password):
+            return hasher
+    return None
+
+
 def get_password_hash(password: str) -> str:
-    salt = secrets.token_hex(16)
-    pwd_hash = hashlib.sha256(f"{password}{salt}".encode()).hexdigest()
-    return f"{salt}:{pwd_hash}"
+    """
+    Hashes a password with the configured backend. This is CPU and memory heavy;
+    from async code use hash_password() so it runs on the hashing pool instead.
+    """
+    return _default_hasher.hash(password)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    try:
-        salt, pwd_hash = hashed_password.split(':', 1)
-        return pwd_hash == hashlib.sha256(f"{plain_password}{salt}".encode()).hexdigest()
-    except (ValueError, TypeError):
+    """
+    Verifies a password against a hash produced by any known backend.
+    From async code use check_password() so it runs on the hashing pool instead.
+    """
+    if not isinstance(hashed_password, str):
         return False
+    hasher = _identify_hasher(hashed_password)
+    if hasher is None:
+        return False
+    return hasher.verify(plain_password, hashed_password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password and, if the stored hash is legacy or uses outdated parameters,
+    returns a fresh hash to store. Returns (verified, new_hash_or_None).
+    """
+    if not isinstance(hashed_password, str):
+        return False, None
+    hasher = _identify_hasher(hashed_password)
+    if hasher is None or not hasher.verify(plain_password, hashed_password):
+        return False, None
+    if hasher is not _default_hasher or hasher.needs_rehash(hashed_password):
+        return True, _default_hasher.hash(plain_password)
+    return True, None
+
+
+class HashingPoolBusy(Exception):
+    """
+    Raised when too many hashing jobs are already waiting for the pool.
+    """
+
+
+class HashingPool:
+    """
+    Runs password hashing on a bounded thread or process pool so it never blocks the event loop.
+    At most `workers` jobs run at once and at most `max_queue` jobs may wait behind them;
+    beyond that HashingPoolBusy is raised so the caller can shed load instead of piling up.
+    """
+
+    def __init__(self, kind: str = PASSWORD_HASH_POOL, workers: int = PASSWORD_HASH_WORKERS,
+                 max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown password hash pool kind: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwhash")
+        return self._executor
+
+    async def run(self, func, *args):
+        if self._pending >= self.workers + self.max_queue:
+            raise HashingPoolBusy("Password hashing queue is full")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        self._semaphore = None
+
+
+_hashing_pool: Optional[HashingPool] = None
+
+
+def get_hashing_pool() -> HashingPool:
+    global _hashing_pool
+    if _hashing_pool is None:
+        _hashing_pool = HashingPool()
+    return _hashing_pool
+
+
+def shutdown_hashing_pool(wait: bool = True):
+    global _hashing_pool
+    if _hashing_pool is not None:
+        _hashing_pool.shutdown(wait=wait)
+        _hashing_pool = None
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hashes a password on the hashing pool.
+    """
+    return await get_hashing_pool().run(get_password_hash, password)
+
+
+async def hash_passwords(passwords: Sequence[str]) -> List[str]:
+    """
+    Hashes many passwords, keeping at most `workers` of them in the pool at a time so a
+    bulk job never fills the queue that interactive requests rely on.
+    """
+    pool = get_hashing_pool()
+    hashes: List[str] = []
+    for offset in range(0, len(passwords), pool.workers):
+        chunk = passwords[offset:offset + pool.workers]
+        hashes.extend(await asyncio.gather(*(pool.run(get_password_hash, password) for password in chunk)))
+    return hashes
+
+
+async def check_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password on the hashing pool. Returns (verified, new_hash_or_None).
+    """
+    return await get_hashing_pool().run(verify_and_update, plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -31,7 +240,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc), "type": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -41,7 +250,7 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc), "type": "refresh"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -51,6 +260,12 @@ async def authenticate_user(db, email: str, password: str):
 
     user = await db.execute(select(User).where(User.email == email))
     user = user.scalar_one_or_none()
-    if not user or not verify_password(password, user.password_hash):
+    if not user:
+        return None
+    verified, new_hash = await check_password(password, user.password_hash)
+    if not verified:
         return None
+    if new_hash:
+        # Upgrade legacy or outdated hashes now that we know the plain password; the caller commits
+        user.password_hash = new_hash
     return user
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import random
+from typing import List, Optional, Tuple
+
+
+class SMSProviderError(Exception):
+    """
+    Raised by a provider when a message could not be sent.
+    """
+
+
+class SMSProvider:
+    """
+    Interface for SMS providers used by the OTP dispatcher.
+    """
+
+    async def send(self, to: str, body: str) -> str:
+        """
+        Sends a message and returns the provider's message id.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class TwilioSMSProvider(SMSProvider):
+    """
+    Sends SMS through Twilio. A single client is shared by all sends; the Twilio SDK is
+    synchronous, so each request runs in a worker thread instead of on the event loop.
+    """
+
+    def __init__(self, account_sid: Optional[str] = None, auth_token: Optional[str] = None,
+                 from_number: Optional[str] = None):
+        self.account_sid = account_sid or os.getenv("TWILIO_ACCOUNT_SID")
+        self.auth_token = auth_token or os.getenv("TWILIO_AUTH_TOKEN")
+        self.from_number = from_number or os.getenv("TWILIO_PHONE_NUMBER")
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            from twilio.rest import Client  # Imported lazily, only the OTP path needs it
+            self._client = Client(self.account_sid, self.auth_token)
+        return self._client
+
+    def _send_sync(self, to: str, body: str) -> str:
+        message = self._get_client().messages.create(body=body, from_=self.from_number, to=to)
+        return message.sid
+
+    async def send(self, to: str, body: str) -> str:
+        try:
+            return await asyncio.to_thread(self._send_sync, to, body)
+        except Exception as e:
+            raise SMSProviderError(str(e)) from e
+
+
+class FakeSMSProvider(SMSProvider):
+    """
+    Local stand-in for tests and load tests. Records every message instead of sending it,
+    optionally with artificial latency and a random failure rate. With an `outbox` path,
+    messages are also appended to that file as tab-separated recipient and body lines, so a
+    load test running in another process can read the OTP codes.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, outbox: Optional[str] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.outbox = outbox
+        self.sent: List[Tuple[str, str]] = []
+
+    async def send(self, to: str, body: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise SMSProviderError("Simulated provider failure")
+        self.sent.append((to, body))
+        if self.outbox:
+            with open(self.outbox, "a", encoding="utf-8") as f:
+                f.write(f"{to}\t{body}\n")
+        return f"FAKE{len(self.sent):08d}"
+
+
+def create_sms_provider(name: Optional[str] = None) -> SMSProvider:
+    """
+    Builds the provider named by the SMS_PROVIDER environment variable ("twilio" or "fake").
+    """
+    name = name or os.getenv("SMS_PROVIDER", "twilio")
+    if name == "twilio":
+        return TwilioSMSProvider()
+    if name == "fake":
+        return FakeSMSProvider(
+            latency=float(os.getenv("FAKE_SMS_LATENCY", "0")),
+            failure_rate=float(os.getenv("FAKE_SMS_FAILURE_RATE", "0")),
+            outbox=os.getenv("FAKE_SMS_OUTBOX") or None,
+        )
+    raise ValueError(f"Unknown SMS provider: {name}")
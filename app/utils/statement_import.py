@@ -0,0 +1,374 @@
+"""
+Streaming bank statement import.
+
+The uploaded file is never loaded whole: rows flow through a chain of generators
+(parse -> normalize -> batch -> categorize) and each batch is written with asyncpg
+COPY into a temporary staging table, then merged into transactions with
+INSERT ... SELECT ... ON CONFLICT DO NOTHING, which also adds the inserted rows to the
+monthly category rollups. Memory use is bounded by the batch size
+and the repeat window, not by the size of the file.
+"""
+import asyncio
+import codecs
+import csv
+import hashlib
+import itertools
+import os
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import BankAccount
+from app.utils.categorizer import categorize_records, get_categorizer
+from app.utils.rollups import CATEGORY_SQL, MONTH_SQL, ROLLUP_ON_CONFLICT, USER_LOCK_SQL
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Identical rows are numbered within this many distinct recent rows (see Occurrences)
+IMPORT_DEDUP_WINDOW = int(os.getenv("IMPORT_DEDUP_WINDOW", "10000"))
+
+# Header aliases seen in Indian bank statement exports, matched case-insensitively
+COLUMN_ALIASES = {
+    "date": ("date", "txn date", "transaction date", "value date", "posting date"),
+    "description": ("description", "narration", "particulars", "remarks", "details"),
+    "debit": ("debit", "withdrawal", "withdrawal amt", "withdrawal amount", "dr"),
+    "credit": ("credit", "deposit", "deposit amt", "deposit amount", "cr"),
+    "amount": ("amount", "txn amount", "transaction amount"),
+    "direction": ("type", "dr/cr", "cr/dr", "direction"),
+    "merchant": ("merchant", "payee"),
+    "upi_app": ("upi app", "upi_app", "app"),
+    "location": ("location", "city"),
+    "category": ("category",),
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%d-%b-%Y", "%d %b %Y", "%Y-%m-%d %H:%M:%S")
+
+STAGING_COLUMNS = (
+    "transaction_id", "occurred_at", "user_id", "account_id", "amount_minor", "currency", "direction",
+    "category", "merchant", "upi_app", "location", "description", "fingerprint",
+)
+
+
+class StatementFormatError(Exception):
+    """
+    Raised when a file cannot be read as a statement at all (unknown format, missing columns).
+    """
+
+
+def _map_header(header: Iterable) -> dict:
+    lookup = {}
+    for index, name in enumerate(header):
+        key = str(name or "").strip().lower()
+        for field, aliases in COLUMN_ALIASES.items():
+            if key in aliases and field not in lookup:
+                lookup[field] = index
+    if "date" not in lookup or not ({"debit", "credit"} & lookup.keys() or "amount" in lookup):
+        raise StatementFormatError("Statement needs a date column and debit/credit or amount columns")
+    return lookup
+
+
+def parse_csv(file: BinaryIO) -> Iterator[Tuple[dict, list]]:
+    """
+    Yields (column_map, row) for each CSV row, reading the file in buffered chunks.
+    """
+    text = codecs.getreader("utf-8-sig")(file, errors="replace")
+    reader = csv.reader(text)
+    try:
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = _map_header(header)
+        for row in reader:
+            if row:
+                yield columns, row
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise StatementFormatError(f"Not a readable CSV file: {e}") from e
+
+
+def parse_xlsx(file: BinaryIO) -> Iterator[Tuple[dict, list]]:
+    """
+    Yields (column_map, row) for each row of the first sheet, using openpyxl read-only mode
+    so rows are streamed from the archive instead of building the whole workbook.
+    """
+    from openpyxl import load_workbook  # Only the XLSX path needs it
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    unreadable = (zipfile.BadZipFile, InvalidFileException, KeyError, UnicodeDecodeError)
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except unreadable as e:
+        raise StatementFormatError(f"Not a readable XLSX file: {e}") from e
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = _map_header(header)
+        for row in rows:
+            if any(cell is not None for cell in row):
+                yield columns, list(row)
+    except unreadable as e:
+        raise StatementFormatError(f"Not a readable XLSX file: {e}") from e
+    finally:
+        workbook.close()
+
+
+def _cell(row: list, columns: dict, field: str):
+    index = columns.get(field)
+    if index is None or index >= len(row):
+        return None
+    value = row[index]
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _text(row: list, columns: dict, field: str, max_length: int) -> Optional[str]:
+    value = _cell(row, columns, field)
+    return str(value)[:max_length] if value is not None else None
+
+
+def _to_minor(value) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        amount = Decimal(str(value).replace(",", "").replace("₹", "").strip())
+        return int((amount * 100).to_integral_value())
+    except (InvalidOperation, OverflowError):
+        # OverflowError: Infinity; NaN raises ValueError on its own
+        raise ValueError(f"Invalid amount: {value!r}")
+
+
+def _to_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        text = str(value).strip()
+        for fmt in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"Invalid date: {value!r}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def row_fingerprint(account_id: uuid.UUID, occurred_at: datetime, amount_minor: int, direction: str,
+                    description: Optional[str], occurrence: int = 0) -> bytes:
+    """
+    Identifies a ledger row by its source fields and its position among identical rows of
+    the same source, so the same bank row arriving twice (a re-uploaded statement, an
+    overlapping sync) is only stored once, while two genuine identical payments are both kept.
+    The first occurrence keeps the key it had before positions were counted.
+    """
+    key = f"{account_id}|{occurred_at.isoformat()}|{amount_minor}|{direction}|{description or ''}"
+    if occurrence:
+        key += f"|{occurrence}"
+    return hashlib.sha256(key.encode()).digest()[:16]
+
+
+class Occurrences:
+    """
+    Numbers identical rows in the order a source lists them: 0 for the first, 1 for the next
+    and so on. Only the last `window` distinct rows are remembered; identical rows share a
+    date, so they sit close together in any statement or fetch.
+    """
+
+    def __init__(self, window: int = IMPORT_DEDUP_WINDOW):
+        self.window = window
+        self._seen: "OrderedDict[bytes, int]" = OrderedDict()
+
+    def fingerprint(self, account_id: uuid.UUID, occurred_at: datetime, amount_minor: int, direction: str,
+                    description: Optional[str]) -> bytes:
+        first = row_fingerprint(account_id, occurred_at, amount_minor, direction, description)
+        occurrence = self._seen.pop(first, 0)
+        self._seen[first] = occurrence + 1
+        if len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+        if not occurrence:
+            return first
+        return row_fingerprint(account_id, occurred_at, amount_minor, direction, description, occurrence)
+
+
+class ImportStats:
+    __slots__ = ("rows_read", "rows_rejected", "rows_inserted", "started")
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_rejected = 0
+        self.rows_inserted = 0
+        self.started = time.perf_counter()
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "rows_read": self.rows_read,
+            "rows_inserted": self.rows_inserted,
+            "already_imported": self.rows_read - self.rows_rejected - self.rows_inserted,
+            "rows_rejected": self.rows_rejected,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows_read / elapsed, 1) if elapsed else None,
+        }
+
+
+def normalize(rows: Iterable[Tuple[dict, list]], user_id: uuid.UUID, account_id: uuid.UUID,
+              stats: ImportStats) -> Iterator[tuple]:
+    """
+    Turns raw statement rows into staging records. Rows that cannot be parsed are counted and skipped.
+    """
+    occurrences = Occurrences()
+    for columns, row in rows:
+        stats.rows_read += 1
+        try:
+            occurred_at = _to_datetime(_cell(row, columns, "date"))
+            debit = _to_minor(_cell(row, columns, "debit"))
+            credit = _to_minor(_cell(row, columns, "credit"))
+            # The column gives the direction; many banks still sign the value ("-500.00" under Debit)
+            if debit:
+                amount, direction = abs(debit), "debit"
+            elif credit:
+                amount, direction = abs(credit), "credit"
+            else:
+                amount = _to_minor(_cell(row, columns, "amount"))
+                if amount is None:
+                    raise ValueError("Row has no amount")
+                # An explicit Dr/Cr column wins; otherwise the sign decides (negative = money out)
+                marker = str(_cell(row, columns, "direction") or "").lower()
+                if marker:
+                    direction = "credit" if marker.startswith("cr") else "debit"
+                else:
+                    direction = "debit" if amount < 0 else "credit"
+                amount = abs(amount)
+        except ValueError:
+            stats.rows_rejected += 1
+            continue
+
+        description = _text(row, columns, "description", 1000)
+        fingerprint = occurrences.fingerprint(account_id, occurred_at, amount, direction, description)
+        yield (
+            uuid.uuid4(), occurred_at, user_id, account_id, amount, "INR", direction,
+            _text(row, columns, "category", 50), _text(row, columns, "merchant", 150),
+            _text(row, columns, "upi_app", 50), _text(row, columns, "location", 150),
+            description, fingerprint,
+        )
+
+
+def batched(records: Iterable[tuple], size: int = IMPORT_BATCH_SIZE) -> Iterator[List[tuple]]:
+    iterator = iter(records)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def build_pipeline(file: BinaryIO, filename: str, user_id: uuid.UUID, account_id: uuid.UUID,
+                   stats: ImportStats, batch_size: int = IMPORT_BATCH_SIZE) -> Iterator[List[tuple]]:
+    name = (filename or "").lower()
+    if name.endswith(".xlsx"):
+        rows = parse_xlsx(file)
+    elif name.endswith(".csv"):
+        rows = parse_csv(file)
+    else:
+        raise StatementFormatError("Only .csv and .xlsx statements are supported")
+    records = normalize(rows, user_id, account_id, stats)
+    return categorize_records(
+        batched(records, batch_size), get_categorizer(),
+        STAGING_COLUMNS.index("category"), STAGING_COLUMNS.index("merchant"),
+    )
+
+
+CREATE_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS import_staging (
+        transaction_id uuid, occurred_at timestamptz, user_id uuid, account_id uuid,
+        amount_minor bigint, currency char(3), direction varchar(6), category varchar(50),
+        merchant varchar(150), upi_app varchar(50), location varchar(150), description text,
+        fingerprint bytea
+    ) ON COMMIT DROP
+"""
+
+# Taken before each merge, in user order, so a rollup rebuild of the same user waits for it
+LOCK_STAGING_USERS = f"""
+    SELECT {USER_LOCK_SQL.format(column="user_id")}
+    FROM (SELECT DISTINCT user_id FROM import_staging ORDER BY user_id) AS users
+"""
+
+# Inserted rows are rolled up per (user, month, category) in the same statement, so the
+# monthly rollups move together with the ledger
+MERGE_STAGING = f"""
+    WITH inserted AS (
+        INSERT INTO transactions ({", ".join(STAGING_COLUMNS)})
+        SELECT {", ".join(STAGING_COLUMNS)} FROM import_staging
+        ON CONFLICT (account_id, occurred_at, fingerprint) WHERE fingerprint IS NOT NULL DO NOTHING
+        RETURNING user_id, occurred_at, category, direction, amount_minor
+    ), rolled_up AS (
+        INSERT INTO category_monthly_rollups AS r (user_id, month, category, debit_minor, credit_minor, txn_count)
+        SELECT user_id, {MONTH_SQL.format(column="occurred_at")}, {CATEGORY_SQL.format(column="category")},
+               sum(CASE WHEN direction = 'debit' THEN amount_minor ELSE 0 END),
+               sum(CASE WHEN direction = 'credit' THEN amount_minor ELSE 0 END),
+               count(*)
+        FROM inserted
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        {ROLLUP_ON_CONFLICT}
+    )
+    SELECT count(*) FROM inserted
+"""
+
+
+async def copy_batches(session: AsyncSession, batches: Iterator[List[tuple]], stats: ImportStats):
+    """
+    Writes batches with COPY into the staging table and merges each one into transactions,
+    all inside the session's transaction. Parsing the next batch runs in a worker thread so
+    the event loop stays free while large files are read.
+    """
+    # The asyncpg adapter only sends BEGIN with its first statement. Without this, the raw
+    # statements below would autocommit: the ON COMMIT DROP staging table would be gone
+    # before the COPY, and the merge would not commit together with the caller's writes.
+    await session.execute(text("SELECT 1"))
+    connection = await session.connection()
+    raw = await connection.get_raw_connection()
+    driver = raw.driver_connection
+    await driver.execute(CREATE_STAGING)
+
+    while True:
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+        await driver.copy_records_to_table("import_staging", records=batch, columns=STAGING_COLUMNS)
+        await driver.execute(LOCK_STAGING_USERS)
+        stats.rows_inserted += await driver.fetchval(MERGE_STAGING)
+        await driver.execute("TRUNCATE import_staging")
+
+
+async def import_statement(session: AsyncSession, file: BinaryIO, filename: str,
+                           user_id: uuid.UUID, account_id: uuid.UUID) -> dict:
+    """
+    Imports a CSV or XLSX statement into an account in one transaction and updates its last_sync.
+    Returns rows read, inserted, skipped and rejected, plus rows per second.
+    """
+    stats = ImportStats()
+    batches = build_pipeline(file, filename, user_id, account_id, stats)
+    try:
+        await copy_batches(session, batches, stats)
+        await session.execute(
+            update(BankAccount)
+            .where(BankAccount.account_id == account_id)
+            .values(last_sync=datetime.now(timezone.utc))
+        )
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    return stats.report()
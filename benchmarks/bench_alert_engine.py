@@ -0,0 +1,92 @@
+"""
+Alert engine replay benchmark.
+
+Replays a synthetic, time-ordered ledger through a fresh AlertEngine (no database needed)
+and reports events per second, alerts raised, state memory per user and snapshot
+save/restore times. To replay the real ledger instead, use python -m app.utils.alerts replay.
+
+Usage:
+    python benchmarks/bench_alert_engine.py --events 1000000 --users 10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.alerts import AlertEngine, TransactionEvent  # noqa: E402
+
+CATEGORIES = ["food", "travel", "bills", "shopping", "health", "groceries", None]
+CITIES = ["Bengaluru", "Mumbai", "Delhi", "Hyderabad", "Chennai", "Pune", "Kolkata", "Jaipur"]
+
+
+def synthetic_ledger(events: int, users: int, days: int, seed: int = 11):
+    rng = random.Random(seed)
+    user_ids = [uuid.uuid4() for _ in range(users)]
+    # Each user mostly shops at a few regular merchants in their home city
+    regulars = {user_id: [f"Merchant {rng.randrange(5000)}" for _ in range(8)] for user_id in user_ids}
+    homes = {user_id: rng.choice(CITIES) for user_id in user_ids}
+    start = time.time() - days * 86400
+    times = sorted(start + rng.random() * days * 86400 for _ in range(events))
+    ledger = []
+    for at in times:
+        user_id = rng.choice(user_ids)
+        novel = rng.random() < 0.01
+        ledger.append(TransactionEvent(
+            uuid.uuid4(), user_id, at,
+            rng.randrange(1000, 2_000_000 if novel else 300_000),
+            "debit" if rng.random() < 0.9 else "credit",
+            rng.choice(CATEGORIES),
+            f"Merchant {rng.randrange(100000)}" if novel else rng.choice(regulars[user_id]),
+            rng.choice(CITIES) if novel else homes[user_id],
+        ))
+    return user_ids, ledger
+
+
+def main(args):
+    user_ids, ledger = synthetic_ledger(args.events, args.users, args.days)
+    engine = AlertEngine()
+    rng = random.Random(3)
+    for user_id in user_ids:
+        state = engine.state(user_id)
+        for category in CATEGORIES[:4]:
+            state.budgets[category] = rng.randrange(500_000, 5_000_000)
+
+    report = engine.replay(ledger)
+    print(f"replayed {report['events']:,} events for {report['users']:,} users "
+          f"in {report['elapsed_seconds']:.2f}s: {report['events_per_second']:,} events/s")
+    for kind, count in sorted(report["alerts"].items()):
+        print(f"  {kind:<24}{count:>8,}")
+
+    start = time.perf_counter()
+    snapshot = engine.snapshot()
+    save_ms = (time.perf_counter() - start) * 1000
+    restored = AlertEngine()
+    start = time.perf_counter()
+    restored.restore(snapshot)
+    restore_ms = (time.perf_counter() - start) * 1000
+    print(f"snapshot {len(snapshot) / 1e6:.1f} MB ({len(snapshot) / len(engine):,.0f} B/user), "
+          f"save {save_ms:.0f} ms, restore {restore_ms:.0f} ms")
+
+    del restored, snapshot
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    measured = AlertEngine()
+    for event in ledger[:args.memory_events]:
+        measured.process(event)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"in-memory state ~{used / len(measured):,.0f} B/user ({len(measured):,} users)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--memory-events", type=int, default=200_000)
+    main(parser.parse_args())
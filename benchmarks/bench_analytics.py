@@ -0,0 +1,179 @@
+"""
+Spending analytics benchmark: vectorized NumPy/pandas report vs a pure-Python loop.
+
+Generates one user's transactions in memory (no database needed), checks that both
+implementations produce the same report, then times each. The process-pool run includes
+shipping the columns to the worker and the report back.
+
+Usage:
+    python benchmarks/bench_analytics.py --transactions 100000 --repeats 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.analytics import (  # noqa: E402
+    ANALYTICS_LOOKBACK_DAYS, ANALYTICS_TIMEZONE, MOVING_AVERAGE_WINDOWS, AnalyticsEngine, compute_report,
+)
+
+CATEGORIES = ["food", "travel", "bills", "shopping", "health", "groceries", "fuel", ""]
+
+
+def generate(count: int, now_us: int, lookback_days: int, seed: int = 7):
+    rng = random.Random(seed)
+    span = lookback_days * 86_400_000_000
+    timestamps = [now_us - rng.randrange(span) for _ in range(count)]
+    amounts = [rng.randrange(100, 500_000) for _ in range(count)]
+    is_debit = [rng.random() < 0.9 for _ in range(count)]
+    categories = [rng.choice(CATEGORIES) for _ in range(count)]
+    return timestamps, amounts, is_debit, categories
+
+
+def month_index(day) -> int:
+    return day.year * 12 + day.month - 1
+
+
+def python_report(timestamps_us, amounts, is_debit, categories, now_us, tz=ANALYTICS_TIMEZONE,
+                  lookback_days=ANALYTICS_LOOKBACK_DAYS) -> dict:
+    """
+    The same report as compute_report(), one transaction at a time.
+    """
+    zone = ZoneInfo(tz)
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    today = (epoch + timedelta(microseconds=now_us)).astimezone(zone).date()
+    first_day = today - timedelta(days=lookback_days - 1)
+    first_month = month_index(first_day)
+    month_count = month_index(today) - first_month + 1
+
+    spent_by_month = [0] * month_count
+    received_by_month = [0] * month_count
+    spent_by_day = [0] * lookback_days
+    spent_by_category = defaultdict(int)
+    count_by_category = defaultdict(int)
+    first_seen = {}
+    heatmap = [[0] * 24 for _ in range(7)]
+    total_spent = total_received = 0
+
+    for at_us, amount, debit, category in zip(timestamps_us, amounts, is_debit, categories):
+        local = (epoch + timedelta(microseconds=at_us)).astimezone(zone)
+        day = local.date()
+        if day < first_day or day > today:
+            continue
+        first_seen.setdefault(category, len(first_seen))
+        month = month_index(day) - first_month
+        if debit:
+            total_spent += amount
+            spent_by_month[month] += amount
+            spent_by_day[(day - first_day).days] += amount
+            spent_by_category[category] += amount
+            count_by_category[category] += 1
+            heatmap[day.weekday()][local.hour] += amount
+        else:
+            total_received += amount
+            received_by_month[month] += amount
+
+    monthly = []
+    for i in range(month_count):
+        year, month = divmod(first_month + i, 12)
+        change = spent_by_month[i] - spent_by_month[i - 1] if i else None
+        previous = spent_by_month[i - 1] if i else 0
+        monthly.append({
+            "month": f"{year:04d}-{month + 1:02d}",
+            "spent_minor": spent_by_month[i],
+            "received_minor": received_by_month[i],
+            "spent_change_minor": change,
+            "spent_change_pct": round(change * 100.0 / previous, 2) if i and previous > 0 else None,
+        })
+
+    daily = []
+    for i in range(lookback_days):
+        entry = {"date": str(first_day + timedelta(days=i)), "spent_minor": spent_by_day[i]}
+        for window in MOVING_AVERAGE_WINDOWS:
+            start = max(i + 1 - window, 0)
+            entry[f"moving_average_{window}d"] = round(sum(spent_by_day[start:i + 1]) / (i + 1 - start), 2)
+        daily.append(entry)
+
+    category_total = sum(spent_by_category.values())
+    ordered = sorted(spent_by_category, key=lambda name: (-spent_by_category[name], first_seen[name]))
+    category_share = [
+        {
+            "category": name,
+            "spent_minor": spent_by_category[name],
+            "txn_count": count_by_category[name],
+            "share_pct": round(float(spent_by_category[name]) * 100 / category_total, 2) if category_total else 0.0,
+        }
+        for name in ordered
+    ]
+
+    return {
+        "timezone": tz,
+        "lookback_days": lookback_days,
+        "total_spent_minor": total_spent,
+        "total_received_minor": total_received,
+        "monthly": monthly,
+        "daily": daily,
+        "categories": category_share,
+        "heatmap": heatmap,
+    }
+
+
+def timed(func, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+async def timed_pool(columns, now_us: int, repeats: int) -> float:
+    engine = AnalyticsEngine(workers=1)
+    loop = asyncio.get_running_loop()
+    executor = engine._get_executor()
+    # Warm the worker up so process start-up is not measured
+    await loop.run_in_executor(executor, compute_report, *columns, now_us)
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await loop.run_in_executor(executor, compute_report, *columns, now_us)
+        samples.append(time.perf_counter() - start)
+    engine.shutdown()
+    return statistics.median(samples) * 1000
+
+
+def main(args):
+    now_us = int(datetime.now(timezone.utc).timestamp() * 1_000_000)
+    columns = generate(args.transactions, now_us, ANALYTICS_LOOKBACK_DAYS)
+
+    vectorized = compute_report(*columns, now_us)
+    reference = python_report(*columns, now_us)
+    if vectorized != reference:
+        for key in reference:
+            if vectorized[key] != reference[key]:
+                print(f"mismatch in {key!r}")
+        raise SystemExit(1)
+
+    python_ms = timed(lambda: python_report(*columns, now_us), args.repeats)
+    numpy_ms = timed(lambda: compute_report(*columns, now_us), args.repeats)
+    pool_ms = asyncio.run(timed_pool(columns, now_us, args.repeats))
+
+    print(f"{args.transactions:,} transactions, {ANALYTICS_LOOKBACK_DAYS} day window (reports match)")
+    print(f"pure Python loop      : {python_ms:8.1f} ms")
+    print(f"NumPy/pandas inline   : {numpy_ms:8.1f} ms  ({python_ms / numpy_ms:.1f}x)")
+    print(f"NumPy/pandas via pool : {pool_ms:8.1f} ms  (includes pickling to and from the worker)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    main(parser.parse_args())
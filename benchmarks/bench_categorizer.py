@@ -0,0 +1,122 @@
+"""
+Categorization throughput benchmark.
+
+Trains a model on synthetic labelled merchants, saves it, loads it memory-mapped and reports
+predictions per second for one-at-a-time calls, direct batches, the async micro-batcher
+under concurrent requests, and merchant-cache hits.
+
+Usage:
+    python benchmarks/bench_categorizer.py --train 50000 --requests 5000 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.categorizer import (  # noqa: E402
+    CategorizationBatcher, Categorizer, save_model, train_model,
+)
+
+MERCHANTS = {
+    "food": ["Swiggy", "Zomato", "Dominos Pizza", "Cafe Coffee Day", "Haldiram", "Barbeque Nation"],
+    "travel": ["Uber India", "Ola Cabs", "IRCTC", "Indigo Airlines", "Rapido", "MakeMyTrip"],
+    "groceries": ["BigBasket", "Blinkit", "Zepto", "DMart", "Reliance Fresh", "More Supermarket"],
+    "bills": ["BESCOM", "Airtel Postpaid", "Jio Recharge", "Tata Power", "ACT Fibernet", "BWSSB"],
+    "shopping": ["Amazon", "Flipkart", "Myntra", "Ajio", "Nykaa", "Croma"],
+    "health": ["Apollo Pharmacy", "1mg", "PharmEasy", "Practo", "MedPlus", "Cult Fit"],
+    "fuel": ["Indian Oil", "HP Petrol Pump", "Bharat Petroleum", "Shell India", "Nayara Energy", "IOCL"],
+}
+UPI_APPS = ["GPay", "PhonePe", "Paytm", "BHIM", None]
+CITIES = ["Bengaluru", "Mumbai", "Delhi", "Hyderabad", "Chennai", "Pune", None]
+
+
+def synthetic_rows(count: int, seed: int):
+    rng = random.Random(seed)
+    features, labels = [], []
+    for _ in range(count):
+        category = rng.choice(list(MERCHANTS))
+        # Store or branch suffixes make most merchants unique, like real narrations
+        merchant = f"{rng.choice(MERCHANTS[category])} {rng.choice(['', 'Store', 'Outlet', 'Online'])} {rng.randrange(10000)}"
+        features.append((merchant, rng.choice(UPI_APPS), rng.choice(CITIES)))
+        labels.append(category)
+    return features, labels
+
+
+def rate(count: int, elapsed: float) -> str:
+    return f"{count / elapsed:10,.0f} predictions/s"
+
+
+async def run_batcher(categorizer: Categorizer, features, concurrency: int, wait_ms: float):
+    batcher = CategorizationBatcher(categorizer, max_wait_ms=wait_ms)
+    limiter = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(row):
+        async with limiter:
+            start = time.perf_counter()
+            await batcher.categorize(*row)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(row) for row in features))
+    elapsed = time.perf_counter() - start
+    await batcher.close()
+    latencies.sort()
+    return elapsed, statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def main(args):
+    train_x, train_y = synthetic_rows(args.train, seed=1)
+    test_x, test_y = synthetic_rows(args.requests, seed=2)
+
+    start = time.perf_counter()
+    model = train_model(train_x, train_y)
+    print(f"trained on {args.train:,} rows in {time.perf_counter() - start:.1f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "categorizer.joblib")
+        save_model(model, path)
+        print(f"model file {os.path.getsize(path) / 1e6:.1f} MB")
+        start = time.perf_counter()
+        categorizer = Categorizer.load(path, min_confidence=0.0)
+        print(f"mmap load {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        predicted = categorizer.predict_batch(test_x)
+        accuracy = sum(p == y for p, y in zip(predicted, test_y)) / len(test_y)
+        print(f"accuracy on unseen merchants: {accuracy:.3f}\n")
+
+        single = test_x[:min(len(test_x), 1000)]
+        start = time.perf_counter()
+        for row in single:
+            categorizer.predict_batch([row])
+        print(f"single item       : {rate(len(single), time.perf_counter() - start)}")
+
+        for size in (32, 256, 1024):
+            start = time.perf_counter()
+            for offset in range(0, len(test_x), size):
+                categorizer.predict_batch(test_x[offset:offset + size])
+            print(f"batch of {size:<5}    : {rate(len(test_x), time.perf_counter() - start)}")
+
+        categorizer.cache.clear()
+        elapsed, p50, p99 = asyncio.run(run_batcher(categorizer, test_x, args.concurrency, args.wait_ms))
+        print(f"micro-batcher     : {rate(len(test_x), elapsed)}  "
+              f"(concurrency {args.concurrency}, p50 {p50:.1f} ms, p99 {p99:.1f} ms)")
+
+        # Every merchant is now cached, so the same requests never reach the model
+        elapsed, p50, p99 = asyncio.run(run_batcher(categorizer, test_x, args.concurrency, args.wait_ms))
+        print(f"merchant cache    : {rate(len(test_x), elapsed)}  (p50 {p50:.3f} ms, p99 {p99:.3f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--train", type=int, default=50_000)
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--wait-ms", type=float, default=5.0)
+    main(parser.parse_args())
@@ -0,0 +1,79 @@
+"""
+Password hashing benchmark.
+
+Simulates a burst of concurrent logins and reports logins per second and event-loop lag,
+once with verification run inline on the event loop and once through the hashing pool.
+
+Usage:
+    python benchmarks/bench_password_hashing.py --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.security import HashingPool, get_password_hash, verify_and_update  # noqa: E402
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float, samples: list):
+    """
+    Sleeps for `interval` in a loop and records how late each wake-up was.
+    """
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+async def run_burst(mode: str, hashed: str, password: str, logins: int, concurrency: int, pool_kind: str):
+    pool = HashingPool(kind=pool_kind, max_queue=logins) if mode == "pool" else None
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with limiter:
+            if pool is None:
+                verify_and_update(password, hashed)
+            else:
+                await pool.run(verify_and_update, password, hashed)
+
+    stop = asyncio.Event()
+    lag_samples = []
+    lag_task = asyncio.create_task(measure_loop_lag(stop, 0.005, lag_samples))
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await lag_task
+    if pool is not None:
+        pool.shutdown()
+
+    lag_samples.sort()
+    max_lag = lag_samples[-1] if lag_samples else elapsed
+    p99_lag = lag_samples[int(len(lag_samples) * 0.99)] if lag_samples else elapsed
+    print(f"{mode:>6}: {logins / elapsed:8.1f} logins/s  "
+          f"loop lag p99={p99_lag * 1000:7.1f} ms  max={max_lag * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pool", choices=["thread", "process"], default="thread")
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    hashed = get_password_hash(password)
+
+    asyncio.run(run_burst("inline", hashed, password, args.logins, args.concurrency, args.pool))
+    asyncio.run(run_burst("pool", hashed, password, args.logins, args.concurrency, args.pool))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Push fan-out benchmark against the local fake FCM server.
+
+Simulates a month-end burst: `--alerts` alerts spread over `--users` users with
+`--devices` tokens each (a share of them already unregistered). Compares a naive sender
+(one HTTP call per alert per device, a new connection each time) with PushWorker
+(per-user coalescing, one token lookup per batch, pooled client, bounded concurrency).
+The naive sender only gets the first `--naive-alerts` alerts; it is too slow for the full
+burst. No database is needed; tokens are served from memory.
+
+Usage:
+    python benchmarks/bench_push_fanout.py --alerts 5000 --users 1000 --devices 2 --latency-ms 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx  # noqa: E402
+
+from app.utils.alerts import Alert  # noqa: E402
+from app.utils.fake_fcm import FakeFCMServer  # noqa: E402
+from app.utils.push import FCMClient, PushWorker  # noqa: E402
+
+
+def build_burst(alerts: int, users: int, devices: int, invalid_rate: float, seed: int = 5):
+    rng = random.Random(seed)
+    user_ids = [uuid.uuid4() for _ in range(users)]
+    tokens = {
+        user_id: [("invalid-" if rng.random() < invalid_rate else "token-") + uuid.uuid4().hex for _ in range(devices)]
+        for user_id in user_ids
+    }
+    # Skewed like real bursts: a minority of users get most of the alerts
+    weights = [1 / (rank + 1) for rank in range(users)]
+    burst = [
+        Alert(user_id, "budget_warning", "You have used 80% of your food budget", uuid.uuid4(), time.time(), {})
+        for user_id in rng.choices(user_ids, weights=weights, k=alerts)
+    ]
+    return tokens, burst
+
+
+async def naive(server: FakeFCMServer, tokens, burst, concurrency: int):
+    limiter = asyncio.Semaphore(concurrency)
+    path = "/v1/projects/local/messages:send"
+
+    async def send(token: str, alert: Alert):
+        async with limiter:
+            async with httpx.AsyncClient(base_url=server.base_url) as client:
+                await client.post(path, json={"message": {"token": token, "notification": {"body": alert.message}}})
+
+    await asyncio.gather(*(send(token, alert) for alert in burst for token in tokens[alert.user_id]))
+
+
+async def fan_out(server: FakeFCMServer, tokens, burst, concurrency: int, batch_size: int):
+    async def load(user_ids):
+        return {user_id: list(tokens[user_id]) for user_id in user_ids}
+
+    async def prune(dead):
+        dead = set(dead)
+        for user_id in tokens:
+            tokens[user_id] = [token for token in tokens[user_id] if token not in dead]
+        return len(dead)
+
+    queue = asyncio.Queue()
+    worker = PushWorker(queue, FCMClient(base_url=server.base_url, project_id="local", max_connections=concurrency),
+                        token_loader=load, token_pruner=prune, batch_size=batch_size, concurrency=concurrency)
+    summary = {}
+    for offset in range(0, len(burst), batch_size):
+        for result, count in (await worker.deliver(burst[offset:offset + batch_size])).items():
+            summary[result] = summary.get(result, 0) + count
+    await worker.client.close()
+    return summary
+
+
+async def main(args):
+    for name in ("naive", "worker"):
+        tokens, burst = build_burst(args.alerts, args.users, args.devices, args.invalid_rate)
+        if name == "naive":
+            burst = burst[:args.naive_alerts]
+        server = FakeFCMServer(latency=args.latency_ms / 1000)
+        await server.start()
+        start = time.perf_counter()
+        if name == "naive":
+            await naive(server, tokens, burst, args.concurrency)
+            summary = ""
+        else:
+            summary = await fan_out(server, tokens, burst, args.concurrency, args.batch_size)
+        elapsed = time.perf_counter() - start
+        await server.stop()
+        requests = server.stats["accepted"] + server.stats["unregistered"] + server.stats["unavailable"]
+        print(f"{name:>6}: {len(burst) / elapsed:8,.0f} alerts/s  {elapsed:6.2f}s  "
+              f"{requests:7,} HTTP calls  {server.stats['connections']:6,} connections  {summary}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alerts", type=int, default=5_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--devices", type=int, default=2)
+    parser.add_argument("--invalid-rate", type=float, default=0.05)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--naive-alerts", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
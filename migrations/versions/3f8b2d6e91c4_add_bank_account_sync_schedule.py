@@ -0,0 +1,34 @@
+"""Add bank_accounts.next_sync_at and sync_failures for Account Aggregator sync
+
+Revision ID: 3f8b2d6e91c4
+Revises: cd9000412995
+Create Date: 2026-10-18 16:42:08.513207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8b2d6e91c4'
+down_revision: Union[str, Sequence[str], None] = 'cd9000412995'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('bank_accounts', sa.Column('next_sync_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='When the account is next due for an Account Aggregator sync'))
+    op.add_column('bank_accounts', sa.Column('sync_failures', sa.INTEGER(), server_default='0', nullable=False, comment='Consecutive failed syncs, for backoff'))
+    # Spread the first sync of existing accounts over an hour instead of all at once
+    op.execute("UPDATE bank_accounts SET next_sync_at = now() + random() * interval '1 hour'")
+    op.create_index('ix_bank_accounts_next_sync_at', 'bank_accounts', ['next_sync_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_bank_accounts_next_sync_at', table_name='bank_accounts')
+    op.drop_column('bank_accounts', 'sync_failures')
+    op.drop_column('bank_accounts', 'next_sync_at')
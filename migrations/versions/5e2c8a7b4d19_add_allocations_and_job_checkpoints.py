@@ -0,0 +1,53 @@
+"""Add monthly fund allocations and batch job checkpoints
+
+Revision ID: 5e2c8a7b4d19
+Revises: 9a41c7e5d203
+Create Date: 2026-10-18 19:02:37.551840
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2c8a7b4d19'
+down_revision: Union[str, Sequence[str], None] = '9a41c7e5d203'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('allocations',
+    sa.Column('user_id', sa.UUID(), nullable=False, comment='Owner user ID'),
+    sa.Column('month', sa.DATE(), nullable=False, comment='First day of the month'),
+    sa.Column('name', sa.VARCHAR(length=10), nullable=False, comment='Fund: fixed, spend or save'),
+    sa.Column('target_pct', sa.SMALLINT(), nullable=True, comment="Share of the previous month's income, in percent"),
+    sa.Column('target_amount_minor', sa.BIGINT(), nullable=True, comment='Fixed monthly amount, used instead of target_pct when set'),
+    sa.Column('funded_minor', sa.BIGINT(), server_default='0', nullable=False, comment='Money put into the fund for the month'),
+    sa.Column('balance_minor', sa.BIGINT(), server_default='0', nullable=False, comment='Fund balance for the month after funding'),
+    sa.Column('last_funded', sa.TIMESTAMP(timezone=True), nullable=True, comment='When the fund was last funded'),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Creation time'),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Last update time'),
+    sa.CheckConstraint("name IN ('fixed', 'spend', 'save')", name='ck_allocations_name'),
+    sa.CheckConstraint('target_pct BETWEEN 0 AND 100', name='ck_allocations_target_pct'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'month', 'name')
+    )
+    op.create_table('job_checkpoints',
+    sa.Column('job', sa.VARCHAR(length=100), nullable=False, comment='Job and run name, e.g. allocation_rollover:2026-11'),
+    sa.Column('last_key', sa.TEXT(), nullable=True, comment="Last key processed, in the job's own ordering"),
+    sa.Column('processed', sa.BIGINT(), server_default='0', nullable=False, comment='Items processed so far'),
+    sa.Column('started_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='When the run first started'),
+    sa.Column('completed_at', sa.TIMESTAMP(timezone=True), nullable=True, comment='When the run finished'),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Last update time'),
+    sa.PrimaryKeyConstraint('job')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('job_checkpoints')
+    op.drop_table('allocations')
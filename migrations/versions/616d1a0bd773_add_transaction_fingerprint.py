@@ -0,0 +1,33 @@
+"""Add transactions.fingerprint for idempotent imports
+
+Revision ID: 616d1a0bd773
+Revises: bead126c7bd6
+Create Date: 2026-10-18 13:05:31.662790
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '616d1a0bd773'
+down_revision: Union[str, Sequence[str], None] = 'bead126c7bd6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('transactions', sa.Column('fingerprint', sa.LargeBinary(length=16), nullable=True, comment='Digest of the source row, used to skip duplicates on re-import'))
+    # Unique indexes on a partitioned table must include the partition key
+    op.create_index('ux_transactions_account_fingerprint', 'transactions',
+                    ['account_id', 'occurred_at', 'fingerprint'], unique=True,
+                    postgresql_where=sa.text('fingerprint IS NOT NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_transactions_account_fingerprint', table_name='transactions')
+    op.drop_column('transactions', 'fingerprint')
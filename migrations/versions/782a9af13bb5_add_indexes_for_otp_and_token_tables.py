@@ -0,0 +1,63 @@
+"""Add indexes for otp_verifications, refresh_tokens and fcm_tokens
+
+Revision ID: 782a9af13bb5
+Revises: 7c9348089156
+Create Date: 2026-10-18 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '782a9af13bb5'
+down_revision: Union[str, Sequence[str], None] = '7c9348089156'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built concurrently so large tables stay writable; this cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        # OTP verify: user_id = ? AND otp_code = ? AND NOT verified AND expires_at > now()
+        op.create_index('ix_otp_verifications_user_pending', 'otp_verifications',
+                        ['user_id', 'otp_code', 'expires_at'],
+                        postgresql_where=sa.text('verified = false'),
+                        postgresql_concurrently=True)
+        # Retention purge: expires_at < cutoff
+        op.create_index('ix_otp_verifications_expires_at', 'otp_verifications', ['expires_at'],
+                        postgresql_concurrently=True)
+
+        # Refresh: token = ?; equality only, so a hash index keeps TEXT keys compact
+        op.create_index('ix_refresh_tokens_token', 'refresh_tokens', ['token'],
+                        postgresql_using='hash',
+                        postgresql_concurrently=True)
+        # Revoke all sessions for a user: user_id = ? AND NOT revoked
+        op.create_index('ix_refresh_tokens_user_active', 'refresh_tokens', ['user_id', 'expires_at'],
+                        postgresql_where=sa.text('revoked = false'),
+                        postgresql_concurrently=True)
+        # Retention purge: expires_at < cutoff OR revoked
+        op.create_index('ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'],
+                        postgresql_concurrently=True)
+
+        # Push fan-out: user_id = ANY(?), and token = ? when pruning invalid tokens
+        op.create_index('ix_fcm_tokens_user_id', 'fcm_tokens', ['user_id'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_fcm_tokens_token', 'fcm_tokens', ['token'],
+                        postgresql_using='hash',
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_fcm_tokens_token', table_name='fcm_tokens', postgresql_concurrently=True)
+        op.drop_index('ix_fcm_tokens_user_id', table_name='fcm_tokens', postgresql_concurrently=True)
+        op.drop_index('ix_refresh_tokens_expires_at', table_name='refresh_tokens', postgresql_concurrently=True)
+        op.drop_index('ix_refresh_tokens_user_active', table_name='refresh_tokens', postgresql_concurrently=True)
+        op.drop_index('ix_refresh_tokens_token', table_name='refresh_tokens', postgresql_concurrently=True)
+        op.drop_index('ix_otp_verifications_expires_at', table_name='otp_verifications', postgresql_concurrently=True)
+        op.drop_index('ix_otp_verifications_user_pending', table_name='otp_verifications', postgresql_concurrently=True)
@@ -0,0 +1,54 @@
+"""Add transaction export jobs
+
+Revision ID: 7b3d5f1e9a62
+Revises: c2e9f4a7b813
+Create Date: 2026-10-18 21:37:52.604118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3d5f1e9a62'
+down_revision: Union[str, Sequence[str], None] = 'c2e9f4a7b813'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('transaction_exports',
+    sa.Column('export_id', sa.UUID(), nullable=False, comment='Unique export ID'),
+    sa.Column('user_id', sa.UUID(), nullable=False, comment='Owner user ID'),
+    sa.Column('format', sa.VARCHAR(length=5), nullable=False, comment='csv, jsonl or xlsx'),
+    sa.Column('since', sa.TIMESTAMP(timezone=True), nullable=True, comment='Earliest occurred_at exported, if limited'),
+    sa.Column('until', sa.TIMESTAMP(timezone=True), nullable=True, comment='Exported transactions occurred before this, if limited'),
+    sa.Column('status', sa.VARCHAR(length=10), server_default='pending', nullable=False, comment='pending, running, done or failed'),
+    sa.Column('attempts', sa.SMALLINT(), server_default='0', nullable=False, comment='Times a worker has claimed the job'),
+    sa.Column('lease_until', sa.TIMESTAMP(timezone=True), nullable=True, comment='A running job may be claimed again after this'),
+    sa.Column('rows', sa.BIGINT(), nullable=True, comment='Transactions written'),
+    sa.Column('size_bytes', sa.BIGINT(), nullable=True, comment='Size of the written file'),
+    sa.Column('error', sa.TEXT(), nullable=True, comment='Why the export failed'),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Creation time'),
+    sa.Column('completed_at', sa.TIMESTAMP(timezone=True), nullable=True, comment='When the job finished or failed'),
+    sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=True, comment='When the file and this row are deleted'),
+    sa.CheckConstraint("format IN ('csv', 'jsonl', 'xlsx')", name='ck_transaction_exports_format'),
+    sa.CheckConstraint("status IN ('pending', 'running', 'done', 'failed')", name='ck_transaction_exports_status'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('export_id')
+    )
+    op.create_index('ix_transaction_exports_user_created', 'transaction_exports', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_transaction_exports_unfinished', 'transaction_exports', ['created_at'], unique=False,
+                    postgresql_where=sa.text("status IN ('pending', 'running')"))
+    op.create_index('ix_transaction_exports_expires', 'transaction_exports', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_transaction_exports_expires', table_name='transaction_exports')
+    op.drop_index('ix_transaction_exports_unfinished', table_name='transaction_exports')
+    op.drop_index('ix_transaction_exports_user_created', table_name='transaction_exports')
+    op.drop_table('transaction_exports')
@@ -0,0 +1,58 @@
+"""Add audit_logs table, range-partitioned by month
+
+Revision ID: 9a41c7e5d203
+Revises: 3f8b2d6e91c4
+Create Date: 2026-10-18 17:25:44.208915
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.db.partitions import month_start, monthly_partition_ddl
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a41c7e5d203'
+down_revision: Union[str, Sequence[str], None] = '3f8b2d6e91c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Monthly partitions created up front; later months are added by the maintenance job
+FIRST_PARTITION = date(2026, 10, 1)
+LAST_PARTITION = date(2027, 12, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('audit_logs',
+    sa.Column('audit_id', sa.UUID(), nullable=False, comment='Unique audit event ID'),
+    sa.Column('occurred_at', sa.TIMESTAMP(timezone=True), nullable=False, comment='When the event happened (partition key)'),
+    sa.Column('user_id', sa.UUID(), nullable=True, comment='User the event concerns, if known'),
+    sa.Column('action', sa.VARCHAR(length=50), nullable=False, comment='What happened (e.g. login, otp_verify)'),
+    sa.Column('outcome', sa.VARCHAR(length=20), nullable=False, comment='success or failure'),
+    sa.Column('ip_address', sa.VARCHAR(length=45), nullable=True, comment='Client IP address'),
+    sa.Column('user_agent', sa.VARCHAR(length=255), nullable=True, comment='Client user agent'),
+    sa.Column('details', postgresql.JSONB(astext_type=sa.Text()), nullable=True, comment='Event-specific context'),
+    sa.PrimaryKeyConstraint('audit_id', 'occurred_at'),
+    postgresql_partition_by='RANGE (occurred_at)'
+    )
+    op.create_index('ix_audit_logs_user_occurred', 'audit_logs', ['user_id', sa.text('occurred_at DESC')])
+    op.create_index('ix_audit_logs_action_occurred', 'audit_logs', ['action', 'occurred_at'])
+
+    month = FIRST_PARTITION
+    while month <= LAST_PARTITION:
+        op.execute(monthly_partition_ddl('audit_logs', month))
+        month = month_start(month, 1)
+    op.execute("CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Dropping the parent drops every partition with it
+    op.drop_index('ix_audit_logs_action_occurred', table_name='audit_logs')
+    op.drop_index('ix_audit_logs_user_occurred', table_name='audit_logs')
+    op.drop_table('audit_logs')
@@ -0,0 +1,42 @@
+"""Store access token revocations
+
+Revision ID: a8f2d6c4e317
+Revises: e4a9c3b7d2f5
+Create Date: 2026-10-18 23:05:44.871203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8f2d6c4e317'
+down_revision: Union[str, Sequence[str], None] = 'e4a9c3b7d2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('revoked_access_tokens',
+    sa.Column('token_hash', sa.LargeBinary(length=32), nullable=False, comment='SHA-256 digest of the access token'),
+    sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=False, comment='When the token expires; the row can go after this'),
+    sa.Column('revoked_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Revocation time'),
+    sa.PrimaryKeyConstraint('token_hash')
+    )
+    op.create_index('ix_revoked_access_tokens_revoked_at', 'revoked_access_tokens', ['revoked_at'], unique=False)
+    op.create_index('ix_revoked_access_tokens_expires_at', 'revoked_access_tokens', ['expires_at'], unique=False)
+    op.add_column('users', sa.Column('tokens_not_before', sa.TIMESTAMP(timezone=True), nullable=True, comment='Access tokens issued before this are rejected (password change, sign out everywhere)'))
+    op.create_index('ix_users_tokens_not_before', 'users', ['tokens_not_before'], unique=False,
+                    postgresql_where=sa.text('tokens_not_before IS NOT NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_tokens_not_before', table_name='users')
+    op.drop_column('users', 'tokens_not_before')
+    op.drop_index('ix_revoked_access_tokens_expires_at', table_name='revoked_access_tokens')
+    op.drop_index('ix_revoked_access_tokens_revoked_at', table_name='revoked_access_tokens')
+    op.drop_table('revoked_access_tokens')
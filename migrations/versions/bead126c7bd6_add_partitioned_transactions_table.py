@@ -0,0 +1,69 @@
+"""Add transactions table, range-partitioned by month
+
+Revision ID: bead126c7bd6
+Revises: c41047e1bcb7
+Create Date: 2026-10-18 12:20:53.114087
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.db.partitions import month_start, monthly_partition_ddl
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bead126c7bd6'
+down_revision: Union[str, Sequence[str], None] = 'c41047e1bcb7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Monthly partitions created up front; later months are added by the maintenance job
+FIRST_PARTITION = date(2024, 1, 1)
+LAST_PARTITION = date(2027, 12, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('transactions',
+    sa.Column('transaction_id', sa.UUID(), nullable=False, comment='Unique transaction ID'),
+    sa.Column('occurred_at', sa.TIMESTAMP(timezone=True), nullable=False, comment='When the transaction happened (partition key)'),
+    sa.Column('user_id', sa.UUID(), nullable=False, comment='Owner user ID'),
+    sa.Column('account_id', sa.UUID(), nullable=True, comment='Bank account, if linked'),
+    sa.Column('amount_minor', sa.BIGINT(), nullable=False, comment='Amount in minor currency units (e.g. paise)'),
+    sa.Column('currency', sa.CHAR(length=3), server_default='INR', nullable=False, comment='ISO 4217 currency code'),
+    sa.Column('direction', sa.VARCHAR(length=6), nullable=False, comment='debit or credit'),
+    sa.Column('category', sa.VARCHAR(length=50), nullable=True, comment='Spending category'),
+    sa.Column('merchant', sa.VARCHAR(length=150), nullable=True, comment='Merchant name'),
+    sa.Column('upi_app', sa.VARCHAR(length=50), nullable=True, comment='UPI app used (e.g., GPay)'),
+    sa.Column('location', sa.VARCHAR(length=150), nullable=True, comment='Where the transaction happened'),
+    sa.Column('description', sa.TEXT(), nullable=True, comment='Free-form note or bank narration'),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Creation time'),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Last update time'),
+    sa.CheckConstraint('amount_minor >= 0', name='ck_transactions_amount_non_negative'),
+    sa.CheckConstraint("direction IN ('debit', 'credit')", name='ck_transactions_direction'),
+    sa.ForeignKeyConstraint(['account_id'], ['bank_accounts.account_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('transaction_id', 'occurred_at'),
+    postgresql_partition_by='RANGE (occurred_at)'
+    )
+    # Indexes on the parent are created on every partition automatically
+    op.create_index('ix_transactions_user_occurred', 'transactions',
+                    ['user_id', sa.text('occurred_at DESC'), sa.text('transaction_id DESC')])
+    op.create_index('ix_transactions_account_occurred', 'transactions', ['account_id', 'occurred_at'])
+
+    month = FIRST_PARTITION
+    while month <= LAST_PARTITION:
+        op.execute(monthly_partition_ddl('transactions', month))
+        month = month_start(month, 1)
+    op.execute("CREATE TABLE IF NOT EXISTS transactions_default PARTITION OF transactions DEFAULT")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Dropping the parent drops every partition with it
+    op.drop_index('ix_transactions_account_occurred', table_name='transactions')
+    op.drop_index('ix_transactions_user_occurred', table_name='transactions')
+    op.drop_table('transactions')
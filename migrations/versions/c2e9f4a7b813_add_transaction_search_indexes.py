@@ -0,0 +1,50 @@
+"""Add trigram and full-text search indexes on transactions
+
+Revision ID: c2e9f4a7b813
+Revises: 5e2c8a7b4d19
+Create Date: 2026-10-18 20:14:08.327415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2e9f4a7b813'
+down_revision: Union[str, Sequence[str], None] = '5e2c8a7b4d19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_VECTOR_SQL = (
+    "to_tsvector('simple', coalesce(merchant, '') || ' ' || coalesce(upi_app, '') || ' ' || "
+    "coalesce(location, '') || ' ' || coalesce(description, ''))"
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Lets user_id (uuid) sit in the same GIN index as the searched column
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    # A stored generated column: Postgres fills it on every insert and update. Adding it
+    # rewrites every partition, so run this in a maintenance window on a large ledger.
+    op.add_column('transactions', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(SEARCH_VECTOR_SQL, persisted=True), nullable=True, comment='Words of merchant, UPI app, location and description, for full-text search'))
+    # Indexes on the parent are created on every partition automatically
+    op.create_index('ix_transactions_user_merchant_trgm', 'transactions', ['user_id', 'merchant'],
+                    postgresql_using='gin', postgresql_ops={'merchant': 'gin_trgm_ops'})
+    op.create_index('ix_transactions_user_location_trgm', 'transactions', ['user_id', 'location'],
+                    postgresql_using='gin', postgresql_ops={'location': 'gin_trgm_ops'})
+    op.create_index('ix_transactions_user_search_vector', 'transactions', ['user_id', 'search_vector'],
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_transactions_user_search_vector', table_name='transactions')
+    op.drop_index('ix_transactions_user_location_trgm', table_name='transactions')
+    op.drop_index('ix_transactions_user_merchant_trgm', table_name='transactions')
+    op.drop_column('transactions', 'search_vector')
+    # The extensions are left installed; other objects may use them
@@ -0,0 +1,43 @@
+"""Store refresh tokens as SHA-256 digests
+
+Revision ID: c41047e1bcb7
+Revises: 782a9af13bb5
+Create Date: 2026-10-18 11:02:17.918324
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41047e1bcb7'
+down_revision: Union[str, Sequence[str], None] = '782a9af13bb5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('refresh_tokens', sa.Column('token_hash', sa.LargeBinary(length=32), nullable=True, comment='SHA-256 digest of the refresh token'))
+    op.execute("UPDATE refresh_tokens SET token_hash = sha256(convert_to(token, 'UTF8'))")
+    op.alter_column('refresh_tokens', 'token_hash', nullable=False)
+    op.create_index('ux_refresh_tokens_token_hash', 'refresh_tokens', ['token_hash'], unique=True)
+    # Incremental rebuild of the in-memory revocation set: revoked AND updated_at > last sync
+    op.create_index('ix_refresh_tokens_revoked_updated_at', 'refresh_tokens', ['updated_at'],
+                    postgresql_where=sa.text('revoked = true'))
+    op.drop_index('ix_refresh_tokens_token', table_name='refresh_tokens')
+    op.drop_column('refresh_tokens', 'token')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Raw tokens cannot be recovered from their digests; old rows keep the hex digest instead
+    op.add_column('refresh_tokens', sa.Column('token', sa.TEXT(), nullable=True, comment='Refresh token string'))
+    op.execute("UPDATE refresh_tokens SET token = encode(token_hash, 'hex')")
+    op.alter_column('refresh_tokens', 'token', nullable=False)
+    op.create_index('ix_refresh_tokens_token', 'refresh_tokens', ['token'], postgresql_using='hash')
+    op.drop_index('ix_refresh_tokens_revoked_updated_at', table_name='refresh_tokens')
+    op.drop_index('ux_refresh_tokens_token_hash', table_name='refresh_tokens')
+    op.drop_column('refresh_tokens', 'token_hash')
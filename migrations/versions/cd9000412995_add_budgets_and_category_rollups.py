@@ -0,0 +1,61 @@
+"""Add budgets and monthly category rollups
+
+Revision ID: cd9000412995
+Revises: 616d1a0bd773
+Create Date: 2026-10-18 13:48:12.405316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cd9000412995'
+down_revision: Union[str, Sequence[str], None] = '616d1a0bd773'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('budgets',
+    sa.Column('budget_id', sa.UUID(), nullable=False, comment='Unique budget ID'),
+    sa.Column('user_id', sa.UUID(), nullable=False, comment='Owner user ID'),
+    sa.Column('category', sa.VARCHAR(length=50), nullable=False, comment='Spending category the budget applies to'),
+    sa.Column('amount_minor', sa.BIGINT(), nullable=False, comment='Monthly limit in minor currency units'),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Creation time'),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Last update time'),
+    sa.CheckConstraint('amount_minor >= 0', name='ck_budgets_amount_non_negative'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('budget_id'),
+    sa.UniqueConstraint('user_id', 'category', name='uq_budgets_user_category')
+    )
+    op.create_table('category_monthly_rollups',
+    sa.Column('user_id', sa.UUID(), nullable=False, comment='Owner user ID'),
+    sa.Column('month', sa.DATE(), nullable=False, comment='First day of the month'),
+    sa.Column('category', sa.VARCHAR(length=50), nullable=False, comment="Spending category ('' when uncategorized)"),
+    sa.Column('debit_minor', sa.BIGINT(), server_default='0', nullable=False, comment='Money out in minor currency units'),
+    sa.Column('credit_minor', sa.BIGINT(), server_default='0', nullable=False, comment='Money in in minor currency units'),
+    sa.Column('txn_count', sa.INTEGER(), server_default='0', nullable=False, comment='Number of transactions'),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False, comment='Last update time'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'month', 'category')
+    )
+    # Backfill from the existing ledger; later writes keep the rollups in step
+    op.execute("""
+        INSERT INTO category_monthly_rollups (user_id, month, category, debit_minor, credit_minor, txn_count)
+        SELECT user_id, date_trunc('month', occurred_at AT TIME ZONE 'UTC')::date, coalesce(category, ''),
+               sum(CASE WHEN direction = 'debit' THEN amount_minor ELSE 0 END),
+               sum(CASE WHEN direction = 'credit' THEN amount_minor ELSE 0 END),
+               count(*)
+        FROM transactions
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('category_monthly_rollups')
+    op.drop_table('budgets')
@@ -0,0 +1,28 @@
+"""Count wrong attempts on stored OTP challenges
+
+Revision ID: e4a9c3b7d2f5
+Revises: 7b3d5f1e9a62
+Create Date: 2026-10-18 22:41:16.208937
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a9c3b7d2f5'
+down_revision: Union[str, Sequence[str], None] = '7b3d5f1e9a62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('otp_verifications', sa.Column('attempts', sa.SMALLINT(), server_default='0', nullable=False, comment='Wrong codes tried against this OTP'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('otp_verifications', 'attempts')